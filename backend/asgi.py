@@ -0,0 +1,88 @@
+"""ASGI entry point. The read-only catalog routes (filter, detail, similar,
+search and the home page lists) run on the event loop against SQLAlchemy's
+asyncio engine; every other request, admin included, goes to the Flask app
+on a thread pool.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+One process can hold thousands of open, slow client connections. Database
+concurrency stays bounded by the pools (DB_POOL_SIZE + DB_MAX_OVERFLOW per
+engine); beyond that, requests wait for a connection rather than a thread.
+"""
+import asyncio
+from a2wsgi import WSGIMiddleware
+from quart import Quart, request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+from app import create_app
+from blueprints.public_async import public_async_bp
+from services.routing import REPLICA_BIND
+from services import taxonomy
+
+
+def _async_engine(url, options):
+    return create_async_engine(make_url(url).set(drivername='postgresql+asyncpg'), **options)
+
+
+def _load_taxonomy(app):
+    with app.app_context():
+        taxonomy.current()
+
+
+def _handles(url_map, scope):
+    # Only reads are served async; anything else falls through to Flask
+    if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+        return False
+    try:
+        url_map.bind('').match(scope['path'], method=scope['method'])
+    except HTTPException:
+        return False
+    return True
+
+
+def create_asgi_app(config=None):
+    flask_app = create_app(config)
+    catalog = Quart(__name__, static_folder=None)
+    catalog.extensions['flask_app'] = flask_app
+    catalog.register_blueprint(public_async_bp)
+
+    @catalog.before_serving
+    async def open_engines():
+        options = flask_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        engines = {None: _async_engine(flask_app.config['SQLALCHEMY_DATABASE_URI'], options)}
+        replica = flask_app.config.get('SQLALCHEMY_BINDS', {}).get(REPLICA_BIND)
+        if replica:
+            engines[REPLICA_BIND] = _async_engine(replica, options)
+        catalog.extensions['async_engines'] = engines
+        # Load the taxonomy snapshot before the first request, off the loop
+        await asyncio.to_thread(_load_taxonomy, flask_app)
+
+    @catalog.after_serving
+    async def close_engines():
+        for engine in catalog.extensions.pop('async_engines', {}).values():
+            await engine.dispose()
+
+    @catalog.after_request
+    async def cors(response):
+        # What flask-cors adds to the Flask side's /api/* responses
+        origin = request.headers.get('Origin')
+        if origin in flask_app.config['CORS_ORIGINS']:
+            response.headers['Access-Control-Allow-Origin'] = origin
+            response.headers['Access-Control-Allow-Credentials'] = 'true'
+            response.headers['Access-Control-Expose-Headers'] = ', '.join(flask_app.config['CORS_EXPOSE_HEADERS'])
+        response.vary.add('Origin')
+        return response
+
+    wsgi = WSGIMiddleware(flask_app, workers=flask_app.config['WSGI_THREADS'])
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan' or _handles(catalog.url_map, scope):
+            await catalog(scope, receive, send)
+        else:
+            await wsgi(scope, receive, send)
+
+    return app
+
+
+app = create_asgi_app()
@@ -0,0 +1,430 @@
+"""Load and latency benchmark for the public and admin API.
+
+    python bench.py run --seed-products 100000 --duration 60 --out before.json
+    python bench.py run --duration 60 --out after.json
+    python bench.py compare before.json after.json
+
+`run` starts the app on a local port (or targets --url), replays a weighted
+traffic mix from --concurrency client threads and prints throughput and
+p50/p95/p99 latency per route. `compare` prints the per-route change between
+two runs and exits non-zero when any route regressed past --threshold.
+
+Give --warmup enough time for lazily built in-process state: the search
+index takes about 20s to build at 100k products.
+
+`flask --app app bench-listing` times the filter listing alone, in process,
+on the columnar index against the SQL-only path.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FACETS = ['price', 'brands', 'in_stock', 'on_sale']
+SORTS = [None, 'price_asc', 'price_desc', 'newest', 'popularity']
+SEARCH_NOISE = ['pro', 'wireless', 'fast', 'usb', 'max', 'mini']
+
+# Scenario weights; each scenario issues one or more requests
+MIX = {
+    'home': 15,
+    'lists': 10,
+    'filter': 25,
+    'search': 15,
+    'detail': 10,
+    'product': 10,
+    'click': 10,
+    'admin': 5,
+}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = False
+
+    def add(self, route, elapsed, ok):
+        if not self.recording:
+            return
+        with self.lock:
+            self.latencies[route].append(elapsed * 1000)
+            if not ok:
+                self.errors[route] += 1
+
+    def summary(self, duration):
+        routes = {}
+        for route in sorted(self.latencies):
+            values = sorted(self.latencies[route])
+            routes[route] = {
+                'count': len(values),
+                'rps': len(values) / duration,
+                'errors': self.errors[route],
+                'mean_ms': sum(values) / len(values),
+                'p50_ms': percentile(values, 50),
+                'p95_ms': percentile(values, 95),
+                'p99_ms': percentile(values, 99),
+            }
+        return routes
+
+
+class Client:
+    """One simulated user: a keep-alive session and its own random stream."""
+
+    def __init__(self, base_url, catalog, recorder, rng, admin, timeout=30):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.catalog = catalog
+        self.recorder = recorder
+        self.rng = rng
+        self.session = requests.Session()
+        self.admin = admin
+        self.csrf = None
+        self.created = []
+
+    def request(self, route, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            response.content
+            ok = response.status_code < 500
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.add(route, time.perf_counter() - started, ok)
+        return response
+
+    # ----------- scenarios -----------
+
+    def home(self):
+        # The home page's lists, plus the navigation bar's taxonomy
+        for path in ('/api/home', '/api/categories', '/api/brands'):
+            self.request(f'GET {path}', 'GET', path)
+
+    def lists(self):
+        # The individual home page lists, still served on their own
+        for path in ('/api/products/newest', '/api/products/bestsellers', '/api/products/sale'):
+            self.request(f'GET {path}', 'GET', path)
+
+    def filter(self):
+        rng = self.rng
+        params = {'limit': rng.choice([12, 24, 48])}
+        if rng.random() < 0.6:
+            params['category_slug'] = rng.choice(self.catalog['categories'])
+        if rng.random() < 0.3:
+            params['brand_slugs'] = ','.join(rng.sample(self.catalog['brands'], rng.randint(1, 3)))
+        if rng.random() < 0.3:
+            low = rng.choice([0, 50, 100, 500])
+            params.update(min_price=low, max_price=low + rng.choice([100, 500, 2000]))
+        if rng.random() < 0.3:
+            params['in_stock'] = 'true'
+        if rng.random() < 0.15:
+            params['is_sale'] = 'true'
+        sort_by = rng.choice(SORTS)
+        if sort_by:
+            params['sort_by'] = sort_by
+        params['facets'] = ','.join(f for f in FACETS if rng.random() < 0.7) or 'none'
+
+        if rng.random() < 0.3:
+            # Keyset walk a few pages deep
+            params['paginate'] = 'cursor'
+            for _ in range(rng.randint(1, 5)):
+                response = self.request('GET /api/products/filter?paginate=cursor', 'GET', '/api/products/filter', params=params)
+                cursor = response is not None and response.ok and response.json()['meta']['next_cursor']
+                if not cursor:
+                    break
+                params['cursor'] = cursor
+        else:
+            # Mostly first pages, sometimes deep ones
+            params['page'] = 1 if rng.random() < 0.7 else rng.choice([2, 5, 20, 100])
+            self.request('GET /api/products/filter', 'GET', '/api/products/filter', params=params)
+
+    def search(self):
+        words = self.rng.sample(self.catalog['terms'], 1)
+        if self.rng.random() < 0.3:
+            words.append(self.rng.choice(SEARCH_NOISE))
+        self.request('GET /api/products/search', 'GET', '/api/products/search', params={'query': ' '.join(words)})
+
+    def detail(self):
+        product_id = self.rng.choice(self.catalog['products'])
+        # What the product page requests
+        self.request('GET /api/products/<id>/bundle', 'GET', f'/api/products/{product_id}/bundle')
+
+    def product(self):
+        # The separate routes the bundle combines
+        product_id = self.rng.choice(self.catalog['products'])
+        self.request('GET /api/products/<id>', 'GET', f'/api/products/{product_id}')
+        self.request('GET /api/products/<id>/similar', 'GET', f'/api/products/{product_id}/similar')
+
+    def click(self):
+        product_id = self.rng.choice(self.catalog['products'])
+        self.request('POST /api/products/<id>/click', 'POST', f'/api/products/{product_id}/click')
+
+    def login(self):
+        user, password = self.admin
+        response = self.session.post(
+            self.base_url + '/api/admin/login', json={'username': user, 'password': password}, timeout=self.timeout
+        )
+        if response.ok:
+            self.csrf = self.session.cookies.get('csrf_access_token')
+        return response.ok
+
+    def admin_write(self):
+        rng = self.rng
+        headers = {'X-CSRF-TOKEN': self.csrf or ''}
+        if self.created and rng.random() < 0.5:
+            product_id = self.created.pop(rng.randrange(len(self.created)))
+            if rng.random() < 0.5:
+                self.request('PUT /api/admin/products/<id>', 'PUT', f'/api/admin/products/{product_id}',
+                             json={'price': rng.randint(10, 2000)}, headers=headers)
+                self.created.append(product_id)
+            else:
+                self.request('DELETE /api/admin/products/<id>', 'DELETE', f'/api/admin/products/{product_id}',
+                             headers=headers)
+        else:
+            response = self.request('POST /api/admin/products', 'POST', '/api/admin/products', json={
+                'title': f'Bench product {rng.randint(0, 10 ** 6)}',
+                'description': 'Created by bench.py',
+                'price': rng.randint(10, 2000),
+                'brand_id': rng.choice(self.catalog['brand_ids']),
+                'images': [],
+            }, headers=headers)
+            if response is not None and response.status_code == 201:
+                self.created.append(response.json()['id'])
+
+    def cleanup(self):
+        for product_id in self.created:
+            try:
+                self.session.delete(f'{self.base_url}/api/admin/products/{product_id}',
+                                    headers={'X-CSRF-TOKEN': self.csrf or ''}, timeout=self.timeout)
+            except requests.RequestException as e:
+                print(f'Could not delete bench product {product_id}: {e}', file=sys.stderr)
+
+    def run(self, until, mix):
+        scenarios = {
+            'home': self.home, 'lists': self.lists, 'filter': self.filter, 'search': self.search,
+            'detail': self.detail, 'product': self.product, 'click': self.click, 'admin': self.admin_write,
+        }
+        names, weights = zip(*mix.items())
+        while time.monotonic() < until:
+            scenarios[self.rng.choices(names, weights)[0]]()
+
+
+def discover(base_url, pages=20):
+    """Sample slugs, product ids and search terms through the public API."""
+    session = requests.Session()
+    categories = [c['slug'] for c in session.get(f'{base_url}/api/categories', timeout=60).json()]
+    brands = session.get(f'{base_url}/api/brands', timeout=60).json()
+    products, terms, cursor = [], set(), None
+    for _ in range(pages):
+        params = {'paginate': 'cursor', 'limit': 100, 'facets': 'none', 'sort_by': 'popularity'}
+        if cursor:
+            params['cursor'] = cursor
+        body = session.get(f'{base_url}/api/products/filter', params=params, timeout=60).json()
+        for p in body['products']:
+            products.append(p['id'])
+            terms.update(w.lower() for w in p['title'].split() if w.isalpha() and len(w) > 2)
+        cursor = body['meta']['next_cursor']
+        if not cursor:
+            break
+    if not (categories and brands and products):
+        raise SystemExit('The catalog is empty; seed it first (--seed-products N)')
+    return {
+        'categories': categories,
+        'brands': [b['slug'] for b in brands],
+        'brand_ids': [b['id'] for b in brands],
+        'products': products,
+        'terms': sorted(terms),
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(env, asgi=False):
+    port = _free_port()
+    if asgi:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--no-access-log']
+    else:
+        code = (
+            'from app import create_app\n'
+            'from werkzeug.serving import run_simple\n'
+            f'run_simple("127.0.0.1", {port}, create_app(), threaded=True)\n'
+        )
+        command = [sys.executable, '-c', code]
+    # The access log goes to a file: an unread pipe fills up and blocks the server
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        if process.poll() is not None:
+            log.seek(0)
+            raise SystemExit(f'Server exited:\n{log.read().decode()}')
+        try:
+            requests.get(base_url + '/api', timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit('Server did not start')
+
+
+def run(args):
+    env = dict(os.environ)
+    if args.database_url:
+        env['DATABASE_URL'] = args.database_url
+    if args.seed_products:
+        subprocess.run([sys.executable, 'seeds.py', '--products', str(args.seed_products), '--seed', str(args.seed),
+                        '--reset', '--admin-password', args.admin_password], cwd=HERE, env=env, check=True)
+
+    process = None
+    base_url = args.url
+    if not base_url:
+        process, base_url = start_server(env, args.asgi)
+    try:
+        catalog = discover(base_url)
+        recorder = Recorder()
+        mix = dict(MIX)
+        clients = [
+            Client(base_url, catalog, recorder, random.Random(args.seed * 1000 + i),
+                   (args.admin_user, args.admin_password), args.timeout)
+            for i in range(args.concurrency)
+        ]
+        if mix['admin'] and not clients[0].login():
+            print('Admin login failed; admin writes are left out of the mix', file=sys.stderr)
+            mix['admin'] = 0
+        for client in clients[1:]:
+            if mix['admin']:
+                client.login()
+
+        until = time.monotonic() + args.warmup + args.duration
+        threads = [threading.Thread(target=c.run, args=(until, mix)) for c in clients]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.warmup)
+        recorder.recording = True
+        started = time.monotonic()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        for client in clients:
+            client.cleanup()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    routes = recorder.summary(elapsed)
+    result = {
+        'config': {
+            'duration': args.duration, 'concurrency': args.concurrency, 'seed': args.seed,
+            'mix': mix, 'products_sampled': len(catalog['products']),
+        },
+        'total_rps': sum(r['count'] for r in routes.values()) / elapsed,
+        'routes': routes,
+    }
+    print_run(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+def print_run(result):
+    print(f"{'route':48} {'count':>7} {'rps':>8} {'err':>5} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, r in result['routes'].items():
+        print(f"{route:48} {r['count']:7d} {r['rps']:8.1f} {r['errors']:5d} "
+              f"{r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f}")
+    print(f"total {result['total_rps']:.1f} req/s (latencies in ms)")
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    def change(before, after):
+        return (after - before) / before * 100 if before else 0.0
+
+    regressions = []
+    print(f"{'route':48} {'p50':>16} {'p95':>16} {'p99':>16} {'rps':>8}")
+    for route in sorted(set(base['routes']) | set(new['routes'])):
+        b, n = base['routes'].get(route), new['routes'].get(route)
+        if not b or not n:
+            print(f"{route:48} {'only in ' + ('new' if n else 'base'):>16}")
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            delta = change(b[key], n[key])
+            cells.append(f'{n[key]:7.1f} {delta:+6.0f}%')
+            # Sub-millisecond moves are noise whatever their percentage, and so
+            # is a tail percentile with only a handful of samples beyond it
+            tail = min(b['count'], n['count']) * (100 - int(key[1:3])) / 100
+            if (key != 'p50_ms' and delta > args.threshold and n[key] - b[key] > args.min_ms
+                    and tail >= args.min_tail):
+                regressions.append(f'{route} {key[:-3]} {b[key]:.1f} -> {n[key]:.1f} ms')
+        if n['errors'] > b['errors']:
+            regressions.append(f"{route} errors {b['errors']} -> {n['errors']}")
+        print(f"{route:48} {cells[0]:>16} {cells[1]:>16} {cells[2]:>16} {change(b['rps'], n['rps']):+7.0f}%")
+    print(f"total rps {base['total_rps']:.1f} -> {new['total_rps']:.1f}")
+    if regressions:
+        print('\nRegressions:')
+        for line in regressions:
+            print(f'  {line}')
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('run', help='run the traffic mix and report latencies')
+    p.add_argument('--url', help='benchmark a running server instead of starting one')
+    p.add_argument('--asgi', action='store_true', help='start the server with uvicorn asgi:app')
+    p.add_argument('--database-url', help='database for the started server (default: DATABASE_URL / config.py)')
+    p.add_argument('--seed-products', type=int, help='reseed the catalog with this many products first')
+    p.add_argument('--duration', type=float, default=30, help='measured seconds')
+    p.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before that')
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--timeout', type=float, default=30, help='per request; slower counts as an error')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--admin-user', default='admin')
+    p.add_argument('--admin-password', default='admin')
+    p.add_argument('--out', help='write the results as JSON')
+    p.set_defaults(func=run)
+
+    p = commands.add_parser('compare', help='compare two JSON results')
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=10, help='allowed p95/p99 increase in percent')
+    p.add_argument('--min-ms', type=float, default=1.0, help='ignore increases smaller than this')
+    p.add_argument('--min-tail', type=int, default=5,
+                   help='judge p95/p99 only with this many samples beyond them (100 for p95, 500 for p99)')
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
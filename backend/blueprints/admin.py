@@ -1,26 +1,32 @@
 from flask import Blueprint, request, jsonify
-import requests
 from models import db, Admin, Category, Brand, Product
-import re
-from unidecode import unidecode
 import datetime
-from flask import current_app, make_response
+from flask import current_app, g, make_response, Response, stream_with_context
+import io
 import jwt
 import secrets
-from flask_jwt_extended import get_jwt_identity, jwt_required, create_access_token, set_access_cookies
-from werkzeug.security import check_password_hash
+from flask_jwt_extended import set_access_cookies
+from sqlalchemy import select, func
+from services.queries import product_listing, fetch_products
+from services.pagination import InvalidCursor, keyset, page_cursors
+from services.streaming import stream_by_key
+from services.signals import notify_product_changed, notify_taxonomy_changed
+from services.text import slugify
+from services.stats import dashboard_summary, recompute_stats
+from services.catalog_io import export_csv, export_ndjson, import_products
+from services.storage import uploader
+from services.images import image_pipeline
+from services.routing import stick_to_primary
+from services.auth import admin_required, login_token, password_checker
+from services.product_updates import (
+    InvalidChange, clean_changes, item_changes, item_values, filter_criteria, expression_values, bulk_update,
+)
 
 admin_bp = Blueprint('api', __name__, url_prefix='/api/admin')
 
-BUNNY_STORAGE_ZONE = 'aidibysmarttech'
-BUNNY_STORAGE_API_KEY = '39a5bd39-84f5-419b-bb47b193a370-faf1-4954'
-BUNNY_STORAGE_ENDPOINT = f'https://storage.bunnycdn.com/{BUNNY_STORAGE_ZONE}'
-
-def slugify(text):
-    text = unidecode(text).lower()
-    text = re.sub(r'[^a-z0-9]+', '-', text)
-    return text.strip('-')
-
+# Admin routes never opt into the replica, and the admin's browser keeps
+# reading from the primary for a moment after each write
+admin_bp.after_request(stick_to_primary)
 
 @admin_bp.route('/login', methods=['POST'])
 def admin_login():
@@ -29,18 +35,18 @@ def admin_login():
     password = data.get('password')
 
     admin = Admin.query.filter_by(username=username).first()
+    # Unknown usernames are checked too, so timing doesn't reveal valid ones
+    valid = password_checker.check(admin.password if admin else None, password or '')
 
-    if not admin or not admin.check_password(password):
-        return jsonify({'error': 'Invalid credentials'}), 401
-    
-    if not check_password_hash(admin.password, password):
-        return jsonify({'error': 'Incorrect password'}), 401
+    if valid is None:
+        response = jsonify({'error': 'Too many login attempts, try again shortly'})
+        response.headers['Retry-After'] = '1'
+        return response, 429
 
+    if not valid:
+        return jsonify({'error': 'Invalid credentials'}), 401
 
-    admin_token = create_access_token(
-        identity=str(admin.id),
-        expires_delta=datetime.timedelta(days=1),
-    )
+    admin_token = login_token(admin, expires_delta=datetime.timedelta(days=1))
 
     response = make_response(jsonify({'message': 'Login successful'}))
 
@@ -56,129 +62,78 @@ def admin_logout():
 
 # Check user auth
 @admin_bp.route('/check-auth', methods=['GET'])
-@jwt_required()
+@admin_required
 def check_auth():
-    admin_id = get_jwt_identity()
-    print(f"Admin ID: {admin_id}")
-    return jsonify({"authenticated": True, "user_id": admin_id}), 200
+    return jsonify({"authenticated": True, "user_id": str(g.admin.id)}), 200
 
 
 @admin_bp.route('/dashboard', methods=['GET'])
-@jwt_required()
+@admin_required
 def dashboard():
-    # Counts
-    total_categories = Category.query.count()
-    total_brands = Brand.query.count()
-    total_products = Product.query.count()
-    total_admins = Admin.query.count()
-
-    # Product stats
-    in_stock = Product.query.filter_by(in_stock=True).count()
-    out_of_stock = Product.query.filter_by(in_stock=False).count()
-    new_products = Product.query.filter_by(is_new=True).count()
-    on_sale = Product.query.filter_by(is_sale=True).count()
-    total_sales = db.session.query(db.func.sum(Product.sales_count)).scalar() or 0
-
-    # Top 5 brands by product count
-    top_brands = (
-        db.session.query(Brand.name, db.func.count(Product.id).label('product_count'))
-        .join(Product, Product.brand_id == Brand.id)
-        .group_by(Brand.id)
-        .order_by(db.desc('product_count'))
-        .limit(5)
-        .all()
-    )
-    top_brands = [{'name': b[0], 'product_count': b[1]} for b in top_brands]
-
-    # Top 5 categories by product count
-    top_categories = (
-        db.session.query(Category.name, db.func.count(Product.id).label('product_count'))
-        .join(Brand, Brand.category_id == Category.id)
-        .join(Product, Product.brand_id == Brand.id)
-        .group_by(Category.id)
-        .order_by(db.desc('product_count'))
-        .limit(5)
-        .all()
-    )
-    top_categories = [{'name': c[0], 'product_count': c[1]} for c in top_categories]
-
-    # Most recent 5 products
-    recent_products = (
-        Product.query.order_by(Product.created_at.desc()).limit(5).all()
-    )
-    recent_products = [
-        {
-            'id': p.id,
-            'title': p.title,
-            'created_at': p.created_at.isoformat(),
-            'brand_id': p.brand_id
-        }
-        for p in recent_products
-    ]
+    # All aggregates come from the incrementally maintained summary tables
+    summary = dashboard_summary()
+    if summary is None:
+        # First load on a fresh database: build the summary once
+        recompute_stats()
+        summary = dashboard_summary()
 
     return jsonify({
         'counts': {
-            'categories': total_categories,
-            'brands': total_brands,
-            'products': total_products,
-            'admins': total_admins
+            'categories': summary['categories'],
+            'brands': summary['brands'],
+            'products': summary['products'],
+            'admins': summary['admins']
         },
         'product_stats': {
-            'in_stock': in_stock,
-            'out_of_stock': out_of_stock,
-            'new': new_products,
-            'on_sale': on_sale,
-            'total_sales': total_sales
+            'in_stock': summary['in_stock'],
+            'out_of_stock': summary['out_of_stock'],
+            'new': summary['new_products'],
+            'on_sale': summary['on_sale'],
+            'total_sales': summary['total_sales']
         },
-        'top_brands': top_brands,
-        'top_categories': top_categories,
-        'recent_products': recent_products
+        'top_brands': summary['top_brands'],
+        'top_categories': summary['top_categories'],
+        'recent_products': summary['recent_products']
     })
 
 # ----------- CATEGORY ROUTES -----------
 
 @admin_bp.route('/categories', methods=['GET'])
 def get_categories():
-    categories = Category.query.all()
-    return jsonify([{'id': c.id, 'name': c.name} for c in categories])
+    try:
+        return stream_by_key(select(Category), Category.id, lambda c: {'id': c.id, 'name': c.name})
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
 
 @admin_bp.route('/categories', methods=['POST'])
-@jwt_required()
+@admin_required
 def add_category():
-    admin_id = get_jwt_identity()
-    admin = Admin.query.get(admin_id)
-    
-    if not admin:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
     data = request.get_json()
     if Category.query.filter_by(name=data['name']).first():
         return jsonify({'error': 'Category already exists'}), 400
     category = Category(name=data['name'], slug=slugify(data['name']))
     db.session.add(category)
     db.session.commit()
+    notify_taxonomy_changed()
     return jsonify({'id': category.id, 'name': category.name}), 201
 
 @admin_bp.route('/categories/<int:id>', methods=['PUT'])
-@jwt_required()
+@admin_required
 def update_category(id):
-    admin_id = get_jwt_identity()
-    admin = Admin.query.get(admin_id)
-
-    if not admin:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
     category = Category.query.get_or_404(id)
     data = request.get_json()
     category.name = data.get('name', category.name)
     db.session.commit()
+    notify_taxonomy_changed()
     return jsonify({'id': category.id, 'name': category.name})
 
 @admin_bp.route('/categories/<int:id>', methods=['DELETE'])
+@admin_required
 def delete_category(id):
     category = Category.query.get_or_404(id)
     db.session.delete(category)
     db.session.commit()
+    notify_taxonomy_changed()
     return jsonify({'message': 'Category deleted'})
 
 
@@ -187,16 +142,18 @@ def delete_category(id):
 @admin_bp.route('/brands', methods=['GET'])
 def get_brands():
     category_id = request.args.get('category_id', type=int)
+    stmt = select(Brand)
     if category_id:
-        brands = Brand.query.filter_by(category_id=category_id).all()
-    else:
-        brands = Brand.query.all()
-    return jsonify([
-        {'id': b.id, 'name': b.name, 'category_id': b.category_id}
-        for b in brands
-    ])
+        stmt = stmt.where(Brand.category_id == category_id)
+    try:
+        return stream_by_key(
+            stmt, Brand.id, lambda b: {'id': b.id, 'name': b.name, 'category_id': b.category_id}
+        )
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
 
 @admin_bp.route('/brands', methods=['POST'])
+@admin_required
 def add_brand():
     data = request.get_json()
     if Brand.query.filter_by(name=data['name']).first():
@@ -204,22 +161,29 @@ def add_brand():
     brand = Brand(name=data['name'], category_id=data['category_id'], slug=slugify(data['name']))
     db.session.add(brand)
     db.session.commit()
+    notify_taxonomy_changed()
     return jsonify({'id': brand.id, 'name': brand.name}), 201
 
 @admin_bp.route('/brands/<int:id>', methods=['PUT'])
+@admin_required
 def update_brand(id):
     brand = Brand.query.get_or_404(id)
     data = request.get_json()
+    moved_from = brand.category_id
     brand.name = data.get('name', brand.name)
     brand.category_id = data.get('category_id', brand.category_id)
     db.session.commit()
+    notify_taxonomy_changed({moved_from, brand.category_id} if brand.category_id != moved_from else ())
     return jsonify({'id': brand.id, 'name': brand.name, 'category_id': brand.category_id})
 
 @admin_bp.route('/brands/<int:id>', methods=['DELETE'])
+@admin_required
 def delete_brand(id):
     brand = Brand.query.get_or_404(id)
+    category_id = brand.category_id
     db.session.delete(brand)
     db.session.commit()
+    notify_taxonomy_changed([category_id])
     return jsonify({'message': 'Brand deleted'})
 
 
@@ -232,37 +196,69 @@ def get_products():
     category_id = request.args.get('category_id', type=int)
     brand_id = request.args.get('brand_id', type=int)
 
-    query = Product.query
-
+    criteria = []
     if category_id:
-        query = query.join(Brand).filter(Brand.category_id == category_id)
-    
+        criteria.append(Brand.category_id == category_id)
+
     if brand_id:
-        query = query.filter(Product.brand_id == brand_id)
-
-    query = query.order_by(Product.created_at.desc())
-
-    paginated = query.paginate(page=page, per_page=per_page, error_out=False)
-
-    products = [{
-        'id': p.id,
-        'title': p.title,
-        'images': p.images,
-        'description': p.description,
-        'price': str(p.price),
-        'original_price': str(p.original_price) if p.original_price else None,
-        'review_count': p.review_count,
-        'in_stock': p.in_stock,
-        'is_new': p.is_new,
-        'is_sale': p.is_sale,
-        'sales_count': p.sales_count,
-        'created_at': p.created_at.isoformat(),
-        'brand_id': p.brand_id,
-        'category_id': p.brand.category_id if p.brand else None
-    } for p in paginated.items]
+        criteria.append(Product.brand_id == brand_id)
+
+    def serialize(p):
+        return {
+            'id': p.id,
+            'title': p.title,
+            'images': p.images,
+            'description': p.description,
+            'price': str(p.price),
+            'original_price': str(p.original_price) if p.original_price else None,
+            'review_count': p.review_count,
+            'in_stock': p.in_stock,
+            'is_new': p.is_new,
+            'is_sale': p.is_sale,
+            'sales_count': p.sales_count,
+            'created_at': p.created_at.isoformat(),
+            'brand_id': p.brand_id,
+            'category_id': p.brand.category_id if p.brand else None
+        }
+
+    # ?paginate=cursor (or any ?cursor=) walks created_at desc, id desc with
+    # keyset pages instead of OFFSET; the total is opt-in via ?include_total=true
+    cursor = request.args.get('cursor')
+    if request.args.get('paginate') == 'cursor' or cursor is not None:
+        try:
+            after, order, backwards = keyset((Product.created_at, Product.id), True, cursor, 'newest')
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+        # The total counts every match, not just those after the cursor
+        count_criteria = list(criteria)
+        if after is not None:
+            criteria.append(after)
+
+        query = product_listing(*criteria, order_by=order, limit=per_page + 1, with_taxonomy=True)
+        items, next_cursor, prev_cursor = page_cursors(
+            fetch_products(query), lambda p: [p.created_at, p.id], 'newest', per_page, cursor, backwards
+        )
+        body = {
+            'products': [serialize(p) for p in items],
+            'per_page': per_page,
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
+        }
+        if request.args.get('include_total', '').lower() == 'true':
+            body['total_items'] = db.session.scalar(
+                select(func.count(Product.id)).join(Product.brand).where(*count_criteria)
+            )
+        return jsonify(body)
+
+    # Brand is joined into the page query so category_id below costs nothing
+    query = product_listing(
+        *criteria, order_by=(Product.created_at.desc(), Product.id.desc()), with_taxonomy=True
+    )
+
+    paginated = db.paginate(query, page=page, per_page=per_page, error_out=False)
 
     return jsonify({
-        'products': products,
+        'products': [serialize(p) for p in paginated.items],
         'page': paginated.page,
         'per_page': paginated.per_page,
         'total_pages': paginated.pages,
@@ -270,6 +266,7 @@ def get_products():
     })
 
 @admin_bp.route('/products', methods=['POST'])
+@admin_required
 def add_product():
     data = request.get_json()
 
@@ -292,37 +289,109 @@ def add_product():
     )
     db.session.add(product)
     db.session.commit()
+    notify_product_changed([product.id])
     return jsonify({'id': product.id, 'title': product.title}), 201
 
 @admin_bp.route('/products/<int:id>', methods=['PUT'])
+@admin_required
 def update_product(id):
     product = Product.query.get_or_404(id)
-    data = request.get_json()
-    
+    try:
+        changes = clean_changes(request.get_json())
+    except InvalidChange as e:
+        return jsonify({'error': str(e)}), 400
+
     # Update fields that are provided in the request
-    for field in ['images', 'title', 'description', 'price', 'original_price', 'review_count',
-                  'in_stock', 'is_new', 'is_sale', 'sales_count', 'brand_id']:
-        if field in data:
-            setattr(product, field, data[field])
-    
+    for field, value in changes.items():
+        setattr(product, field, value)
+
     db.session.commit()
+    notify_product_changed([product.id])
     return jsonify({'id': product.id, 'title': product.title})
 
+@admin_bp.route('/products', methods=['PATCH'])
+@admin_required
+def bulk_update_products():
+    """Change many products in one transaction, either per id:
+
+        {"items": [{"id": 1, "price": 120}, {"id": 2, "in_stock": false}]}
+
+    or everything matching a filter, with values and/or price multipliers:
+
+        {"filter": {"brand_id": 3, "max_price": 500},
+         "set": {"is_sale": true}, "multiply": {"price": 0.9}}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or ('items' in data) == ('filter' in data):
+        return jsonify({'error': 'Send either items or filter'}), 400
+    try:
+        if 'items' in data:
+            by_id = item_changes(data['items'])
+            criteria, values = [Product.id.in_(by_id)], item_values(by_id)
+        else:
+            criteria = filter_criteria(data['filter'])
+            values = expression_values(data.get('set'), data.get('multiply', {}))
+    except InvalidChange as e:
+        return jsonify({'error': str(e)}), 400
+
+    ids = bulk_update(criteria, values)
+    db.session.commit()
+    if ids:
+        notify_product_changed(ids)
+    body = {'updated': len(ids)}
+    if 'items' in data:
+        updated = set(ids)
+        body['missing'] = [i for i in by_id if i not in updated]
+    return jsonify(body)
+
 @admin_bp.route('/products/<int:id>', methods=['DELETE'])
-@jwt_required()
+@admin_required
 def delete_product(id):
-    admin_id = get_jwt_identity()
-    admin = Admin.query.get(admin_id)
-    
-    if not admin:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
     product = Product.query.get_or_404(id)
     db.session.delete(product)
     db.session.commit()
+    notify_product_changed([id], deleted=True)
     return jsonify({'message': 'Product deleted'})
 
+# ----------- BULK IMPORT / EXPORT -----------
+
+BULK_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+@admin_bp.route('/products/export', methods=['GET'])
+@admin_required
+def export_products():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in BULK_FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+    rows = export_csv() if fmt == 'csv' else export_ndjson()
+    response = Response(stream_with_context(rows), mimetype=BULK_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=products.{fmt}'
+    return response
+
+@admin_bp.route('/products/import', methods=['POST'])
+@admin_required
+def import_products_view():
+    # Either a multipart "file" upload or the raw request body
+    upload = request.files.get('file')
+    fmt = request.args.get('format')
+    if fmt is None and upload is not None and upload.filename:
+        fmt = upload.filename.rsplit('.', 1)[-1].lower()
+    if fmt is None:
+        fmt = 'ndjson' if 'ndjson' in (request.content_type or '') else 'csv'
+    if fmt not in BULK_FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+    stream = upload.stream if upload is not None else io.BufferedReader(request.stream)
+    report = import_products(stream, fmt)
+
+    # COPY/upserts bypass the ORM flush hooks; reconcile the dashboard once
+    if report.inserted or report.updated:
+        recompute_stats()
+    return jsonify(report.as_dict())
+
 @admin_bp.route('/upload', methods=['POST'])
+@admin_required
 def upload_to_bunny():
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -333,20 +402,29 @@ def upload_to_bunny():
     if not filename:
         return jsonify({'error': 'No selected file'}), 400
 
-    # Upload to BunnyCDN
-    upload_url = f"{BUNNY_STORAGE_ENDPOINT}/{filename}"
-
-    response = requests.put(
-        upload_url,
-        data=file.stream,
-        headers={
-            'AccessKey': BUNNY_STORAGE_API_KEY,
-            'Content-Type': 'application/octet-stream'
-        }
-    )
-
-    if response.status_code == 201:
-        file_url = f"https://{BUNNY_STORAGE_ZONE}.b-cdn.net/{filename}"
-        return jsonify({'message': 'File uploaded successfully', 'url': file_url}), 201
+    results = uploader.upload_many([file])
+    image_pipeline.process_uploads([file], results)
+    result, = results
+    if 'url' in result:
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'url': result['url'],
+        }), 201
     else:
-        return jsonify({'error': 'Upload failed', 'details': response.text}), response.status_code
\ No newline at end of file
+        return jsonify({'error': 'Upload failed', 'details': result['error']}), result['status']
+
+@admin_bp.route('/upload/batch', methods=['POST'])
+@admin_required
+def upload_batch():
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files'}), 400
+    if len(files) > current_app.config.get('UPLOAD_MAX_FILES', 20):
+        return jsonify({'error': 'Too many files'}), 400
+
+    results = uploader.upload_many(files)
+    image_pipeline.process_uploads(files, results)
+    failed = sum('error' in r for r in results)
+    # 207 when only some of the files made it
+    status = 201 if not failed else 207 if failed < len(results) else 502
+    return jsonify({'results': results, 'uploaded': len(results) - failed, 'failed': failed}), status
\ No newline at end of file
@@ -0,0 +1,494 @@
+import hashlib
+from collections import namedtuple
+from flask import Blueprint, abort, current_app, request, jsonify
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import array
+from models import Category, Brand, Product, db
+from services.facets import filtered_listing, parse_facets
+from services.queries import product_listing, fetch_products
+from services.pagination import InvalidCursor
+from services.streaming import stream_by_key, stream_rows, streamed, offset_cursor, decode_offset_cursor
+from services.search import search_index
+from services.counters import click_counter
+from services.images import listing_image, placeholder
+from services.cache import response_cache
+from services.conditional import conditional
+from services.routing import use_replica
+from services.signals import product_changed, taxonomy_changed, clicks_flushed
+from services.snapshots import Snapshot
+from services import similarity, taxonomy
+
+public_bp = Blueprint('public', __name__, url_prefix='/api')
+
+
+@public_bp.before_request
+def route_reads():
+    # Catalog reads may come from the replica; clicks write (in batches)
+    # through the primary
+    if request.method == 'GET':
+        use_replica()
+
+
+@public_bp.route('')
+def index():
+    return "Welcome to the API"
+
+# Taxonomy lists come back whole for any realistic catalog; the cap only
+# bounds a pathological one. Larger lists continue with ?cursor=
+TAXONOMY_PAGE_SIZE = 500
+
+# Get all categories
+@public_bp.route('/categories')
+@conditional('taxonomy')
+@response_cache.cached('taxonomy')
+def get_categories():
+    try:
+        return stream_by_key(select(Category), Category.id, serialize_category, default_limit=TAXONOMY_PAGE_SIZE)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+
+def serialize_category(c):
+    return {
+        'id': c.id,
+        'name': c.name,
+        'slug': c.slug
+    }
+
+# Get all brands
+@public_bp.route('/brands')
+@conditional('taxonomy')
+@response_cache.cached('taxonomy')
+def get_brands():
+    try:
+        return stream_by_key(select(Brand), Brand.id, serialize_brand, default_limit=TAXONOMY_PAGE_SIZE)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+
+def serialize_brand(b):
+    return {
+        'id': b.id,
+        'name': b.name,
+        'slug': b.slug,
+        'category_id': b.category_id
+    }
+
+def serialize_product(p):
+    return {
+        'id': p.id,
+        'title': p.title,
+        # Listing-sized derivatives, falling back to the originals
+        'images': [listing_image(url, p.image_variants) for url in p.images] if p.images is not None else None,
+        'placeholder': placeholder(p.images[0], p.image_variants) if p.images else None,
+        'description': p.description,
+        'price': int(p.price),
+        'original_price': int(p.original_price) if p.original_price is not None else None,
+        'review_count': p.review_count,
+        'in_stock': p.in_stock,
+        'is_new': p.is_new,
+        'is_sale': p.is_sale,
+        'sales_count': p.sales_count,
+        'created_at': p.created_at.isoformat(),
+        'brand_id': p.brand_id
+    }
+
+# Home page lists; the statements are shared with the async read path
+def newest_listing():
+    return product_listing(order_by=(Product.created_at.desc(),), limit=3)
+
+def bestseller_listing():
+    return product_listing(order_by=(Product.sales_count.desc(),), limit=3)
+
+def sale_listing(limit):
+    return product_listing(Product.is_sale == True, limit=limit)
+
+@public_bp.route('/products/newest')
+@conditional('product', 'sales')
+@response_cache.cached('product', 'sales')
+def get_newest_products():
+    products = fetch_products(newest_listing())
+    return jsonify([serialize_product(p) for p in products])
+
+@public_bp.route('/products/bestsellers')
+@conditional('product', 'sales')
+@response_cache.cached('product', 'sales')
+def get_best_sellers():
+    products = fetch_products(bestseller_listing())
+    return jsonify([serialize_product(p) for p in products])
+
+@public_bp.route('/products/sale')
+@conditional('product', 'sales')
+@response_cache.cached('product', 'sales')
+def get_on_sale_products():
+    limit = request.args.get('limit', default=6, type=int)
+    products = fetch_products(sale_listing(limit))
+    return jsonify([serialize_product(p) for p in products])
+
+# Everything the home page shows, encoded once per catalog change rather
+# than once per visitor
+HOME_SALE_LIMIT = 6
+
+HomePage = namedtuple('HomePage', 'body etag')
+
+def build_home():
+    payload = {
+        'newest': [serialize_product(p) for p in fetch_products(newest_listing())],
+        'bestsellers': [serialize_product(p) for p in fetch_products(bestseller_listing())],
+        'sale': [serialize_product(p) for p in fetch_products(sale_listing(HOME_SALE_LIMIT))],
+        'categories': [serialize_category(c) for c in taxonomy.current().categories.values()],
+        'brands': [serialize_brand(b) for b in taxonomy.current().brands.values()],
+    }
+    body = (current_app.json.dumps(payload, separators=(',', ':')) + '\n').encode()
+    return HomePage(body, hashlib.sha1(body).hexdigest())
+
+home_snapshot = Snapshot('home', build_home, (product_changed, taxonomy_changed, clicks_flushed))
+
+@public_bp.record_once
+def init_home_snapshot(state):
+    home_snapshot.init_app(state.app, state.app.config.get('HOME_SNAPSHOT_MAX_AGE'))
+
+@public_bp.route('/home')
+def get_home():
+    page = home_snapshot.get()
+    response = current_app.response_class(page.body, mimetype='application/json')
+    response.set_etag(page.etag)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response.make_conditional(request)
+
+@public_bp.route('/products/<int:product_id>/click', methods=['POST'])
+def increment_click(product_id):
+    # Clicks are buffered and flushed in batches by the click counter, so this
+    # only reads the stored count; no row lock, no transaction per click.
+    row = db.session.execute(
+        select(Product.sales_count).where(Product.id == product_id)
+    ).first()
+    if row is None:
+        abort(404)
+    pending = click_counter.record(product_id)
+    return jsonify({'message': 'Click recorded', 'sales_count': (row.sales_count or 0) + pending})
+
+@public_bp.route('/products/<int:product_id>/clicks', methods=['GET'])
+def get_click_count(product_id):
+    row = db.session.execute(
+        select(Product.sales_count).where(Product.id == product_id)
+    ).first()
+    if row is None:
+        abort(404)
+    return jsonify({
+        'product_id': product_id,
+        'sales_count': (row.sales_count or 0) + click_counter.pending(product_id),
+    })
+
+
+# @public_bp.route('/products', methods=['GET'])
+# def get_products():
+#     category_slug = request.args.get('category')
+#     brand_slug = request.args.get('brand')
+
+#     query = Product.query
+
+#     # Filter by brand
+#     if brand_slug:
+#         brand = Brand.query.filter_by(slug=brand_slug).first()
+#         if not brand:
+#             return jsonify({'error': 'Brand not found'}), 404
+#         query = query.filter(Product.brand_id == brand.id)
+
+#     # Filter by category (through brand)
+#     elif category_slug:
+#         category = Category.query.filter_by(slug=category_slug).first()
+#         if not category:
+#             return jsonify({'error': 'Category not found'}), 404
+#         query = query.join(Product.brand).filter(Brand.category_id == category.id)
+
+#     products = query.all()
+
+#     return jsonify([
+#         {
+#             'id': p.id,
+#             'title': p.title,
+#             'images': p.images,
+#             'description': p.description,
+#             'price': str(p.price),
+#             'original_price': str(p.original_price),
+#             'review_count': p.review_count,
+#             'in_stock': p.in_stock,
+#             'is_new': p.is_new,
+#             'is_sale': p.is_sale,
+#             'sales_count': p.sales_count,
+#             'created_at': p.created_at.isoformat(),
+#             'brand_id': p.brand_id
+#         } for p in products
+#     ])
+
+MINIFILTER_PAGE_SIZE = 100
+MINIFILTER_MAX_PAGE_SIZE = 500
+
+@public_bp.route('/products/minifilter')
+@conditional('product', 'sales')
+def filter_products():
+    brand_id = request.args.get('brand_id')
+    try:
+        return stream_by_key(
+            product_listing(Product.brand_id == brand_id), Product.id, serialize_product,
+            default_limit=MINIFILTER_PAGE_SIZE, maximum=MINIFILTER_MAX_PAGE_SIZE,
+        )
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+
+def filter_params(args):
+    """filtered_listing keyword arguments from the filter endpoint's query string."""
+    brand_slugs = args.get('brand_slugs')
+    # ?paginate=cursor (or any ?cursor=) switches to keyset pages; the exact
+    # total and the facets are then only computed when asked for, with
+    # ?include_total=true and ?facets=...
+    cursor = args.get('cursor')
+    keyset_mode = args.get('paginate') == 'cursor' or cursor is not None
+    facets = args.get('facets')
+    return {
+        'filters': {
+            'category_slug': args.get('category_slug'),
+            'brand_slugs': brand_slugs.split(',') if brand_slugs else None,
+            'min_price': args.get('min_price', type=float),
+            'max_price': args.get('max_price', type=float),
+            'in_stock': args.get('in_stock', type=lambda v: v.lower() == 'true'),
+            'is_sale': args.get('is_sale', type=lambda v: v.lower() == 'true'),
+        },
+        'sort_by': args.get('sort_by'),
+        'page': args.get('page', default=1, type=int),
+        'limit': args.get('limit', default=12, type=int),
+        'facets': parse_facets(facets) if facets is not None or not keyset_mode else set(),
+        'keyset_mode': keyset_mode,
+        'cursor': cursor,
+        'with_total': bool(args.get('include_total', type=lambda v: v.lower() == 'true')),
+    }
+
+def filter_payload(result, params):
+    min_possible_price, max_possible_price = result['min_price'], result['max_price']
+    total_count = result['total']
+    page, limit = params['page'], params['limit']
+
+    product_list = [
+        {
+            'id': p['id'],
+            'title': p['title'],
+            'image': listing_image(p['images'][0], p['image_variants']) if p['images'] else None,
+            'placeholder': placeholder(p['images'][0], p['image_variants']) if p['images'] else None,
+            'description': p['description'],
+            'price': float(p['price']),
+            'originalPrice': float(p['original_price']) if p['original_price'] else None,
+            'reviewCount': p['review_count'],
+            'category': p['category_name'],
+            'brand': p['brand_name'],
+            'inStock': p['in_stock'],
+            'isNew': p['is_new'],
+            'isSale': p['is_sale'],
+        } for p in result['products']
+    ]
+
+    if params['keyset_mode']:
+        meta = {
+            'limit': limit,
+            'next_cursor': result['next_cursor'],
+            'prev_cursor': result['prev_cursor'],
+        }
+        if total_count is not None:
+            meta.update(
+                min_price=float(min_possible_price) if min_possible_price else 0,
+                max_price=float(max_possible_price) if max_possible_price else 1000,
+                total=total_count,
+            )
+        return {'products': product_list, 'facets': result['facets'], 'meta': meta}
+
+    return {
+        'products': product_list,
+        'facets': result['facets'],
+        'meta': {
+            'min_price': float(min_possible_price) if min_possible_price else 0,
+            'max_price': float(max_possible_price) if max_possible_price else 1000,
+            'total': total_count,
+            'page': page,
+            'limit': limit,
+            'total_pages': (total_count + limit - 1) // limit
+        }
+    }
+
+@public_bp.route('/products/filter', methods=['GET'])
+@conditional('product', 'taxonomy', 'sales')
+def get_filtered_products():
+    params = filter_params(request.args)
+    try:
+        result = filtered_listing(**params)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(filter_payload(result, params))
+
+
+@public_bp.route('/products/<int:product_id>', methods=['GET'])
+@conditional('product', 'taxonomy', 'sales')
+@response_cache.cached('product', 'taxonomy', 'sales')
+def get_product_detail(product_id):
+    rows = with_taxonomy(fetch_products(product_listing(Product.id == product_id)))
+    if not rows:
+        abort(404)
+    return jsonify(serialize_product_detail(*rows[0]))
+
+def with_taxonomy(products):
+    # (product, brand, category) rows, the taxonomy coming from the snapshot
+    tax = taxonomy.current()
+    rows = []
+    for product in products:
+        brand = tax.brand(product.brand_id)
+        rows.append((product, brand, tax.category_of(brand)))
+    return rows
+
+def serialize_product_detail(product, brand, category):
+    return {
+        'id': product.id,
+        'title': product.title,
+        'images': product.images,
+        'imageVariants': product.image_variants,
+        'description': product.description,
+        'price': float(product.price),
+        'originalPrice': float(product.original_price) if product.original_price else None,
+        'reviewCount': product.review_count,
+        'inStock': product.in_stock,
+        'isNew': product.is_new,
+        'isSale': product.is_sale,
+        'salesCount': product.sales_count,
+        'createdAt': product.created_at.isoformat() if product.created_at else None,
+        'brand': {
+            'id': brand.id,
+            'name': brand.name,
+            'slug': brand.slug,
+            'category_id': brand.category_id
+        } if brand else None,
+        'category': {
+            'id': category.id,
+            'name': category.name,
+            'slug': category.slug
+        } if category else None
+    }
+
+# Search products by title, description, brand and category
+SEARCH_MAX_LIMIT = 50
+
+def search_params(args):
+    """(query, offset, limit) for the search endpoint; raises InvalidCursor."""
+    page = max(args.get('page', default=1, type=int), 1)
+    limit = min(max(args.get('limit', default=20, type=int), 1), SEARCH_MAX_LIMIT)
+    cursor = args.get('cursor')
+    offset = decode_offset_cursor(cursor) if cursor else (page - 1) * limit
+    return args.get('query', ''), offset, limit
+
+def ranked_listing(ids):
+    # Products in the order of ids
+    return product_listing(Product.id.in_(ids), order_by=(func.array_position(array(ids), Product.id),))
+
+@public_bp.route('/products/search', methods=['GET'])
+@conditional('product', 'taxonomy', 'sales')
+def search_products():
+    if not request.args.get('query'):
+        return jsonify([])
+    try:
+        query, offset, limit = search_params(request.args)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+
+    total, ids = search_index.search(query, offset=offset, limit=limit)
+    next_cursor = offset_cursor(offset + len(ids)) if offset + len(ids) < total else None
+
+    # Hydrate in rank order straight from the cursor
+    rows = stream_rows(ranked_listing(ids)) if ids else []
+    response = streamed(rows, serialize_product, next_cursor)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+# Fallbacks while a product has no precomputed neighbours
+def same_brand_listing(product_id, brand_id):
+    return product_listing(Product.brand_id == brand_id, Product.id != product_id, limit=4)
+
+def same_category_listing(product_id, category_id, exclude_ids, limit):
+    return product_listing(
+        Product.brand_id.in_(taxonomy.current().category_brands.get(category_id, ())),
+        Product.id != product_id,
+        Product.id.notin_(exclude_ids),
+        limit=limit,
+    )
+
+@public_bp.route('/products/<int:product_id>/similar', methods=['GET'])
+@conditional('product', 'taxonomy', 'sales')
+def get_similar_products(product_id):
+    # One indexed lookup into the precomputed neighbours
+    products = similarity.similar_products(product_id, limit=4)
+    if products is None:
+        product = Product.query.get_or_404(product_id)
+        products = fallback_similar(product.id, taxonomy.current().brand(product.brand_id))
+    return jsonify([serialize_product(p) for p in products])
+
+def fallback_similar(product_id, brand):
+    """While a product has no precomputed neighbours (new product, index
+    not built): same brand first, then the rest of its category."""
+    if brand is None:
+        return []
+    products = fetch_products(same_brand_listing(product_id, brand.id))
+    if len(products) < 4:
+        products += fetch_products(same_category_listing(
+            product_id, brand.category_id, [p.id for p in products], 4 - len(products),
+        ))
+    return products
+
+
+# Product page in one request: detail, brand, category and similar products
+def bundle_payload(product, brand, category, similar):
+    return {
+        'product': serialize_product_detail(product, brand, category),
+        'similar': [serialize_product(p) for p in similar],
+    }
+
+@public_bp.route('/products/<int:product_id>/bundle', methods=['GET'])
+@conditional('product', 'taxonomy', 'sales')
+@response_cache.cached('product', 'taxonomy', 'sales')
+def get_product_bundle(product_id):
+    rows = with_taxonomy(fetch_products(product_listing(Product.id == product_id)))
+    if not rows:
+        abort(404)
+    product, brand, category = rows[0]
+    similar = similarity.similar_products(product_id, limit=4)
+    if similar is None:
+        similar = fallback_similar(product_id, brand)
+    return jsonify(bundle_payload(product, brand, category, similar))
+
+# Batch form for cart and wishlist views: ?ids=1,2,3
+BUNDLE_MAX_IDS = 100
+
+def bundle_ids(args):
+    """Requested ids in order, without duplicates; raises ValueError."""
+    try:
+        ids = [int(i) for i in args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        raise ValueError('ids must be a comma separated list of product ids')
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise ValueError('ids is required')
+    if len(ids) > BUNDLE_MAX_IDS:
+        raise ValueError(f'At most {BUNDLE_MAX_IDS} ids per request')
+    return ids
+
+def batch_payload(ids, rows):
+    # Request order; ids that no longer exist are listed so a cart can drop them
+    found = {product.id: serialize_product_detail(product, brand, category) for product, brand, category in rows}
+    return {
+        'products': [found[i] for i in ids if i in found],
+        'missing': [i for i in ids if i not in found],
+    }
+
+@public_bp.route('/products/bundle', methods=['GET'])
+@conditional('product', 'taxonomy', 'sales')
+@response_cache.cached('product', 'taxonomy', 'sales')
+def get_product_bundles():
+    try:
+        ids = bundle_ids(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    rows = with_taxonomy(fetch_products(product_listing(Product.id.in_(ids))))
+    return jsonify(batch_payload(ids, rows))
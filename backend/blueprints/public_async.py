@@ -0,0 +1,233 @@
+import asyncio
+from functools import wraps
+from quart import Blueprint, Response, abort, current_app, g, request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from werkzeug.exceptions import HTTPException
+from models import Product
+from services.cache import response_cache
+from services.conditional import validators, not_modified
+from services.facets import listing_statement
+from services.metrics import metrics
+from services.pagination import InvalidCursor
+from services.routing import REPLICA_BIND, replica_allowed
+from services.search import search_index
+from services.streaming import NDJSON, json_lines, offset_cursor, wants_ndjson
+from services.queries import product_listing
+from services import similarity, taxonomy
+from blueprints.public import (
+    serialize_product, serialize_product_detail, newest_listing, bestseller_listing, sale_listing,
+    filter_params, filter_payload, search_params, ranked_listing, same_brand_listing, same_category_listing,
+    with_taxonomy, bundle_payload, bundle_ids, batch_payload,
+)
+
+# Async twins of the read-only catalog routes in blueprints/public.py,
+# served by asgi.py. Statements, parameters and payloads are shared with
+# the sync views, so both modes answer alike and share cache entries.
+public_async_bp = Blueprint('public_async', __name__, url_prefix='/api')
+
+
+def flask_app():
+    return current_app.extensions['flask_app']
+
+
+def _session():
+    # Replica or primary, chosen once per request like RoutingSession does
+    if 'engine' not in g:
+        engines = current_app.extensions['async_engines']
+        use_replica = REPLICA_BIND in engines and replica_allowed(request.cookies)
+        g.engine = engines[REPLICA_BIND if use_replica else None]
+    return AsyncSession(g.engine)
+
+
+def _json(payload, status=200):
+    # The same bytes jsonify() would produce
+    body = flask_app().json.dumps(payload, separators=(',', ':')) + '\n'
+    return Response(body, status=status, mimetype='application/json')
+
+
+async def _respond(view, kwargs, scopes, cache):
+    etag, last_modified = validators(scopes, request.full_path)
+    if not_modified(request, etag, last_modified):
+        response = Response('', status=304)
+    else:
+        key = response_cache.key(scopes, request.full_path) if cache and response_cache.enabled else None
+        response = response_cache.load(key, Response) if key else None
+        if response is not None:
+            response.headers['X-Cache'] = 'HIT'
+        else:
+            response = await view(**kwargs)
+            if response.status_code != 200:
+                return response
+            if key:
+                response_cache.store(key, response, await response.get_data())
+                response.headers['X-Cache'] = 'MISS'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+def read_view(*scopes, cache=False):
+    """The async counterpart of @conditional(*scopes), plus
+    @response_cache.cached(*scopes) when cache is set. Runs the view inside
+    the Flask app's context (config, JSON provider, metrics)."""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(**kwargs):
+            with flask_app().app_context():
+                timings = metrics.begin(request.url_rule.rule) if metrics.enabled else None
+                try:
+                    response = await _respond(view, kwargs, scopes, cache)
+                except HTTPException as e:
+                    if timings is not None:
+                        metrics.record(timings, request.method, e.code)
+                    raise
+                if timings is not None:
+                    response.headers['Server-Timing'] = timings.server_timing()
+                    metrics.record(timings, request.method, response.status_code)
+                return response
+        return wrapper
+    return decorator
+
+
+@public_async_bp.route('/products/newest')
+@read_view('product', 'sales', cache=True)
+async def get_newest_products():
+    async with _session() as session:
+        products = (await session.execute(newest_listing())).scalars().all()
+    return _json([serialize_product(p) for p in products])
+
+
+@public_async_bp.route('/products/bestsellers')
+@read_view('product', 'sales', cache=True)
+async def get_best_sellers():
+    async with _session() as session:
+        products = (await session.execute(bestseller_listing())).scalars().all()
+    return _json([serialize_product(p) for p in products])
+
+
+@public_async_bp.route('/products/sale')
+@read_view('product', 'sales', cache=True)
+async def get_on_sale_products():
+    limit = request.args.get('limit', default=6, type=int)
+    async with _session() as session:
+        products = (await session.execute(sale_listing(limit))).scalars().all()
+    return _json([serialize_product(p) for p in products])
+
+
+def _listing_statement(app, params):
+    with app.app_context():
+        return listing_statement(**params)
+
+
+@public_async_bp.route('/products/filter')
+@read_view('product', 'taxonomy', 'sales')
+async def get_filtered_products():
+    params = filter_params(request.args)
+    try:
+        # Off the loop: with the columnar index built this is where the work is
+        stmt, shape = await asyncio.to_thread(_listing_statement, flask_app(), params)
+        async with _session() as session:
+            rows = (await session.execute(stmt)).mappings().all()
+        result = shape(rows)
+    except InvalidCursor as e:
+        return _json({'error': str(e)}, 400)
+    return _json(filter_payload(result, params))
+
+
+@public_async_bp.route('/products/<int:product_id>')
+@read_view('product', 'taxonomy', 'sales', cache=True)
+async def get_product_detail(product_id):
+    async with _session() as session:
+        products = (await session.execute(product_listing(Product.id == product_id))).scalars().all()
+    rows = with_taxonomy(products)
+    if not rows:
+        abort(404)
+    return _json(serialize_product_detail(*rows[0]))
+
+
+def _search(app, query, offset, limit):
+    # CPU bound, and may build the index through the sync session first
+    with app.app_context():
+        return search_index.search(query, offset=offset, limit=limit)
+
+
+@public_async_bp.route('/products/search')
+@read_view('product', 'taxonomy', 'sales')
+async def search_products():
+    if not request.args.get('query'):
+        return _json([])
+    try:
+        query, offset, limit = search_params(request.args)
+    except InvalidCursor as e:
+        return _json({'error': str(e)}, 400)
+
+    total, ids = await asyncio.to_thread(_search, flask_app(), query, offset, limit)
+    products = []
+    if ids:
+        async with _session() as session:
+            products = (await session.execute(ranked_listing(ids))).scalars().all()
+
+    # Pages are small (SEARCH_MAX_LIMIT), so encode in one go
+    ndjson = wants_ndjson(request)
+    response = Response(''.join(json_lines(products, serialize_product, ndjson)),
+                        mimetype=NDJSON if ndjson else 'application/json')
+    if offset + len(ids) < total:
+        response.headers['X-Next-Cursor'] = offset_cursor(offset + len(ids))
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+
+async def _fallback_similar(session, product_id, brand):
+    # Same brand, then same category; see public.fallback_similar
+    if brand is None:
+        return []
+    products = (await session.execute(same_brand_listing(product_id, brand.id))).scalars().all()
+    if len(products) < 4:
+        products += (await session.execute(same_category_listing(
+            product_id, brand.category_id, [p.id for p in products], 4 - len(products),
+        ))).scalars().all()
+    return products
+
+
+@public_async_bp.route('/products/<int:product_id>/similar')
+@read_view('product', 'taxonomy', 'sales')
+async def get_similar_products(product_id):
+    async with _session() as session:
+        products = (await session.execute(similarity.neighbour_listing(product_id, 4))).scalars().all()
+        if not products:
+            # Not indexed yet
+            brand_id = (await session.execute(
+                select(Product.brand_id).where(Product.id == product_id)
+            )).scalar()
+            if brand_id is None:
+                abort(404)
+            products = await _fallback_similar(session, product_id, taxonomy.current().brand(brand_id))
+    return _json([serialize_product(p) for p in products])
+
+
+@public_async_bp.route('/products/<int:product_id>/bundle')
+@read_view('product', 'taxonomy', 'sales', cache=True)
+async def get_product_bundle(product_id):
+    async with _session() as session:
+        rows = with_taxonomy((await session.execute(product_listing(Product.id == product_id))).scalars().all())
+        if not rows:
+            abort(404)
+        product, brand, category = rows[0]
+        similar = (await session.execute(similarity.neighbour_listing(product_id, 4))).scalars().all()
+        if not similar:
+            similar = await _fallback_similar(session, product_id, brand)
+    return _json(bundle_payload(product, brand, category, similar))
+
+
+@public_async_bp.route('/products/bundle')
+@read_view('product', 'taxonomy', 'sales', cache=True)
+async def get_product_bundles():
+    try:
+        ids = bundle_ids(request.args)
+    except ValueError as e:
+        return _json({'error': str(e)}, 400)
+    async with _session() as session:
+        products = (await session.execute(product_listing(Product.id.in_(ids)))).scalars().all()
+    return _json(batch_payload(ids, with_taxonomy(products)))
@@ -0,0 +1,3 @@
+-- Natural key for bulk import upserts
+ALTER TABLE products ADD COLUMN IF NOT EXISTS sku VARCHAR(64);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_products_sku ON products (sku);
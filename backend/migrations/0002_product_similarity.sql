@@ -0,0 +1,9 @@
+-- Precomputed similar products, see services/similarity.py
+CREATE TABLE IF NOT EXISTS product_similarity (
+    product_id INTEGER NOT NULL REFERENCES products (id) ON DELETE CASCADE,
+    rank SMALLINT NOT NULL,
+    similar_id INTEGER NOT NULL,
+    score DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (product_id, rank)
+);
+CREATE INDEX IF NOT EXISTS ix_product_similarity_similar_id ON product_similarity (similar_id);
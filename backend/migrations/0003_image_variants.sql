@@ -0,0 +1,7 @@
+-- Resized image derivatives, see services/images.py
+ALTER TABLE products ADD COLUMN IF NOT EXISTS image_variants JSONB;
+CREATE TABLE IF NOT EXISTS image_manifests (
+    url TEXT PRIMARY KEY,
+    manifest JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
@@ -0,0 +1,23 @@
+-- Indexes for the catalog read paths. Check plans against a large catalog
+-- with `flask --app app check-plans` after changing any of them.
+
+-- Brand joins and category-scoped listings
+CREATE INDEX IF NOT EXISTS ix_brands_category_id ON brands (category_id);
+
+-- minifilter and the similar products fallback: one brand, in id order
+CREATE INDEX IF NOT EXISTS ix_products_brand_id_id ON products (brand_id, id);
+
+-- Admin product list filtered by brand, newest first (offset and cursor pages)
+CREATE INDEX IF NOT EXISTS ix_products_brand_id_created_at ON products (brand_id, created_at DESC, id DESC);
+
+-- "newest" listings and sort, admin product list
+CREATE INDEX IF NOT EXISTS ix_products_created_at_id ON products (created_at DESC, id DESC);
+
+-- Bestsellers and the "popularity" sort
+CREATE INDEX IF NOT EXISTS ix_products_sales_count_id ON products (sales_count DESC, id DESC);
+
+-- Price sorts in both directions, price range filters
+CREATE INDEX IF NOT EXISTS ix_products_price_id ON products (price, id);
+
+-- The sale strip only ever reads the (few) products on sale
+CREATE INDEX IF NOT EXISTS ix_products_on_sale ON products (id) WHERE is_sale;
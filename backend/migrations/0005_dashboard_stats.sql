@@ -0,0 +1,55 @@
+-- Dashboard summary tables, see services/stats.py. Filled here from the
+-- base tables; `flask recompute-stats` rebuilds them the same way.
+CREATE TABLE IF NOT EXISTS catalog_stats (
+    id INTEGER PRIMARY KEY,
+    categories INTEGER NOT NULL DEFAULT 0,
+    brands INTEGER NOT NULL DEFAULT 0,
+    products INTEGER NOT NULL DEFAULT 0,
+    admins INTEGER NOT NULL DEFAULT 0,
+    in_stock INTEGER NOT NULL DEFAULT 0,
+    out_of_stock INTEGER NOT NULL DEFAULT 0,
+    new_products INTEGER NOT NULL DEFAULT 0,
+    on_sale INTEGER NOT NULL DEFAULT 0,
+    total_sales BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS brand_stats (
+    brand_id INTEGER PRIMARY KEY REFERENCES brands (id) ON DELETE CASCADE,
+    product_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_brand_stats_product_count ON brand_stats (product_count);
+
+CREATE TABLE IF NOT EXISTS category_stats (
+    category_id INTEGER PRIMARY KEY REFERENCES categories (id) ON DELETE CASCADE,
+    product_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_category_stats_product_count ON category_stats (product_count);
+
+INSERT INTO catalog_stats (id, categories, brands, admins, products, in_stock, out_of_stock,
+                           new_products, on_sale, total_sales)
+SELECT 1,
+       (SELECT count(*) FROM categories),
+       (SELECT count(*) FROM brands),
+       (SELECT count(*) FROM admins),
+       count(p.id),
+       count(p.id) FILTER (WHERE coalesce(p.in_stock, true)),
+       count(p.id) FILTER (WHERE NOT coalesce(p.in_stock, true)),
+       count(p.id) FILTER (WHERE coalesce(p.is_new, false)),
+       count(p.id) FILTER (WHERE coalesce(p.is_sale, false)),
+       coalesce(sum(p.sales_count), 0)
+FROM products p
+ON CONFLICT (id) DO NOTHING;
+
+INSERT INTO brand_stats (brand_id, product_count)
+SELECT b.id, count(p.id)
+FROM brands b LEFT JOIN products p ON p.brand_id = b.id
+GROUP BY b.id
+ON CONFLICT (brand_id) DO NOTHING;
+
+INSERT INTO category_stats (category_id, product_count)
+SELECT c.id, count(p.id)
+FROM categories c
+LEFT JOIN brands b ON b.category_id = c.id
+LEFT JOIN products p ON p.brand_id = b.id
+GROUP BY c.id
+ON CONFLICT (category_id) DO NOTHING;
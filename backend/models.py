@@ -2,10 +2,13 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import pytz
 from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import JSONB
 from werkzeug.security import generate_password_hash, check_password_hash
+from services.routing import RoutingSession
 
 lebanon_tz = pytz.timezone("Asia/Beirut")
-db = SQLAlchemy() 
+# Reads of opted-in requests go to the replica, see services/routing.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
     
 class Category(db.Model):
     __tablename__ = 'categories'
@@ -19,7 +22,7 @@ class Brand(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     slug = db.Column(db.String(255), unique=True, nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False, index=True)
     category = db.relationship("Category", back_populates="brands")
 
     products = db.relationship("Product", back_populates="brand")
@@ -42,9 +45,28 @@ class Product(db.Model):
 
     brand_id = db.Column(db.Integer, db.ForeignKey('brands.id'), nullable=False)
 
+    # Supplier SKU, the natural key bulk imports upsert on
+    sku = db.Column(db.String(64), nullable=True)
+
+    # {original image url: manifest} copied from image_manifests by
+    # services.images, so listings pick a thumbnail without another query
+    image_variants = db.Column(JSONB, nullable=True)
+
     # Relationships
     brand = db.relationship("Brand", back_populates="products")
 
+    # Shaped after the listing queries, see migrations/0004_catalog_indexes.sql
+    # and `flask --app app check-plans`
+    __table_args__ = (
+        db.Index('uq_products_sku', 'sku', unique=True),
+        db.Index('ix_products_brand_id_id', brand_id, id),
+        db.Index('ix_products_brand_id_created_at', brand_id, created_at.desc(), id.desc()),
+        db.Index('ix_products_created_at_id', created_at.desc(), id.desc()),
+        db.Index('ix_products_sales_count_id', sales_count.desc(), id.desc()),
+        db.Index('ix_products_price_id', price, id),
+        db.Index('ix_products_on_sale', id, postgresql_where=is_sale),
+    )
+
 class Admin(db.Model):
     __tablename__ = 'admins'
     id = db.Column(db.Integer, primary_key=True)
@@ -59,3 +81,55 @@ class Admin(db.Model):
 
     def __repr__(self):
         return f'<Admin {self.username}>'
+
+
+# ----------- DASHBOARD SUMMARY -----------
+# Maintained incrementally by services.stats in the same transaction as the
+# catalog write; rebuilt from scratch with `flask --app app recompute-stats`.
+
+class CatalogStats(db.Model):
+    __tablename__ = 'catalog_stats'
+    id = db.Column(db.Integer, primary_key=True)  # single row, id = 1
+    categories = db.Column(db.Integer, nullable=False, default=0)
+    brands = db.Column(db.Integer, nullable=False, default=0)
+    products = db.Column(db.Integer, nullable=False, default=0)
+    admins = db.Column(db.Integer, nullable=False, default=0)
+    in_stock = db.Column(db.Integer, nullable=False, default=0)
+    out_of_stock = db.Column(db.Integer, nullable=False, default=0)
+    new_products = db.Column(db.Integer, nullable=False, default=0)
+    on_sale = db.Column(db.Integer, nullable=False, default=0)
+    total_sales = db.Column(db.BigInteger, nullable=False, default=0)
+
+class BrandStats(db.Model):
+    __tablename__ = 'brand_stats'
+    brand_id = db.Column(db.Integer, db.ForeignKey('brands.id', ondelete='CASCADE'), primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+class CategoryStats(db.Model):
+    __tablename__ = 'category_stats'
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+
+# ----------- SIMILAR PRODUCTS -----------
+# Top-N neighbours per product, written by services.similarity. similar_id
+# deliberately has no foreign key: rows naming a deleted product are how the
+# incremental rebuild finds the neighbour lists it has to recompute.
+
+class ProductSimilarity(db.Model):
+    __tablename__ = 'product_similarity'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True)
+    similar_id = db.Column(db.Integer, nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+
+
+# ----------- IMAGE DERIVATIVES -----------
+# One manifest per original image url: its size, a tiny inline placeholder
+# and the resized WebP/AVIF derivatives, see services.images.
+
+class ImageManifest(db.Model):
+    __tablename__ = 'image_manifests'
+    url = db.Column(db.Text, primary_key=True)
+    manifest = db.Column(JSONB, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,164 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from flask import g, jsonify
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity, jwt_required
+from sqlalchemy import event
+from werkzeug.security import check_password_hash, generate_password_hash
+from models import db, Admin
+
+AdminIdentity = namedtuple('AdminIdentity', 'id username credential')
+
+
+def _credential(password_hash):
+    # Changes with the password, so tokens issued before a reset stop working
+    return hashlib.sha256(password_hash.encode()).hexdigest()[:16]
+
+
+class AdminCache:
+    """Short-lived LRU of admin identities keyed by id, so authorizing a
+    write doesn't read the admins table. Entries are dropped as soon as an
+    admin is changed or deleted through this process's session; other
+    processes see the change within ADMIN_CACHE_TTL seconds."""
+
+    def __init__(self, ttl=60, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, admin_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(admin_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(admin_id)
+                return entry[1]
+
+        admin = db.session.get(Admin, admin_id)
+        # Missing admins are cached too: a deleted admin's token keeps failing cheaply
+        identity = AdminIdentity(admin.id, admin.username, _credential(admin.password)) if admin else None
+        with self._lock:
+            self._entries[admin_id] = (now + self.ttl, identity)
+            self._entries.move_to_end(admin_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, admin_ids=None):
+        with self._lock:
+            if admin_ids is None:
+                self._entries.clear()
+            for admin_id in admin_ids or ():
+                self._entries.pop(admin_id, None)
+
+
+admin_cache = AdminCache()
+
+
+class PasswordChecker:
+    """Bounds password hash checks, which are deliberately slow. A login
+    holds its request thread while its check waits and runs, so at most
+    `backlog` logins are admitted at a time and the rest get None (a 429)
+    at once; of those, `workers` hash concurrently and the others wait up
+    to `timeout` seconds for a turn."""
+
+    def __init__(self, workers=2, backlog=8, timeout=10):
+        self.workers = workers
+        self.timeout = timeout
+        self.backlog = backlog
+        self._slots = threading.BoundedSemaphore(backlog)
+        self._running = threading.BoundedSemaphore(workers)
+        self._dummy_hash = None
+
+    def configure(self, workers, backlog, timeout):
+        self.timeout = timeout
+        if self._dummy_hash is None:
+            self._dummy_hash = generate_password_hash('not a password')
+        # Swapping a semaphore under checks in flight would over-release it
+        if backlog != self.backlog:
+            self.backlog = backlog
+            self._slots = threading.BoundedSemaphore(backlog)
+        if workers != self.workers:
+            self.workers = workers
+            self._running = threading.BoundedSemaphore(workers)
+
+    def check(self, password_hash, password):
+        """True/False, or None when too many checks are already waiting.
+        A None hash (unknown user) is checked against a dummy one and
+        fails, taking as long as a wrong password would."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            if not self._running.acquire(timeout=self.timeout):
+                return None
+            try:
+                if password_hash is None:
+                    check_password_hash(self._dummy_hash, password)
+                    return False
+                return check_password_hash(password_hash, password)
+            finally:
+                self._running.release()
+        finally:
+            self._slots.release()
+
+
+password_checker = PasswordChecker()
+
+
+def login_token(admin, expires_delta=None):
+    """Access token for `admin` carrying what admin_required checks."""
+    return create_access_token(
+        identity=str(admin.id),
+        additional_claims={'role': 'admin', 'username': admin.username, 'cred': _credential(admin.password)},
+        expires_delta=expires_delta,
+    )
+
+
+def admin_required(view):
+    """@jwt_required() plus a check that the token still belongs to an
+    existing admin with an unchanged password, served from admin_cache.
+    The admin is available as g.admin (an AdminIdentity)."""
+    @wraps(view)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        claims = get_jwt()
+        identity = admin_cache.get(int(get_jwt_identity())) if claims.get('role') == 'admin' else None
+        if identity is None or identity.credential != claims.get('cred'):
+            return jsonify({'error': 'Unauthorized'}), 401
+        g.admin = identity
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _after_flush(session, flush_context):
+    changed = [obj.id for obj in (*session.dirty, *session.deleted) if isinstance(obj, Admin)]
+    if changed:
+        session.info.setdefault('changed_admins', set()).update(changed)
+
+
+def _after_commit(session):
+    changed = session.info.pop('changed_admins', None)
+    if changed:
+        admin_cache.invalidate(changed)
+
+
+def _after_rollback(session):
+    session.info.pop('changed_admins', None)
+
+
+def init_app(app):
+    admin_cache.ttl = app.config.get('ADMIN_CACHE_TTL', admin_cache.ttl)
+    admin_cache.invalidate()
+    password_checker.configure(
+        app.config.get('PASSWORD_CHECK_WORKERS', password_checker.workers),
+        app.config.get('PASSWORD_CHECK_BACKLOG', 8),
+        app.config.get('PASSWORD_CHECK_TIMEOUT', password_checker.timeout),
+    )
+    app.extensions['admin_cache'] = admin_cache
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
@@ -0,0 +1,239 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, current_app
+from services.signals import product_changed, taxonomy_changed, clicks_flushed
+
+# Invalidation scopes. Admin category/brand writes bump "taxonomy", product
+# writes bump "product" and click flushes bump "sales"; a cached response
+# names the scopes it was built from and dies when any of them moves.
+SCOPES = ('taxonomy', 'product', 'sales')
+
+
+class MemoryBackend:
+    """Per-process TTL + LRU store. Versions are only seen by this process,
+    so multi-worker deployments should use RedisBackend instead."""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        # Versions restart at 0 with the process
+        self._epoch = uuid.uuid4().hex[:12]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_versions(self, scopes):
+        with self._lock:
+            return [self._versions.get(scope, (0, 0.0)) for scope in scopes]
+
+    def bump(self, scope):
+        with self._lock:
+            version, _ = self._versions.get(scope, (0, 0.0))
+            self._versions[scope] = (version + 1, time.time())
+
+    def epoch(self):
+        return self._epoch
+
+
+class RedisBackend:
+    """Shared store for multi-worker deployments. Works with redis-py or any
+    client exposing the same get/set/mget/pipeline API (KeyDB, Valkey, a
+    local redis-server, fakeredis in tests). LRU eviction is the server's
+    job: run it with ``maxmemory-policy allkeys-lru``."""
+
+    def __init__(self, client, prefix='smarttech:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=max(int(ttl), 1))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + 'resp:*'):
+            self.client.delete(key)
+
+    def get_versions(self, scopes):
+        keys = []
+        for scope in scopes:
+            keys += [f'{self.prefix}version:{scope}', f'{self.prefix}version-at:{scope}']
+        raw = self.client.mget(keys)
+        return [
+            (int(raw[i] or 0), float(raw[i + 1] or 0.0))
+            for i in range(0, len(raw), 2)
+        ]
+
+    def bump(self, scope):
+        pipe = self.client.pipeline()
+        pipe.incr(f'{self.prefix}version:{scope}')
+        pipe.set(f'{self.prefix}version-at:{scope}', time.time())
+        pipe.execute()
+
+    def epoch(self):
+        # Versions restart at 0 if the server loses its keys; so does this
+        key = f'{self.prefix}epoch'
+        epoch = self.client.get(key)
+        if epoch is None:
+            self.client.set(key, uuid.uuid4().hex[:12], nx=True)
+            epoch = self.client.get(key)
+        return epoch.decode() if isinstance(epoch, bytes) else epoch
+
+
+# Streamed responses are only kept if their body stays under this size
+MAX_STREAMED_BODY = 1024 * 1024
+
+
+def _encode(response, body):
+    meta = {
+        'status': response.status_code,
+        'mimetype': response.mimetype,
+        'headers': {k: v for k, v in response.headers.items() if k.startswith('X-') and k != 'X-Cache'},
+    }
+    return json.dumps(meta).encode() + b'\n' + body
+
+
+def _decode(raw, response_class=None):
+    meta, body = raw.split(b'\n', 1)
+    meta = json.loads(meta)
+    response_class = response_class or current_app.response_class
+    response = response_class(body, status=meta['status'], mimetype=meta['mimetype'])
+    response.headers.update(meta['headers'])
+    return response
+
+
+class ResponseCache:
+
+    def __init__(self):
+        self.backend = None
+        self.default_ttl = 300
+        self.enabled = True
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', self.default_ttl)
+        if app.config.get('CACHE_BACKEND', 'memory') == 'redis':
+            self.backend = RedisBackend.from_url(app.config['CACHE_REDIS_URL'])
+        else:
+            # Each worker would keep its own versions and answer 304 for
+            # another worker's writes indefinitely
+            if app.config.get('WEB_CONCURRENCY', 1) > 1:
+                raise RuntimeError('CACHE_BACKEND=memory serves one worker only; use redis')
+            self.backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', 2048))
+        app.extensions['response_cache'] = self
+
+        product_changed.connect(self._on_product_changed, app, weak=False)
+        taxonomy_changed.connect(self._on_taxonomy_changed, app, weak=False)
+        clicks_flushed.connect(self._on_clicks_flushed, app, weak=False)
+
+    def _on_product_changed(self, sender, **extra):
+        self.bump('product')
+
+    def _on_taxonomy_changed(self, sender, **extra):
+        self.bump('taxonomy')
+
+    def _on_clicks_flushed(self, sender, **extra):
+        self.bump('sales')
+
+    def bump(self, scope):
+        self.backend.bump(scope)
+
+    def versions(self, scopes):
+        """[(version, bumped at unix time)] for each scope."""
+        return self.backend.get_versions(scopes)
+
+    def epoch(self):
+        """Changes whenever the versions start over (restart, flushed server)."""
+        return self.backend.epoch()
+
+    def key(self, scopes, full_path=None):
+        tag = '.'.join(f'{scope}{version}' for scope, (version, _) in zip(scopes, self.versions(scopes)))
+        return f'resp:{tag}:{full_path or request.full_path}'
+
+    def load(self, key, response_class=None):
+        """The cached response under key, or None."""
+        raw = self.backend.get(key)
+        return _decode(raw, response_class) if raw is not None else None
+
+    def store(self, key, response, body, ttl=None):
+        self.backend.set(key, _encode(response, body), ttl or self.default_ttl)
+
+    def _tee(self, key, response, body, ttl):
+        # Pass a streamed body through untouched, keeping a copy to cache
+        # once it has been sent in full, unless it grows too large
+        chunks, size = [], 0
+        for chunk in body:
+            yield chunk
+            if chunks is not None:
+                data = chunk.encode() if isinstance(chunk, str) else chunk
+                size += len(data)
+                chunks.append(data)
+                if size > MAX_STREAMED_BODY:
+                    chunks = None
+        if chunks is not None:
+            self.backend.set(key, _encode(response, b''.join(chunks)), ttl)
+
+    def cached(self, *scopes, ttl=None):
+        """Cache a GET view's response until its TTL passes or one of its
+        scopes is bumped by a write."""
+        unknown = set(scopes) - set(SCOPES)
+        if unknown:
+            raise ValueError(f'Unknown cache scopes: {sorted(unknown)}')
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                key = self.key(scopes)
+                response = self.load(key)
+                if response is not None:
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    if response.is_streamed:
+                        response.response = self._tee(key, response, response.response, ttl or self.default_ttl)
+                    else:
+                        self.store(key, response, response.get_data(), ttl)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,393 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import select, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Category, Brand, Product
+from services.signals import notify_product_changed
+
+EXPORT_BATCH_SIZE = 2000
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+# Column order of CSV exports; imports accept any subset that includes the
+# required ones, in any order.
+EXPORT_FIELDS = [
+    'sku', 'title', 'description', 'price', 'original_price', 'review_count',
+    'in_stock', 'is_new', 'is_sale', 'sales_count', 'brand_slug', 'category_slug',
+    'images', 'id', 'created_at',
+]
+REQUIRED_FIELDS = ('sku', 'title', 'price', 'brand_slug')
+
+# Live counters are only taken from the feed for brand-new products
+INSERT_ONLY_COLUMNS = ('review_count', 'sales_count')
+UPSERT_COLUMNS = (
+    'sku', 'title', 'description', 'price', 'original_price', 'review_count',
+    'in_stock', 'is_new', 'is_sale', 'sales_count', 'brand_id', 'images',
+)
+
+# products.price is DECIMAL(10, 2)
+MAX_PRICE = Decimal(10) ** 8
+# review_count / sales_count are INTEGER columns
+MAX_COUNT = 2 ** 31 - 1
+
+# CSV has no arrays; image URLs are joined with this
+IMAGE_SEPARATOR = '|'
+
+
+# ----------- EXPORT -----------
+
+def _export_rows():
+    stmt = (
+        select(
+            Product.sku, Product.title, Product.description, Product.price, Product.original_price,
+            Product.review_count, Product.in_stock, Product.is_new, Product.is_sale, Product.sales_count,
+            Brand.slug.label('brand_slug'), Category.slug.label('category_slug'),
+            Product.images, Product.id, Product.created_at,
+        )
+        .join(Brand, Product.brand_id == Brand.id)
+        .join(Category, Brand.category_id == Category.id)
+        .order_by(Product.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    # yield_per keeps a server-side cursor open, so only one batch of rows
+    # is ever held in memory
+    for row in db.session.execute(stmt).mappings():
+        yield row
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def export_ndjson():
+    for row in _export_rows():
+        yield json.dumps({k: _plain(v) for k, v in row.items()}) + '\n'
+
+
+def export_csv():
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for row in _export_rows():
+        values = dict(row)
+        values['images'] = IMAGE_SEPARATOR.join(values['images'] or [])
+        writer.writerow([_plain(values[field]) for field in EXPORT_FIELDS])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# ----------- IMPORT -----------
+
+def read_records(stream, fmt):
+    """Yield (line number, raw dict or parse error) from a binary stream
+    without reading it all into memory."""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(text_stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f'Invalid JSON: {e}')
+            continue
+        if not isinstance(record, dict):
+            yield line_number, ValueError('Each line must be a JSON object')
+            continue
+        yield line_number, record
+
+
+def _bool(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('true', '1', 'yes', 't', 'y'):
+        return True
+    if text in ('false', '0', 'no', 'f', 'n'):
+        return False
+    raise ValueError(f'Not a boolean: {value!r}')
+
+
+def _decimal(value, field, required=False):
+    if value is None or value == '':
+        if required:
+            raise ValueError(f'{field} is required')
+        return None
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f'{field} is not a number: {value!r}')
+    if not number.is_finite() or number < 0:
+        raise ValueError(f'{field} must be a non-negative number')
+    if number >= MAX_PRICE:
+        raise ValueError(f'{field} must be below {MAX_PRICE}')
+    return number
+
+
+def _count(value, field):
+    # Counters feed the summary stats, so negatives are rejected as on PUT
+    if value is None or value == '':
+        return 0
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} is not an integer: {value!r}')
+    if number < 0:
+        raise ValueError(f'{field} must not be negative')
+    if number > MAX_COUNT:
+        raise ValueError(f'{field} must be at most {MAX_COUNT}')
+    return number
+
+
+def _images(value):
+    if value is None or value == '':
+        return []
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return [url for url in str(value).split(IMAGE_SEPARATOR) if url]
+
+
+def normalize_record(record):
+    """Validate one raw record; brand/category slugs are resolved later in bulk."""
+    # Stripped before the check, so whitespace alone counts as missing
+    required = {f: str(record[f]).strip() if record.get(f) is not None else '' for f in REQUIRED_FIELDS}
+    missing = [f for f in REQUIRED_FIELDS if not required[f]]
+    if missing:
+        raise ValueError(f"Missing required field(s): {', '.join(missing)}")
+    sku = required['sku']
+    if len(sku) > 64:
+        raise ValueError('sku is longer than 64 characters')
+    title = required['title']
+    if len(title) > 255:
+        raise ValueError('title is longer than 255 characters')
+    return {
+        'sku': sku,
+        'title': title,
+        'description': record.get('description') or '',
+        'price': _decimal(required['price'], 'price', required=True),
+        'original_price': _decimal(record.get('original_price'), 'original_price'),
+        'review_count': _count(record.get('review_count'), 'review_count'),
+        'in_stock': _bool(record.get('in_stock'), True),
+        'is_new': _bool(record.get('is_new'), False),
+        'is_sale': _bool(record.get('is_sale'), False),
+        'sales_count': _count(record.get('sales_count'), 'sales_count'),
+        'images': _images(record.get('images')),
+        'brand_slug': required['brand_slug'],
+        'category_slug': (record.get('category_slug') or '').strip() or None,
+    }
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, sku, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'sku': sku, 'error': message})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+class SlugResolver:
+    """Brand/category slug -> id cache, filled with one query per batch for
+    whichever slugs that batch introduces."""
+
+    def __init__(self):
+        self.brands = {}      # slug -> (brand id, category id) or None
+        self.categories = {}  # slug -> category id or None
+
+    def load(self, brand_slugs, category_slugs):
+        brand_slugs = set(brand_slugs) - self.brands.keys()
+        if brand_slugs:
+            rows = db.session.execute(
+                select(Brand.slug, Brand.id, Brand.category_id).where(Brand.slug.in_(brand_slugs))
+            )
+            found = {slug: (bid, cid) for slug, bid, cid in rows}
+            for slug in brand_slugs:
+                self.brands[slug] = found.get(slug)
+        category_slugs = set(category_slugs) - self.categories.keys()
+        if category_slugs:
+            rows = db.session.execute(
+                select(Category.slug, Category.id).where(Category.slug.in_(category_slugs))
+            )
+            found = dict(rows.all())
+            for slug in category_slugs:
+                self.categories[slug] = found.get(slug)
+
+    def brand_id(self, row):
+        brand = self.brands.get(row['brand_slug'])
+        if brand is None:
+            raise ValueError(f"Unknown brand: {row['brand_slug']}")
+        brand_id, category_id = brand
+        if row['category_slug']:
+            expected = self.categories.get(row['category_slug'])
+            if expected is None:
+                raise ValueError(f"Unknown category: {row['category_slug']}")
+            if expected != category_id:
+                raise ValueError(f"Brand {row['brand_slug']} is not in category {row['category_slug']}")
+        return brand_id
+
+
+def _upsert_statement(rows):
+    stmt = pg_insert(Product).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[Product.sku],
+        set_={c: stmt.excluded[c] for c in UPSERT_COLUMNS if c not in INSERT_ONLY_COLUMNS and c != 'sku'},
+    ).returning(Product.id, literal_column('(xmax = 0)').label('inserted'))
+
+
+def _copy_upsert(rows):
+    """COPY the batch into a temp table, then merge it with one INSERT ...
+    SELECT ... ON CONFLICT. Only available on psycopg2 connections."""
+    connection = db.session.connection()
+    raw = connection.connection.driver_connection
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            _copy_value(row[c]) if c != 'images' else _pg_array(row[c]) for c in UPSERT_COLUMNS
+        ])
+    buffer.seek(0)
+
+    connection.exec_driver_sql(
+        'CREATE TEMP TABLE import_products ('
+        ' sku VARCHAR(64), title VARCHAR(255), description TEXT, price NUMERIC(10, 2),'
+        ' original_price NUMERIC(10, 2), review_count INTEGER, in_stock BOOLEAN, is_new BOOLEAN,'
+        ' is_sale BOOLEAN, sales_count INTEGER, brand_id INTEGER, images VARCHAR[]'
+        ') ON COMMIT DROP'
+    )
+    with raw.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY import_products ({', '.join(UPSERT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    updates = ', '.join(
+        f'{c} = EXCLUDED.{c}' for c in UPSERT_COLUMNS if c not in INSERT_ONLY_COLUMNS and c != 'sku'
+    )
+    columns = ', '.join(UPSERT_COLUMNS)
+    return connection.exec_driver_sql(
+        f'INSERT INTO products ({columns}) SELECT {columns} FROM import_products '
+        f'ON CONFLICT (sku) DO UPDATE SET {updates} '
+        f'RETURNING id, (xmax = 0) AS inserted'
+    ).all()
+
+
+def _copy_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return value
+
+
+def _pg_array(values):
+    escaped = ('"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _supports_copy():
+    raw = db.session.connection().connection.driver_connection
+    return hasattr(raw, 'cursor') and db.engine.dialect.driver == 'psycopg2'
+
+
+def _write_batch(batch, report, use_copy):
+    """Upsert one batch in its own transaction. If the batch as a whole
+    fails, retry row by row so a bad row only costs itself."""
+    # A later duplicate sku in the same batch wins, as if applied in order
+    unique = {}
+    for line, row in batch:
+        unique[row['sku']] = (line, row)
+    values = [{c: row[c] for c in UPSERT_COLUMNS} for _, row in unique.values()]
+
+    try:
+        if use_copy:
+            results = _copy_upsert(values)
+        else:
+            results = db.session.execute(_upsert_statement(values)).all()
+        db.session.commit()
+    except (SQLAlchemyError, db.engine.dialect.dbapi.Error):
+        db.session.rollback()
+        results = []
+        for line, row in unique.values():
+            try:
+                results += db.session.execute(
+                    _upsert_statement([{c: row[c] for c in UPSERT_COLUMNS}])
+                ).all()
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                report.error(line, row['sku'], str(getattr(e, 'orig', e)).strip().splitlines()[0])
+
+    report.inserted += sum(1 for _, inserted in results if inserted)
+    report.updated += sum(1 for _, inserted in results if not inserted)
+    if results:
+        notify_product_changed([product_id for product_id, _ in results])
+
+
+def import_products(stream, fmt, batch_size=IMPORT_BATCH_SIZE):
+    """Stream-import products, upserting on sku. Returns an ImportReport."""
+    report = ImportReport()
+    resolver = SlugResolver()
+    use_copy = _supports_copy()
+    pending = []
+
+    def flush():
+        resolver.load(
+            (row['brand_slug'] for _, row in pending),
+            (row['category_slug'] for _, row in pending if row['category_slug']),
+        )
+        batch = []
+        for line, row in pending:
+            try:
+                row['brand_id'] = resolver.brand_id(row)
+            except ValueError as e:
+                report.error(line, row['sku'], str(e))
+                continue
+            batch.append((line, row))
+        if batch:
+            _write_batch(batch, report, use_copy)
+        pending.clear()
+
+    for line, record in read_records(stream, fmt):
+        report.rows += 1
+        if isinstance(record, Exception):
+            report.error(line, None, str(record))
+            continue
+        try:
+            pending.append((line, normalize_record(record)))
+        except ValueError as e:
+            report.error(line, record.get('sku'), str(e))
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    return report
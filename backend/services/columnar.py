@@ -0,0 +1,566 @@
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+import click
+import numpy as np
+from sqlalchemy import BigInteger, Integer, func, literal, select
+from models import db, Product
+from services.pagination import SORT_KEYS, decode_cursor, sort_keys
+from services.signals import product_changed, clicks_flushed
+
+logger = logging.getLogger(__name__)
+
+# Indexed column -> dtype. Prices are whole cents, created_at microseconds
+# since the epoch; NULL flags are -1 and NULL created_at/sales_count are NULL.
+FIELDS = {
+    'id': np.int32,
+    'price': np.int64,
+    'brand_id': np.int32,
+    'in_stock': np.int8,
+    'is_sale': np.int8,
+    'created_at': np.int64,
+    'sales_count': np.int64,
+}
+NULL = np.iinfo(np.int64).min
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Bounds beyond any price or timestamp, for out-of-range filter values
+_LIMIT = 2 ** 62
+
+# One listing answered from the index: product ids of the page in the
+# order they are fetched, the position of the first one, whether a "prev"
+# cursor walked backwards, and (total, min price, max price, facet counts)
+# when the listing is counted.
+Selection = namedtuple('Selection', 'ids offset backwards summary')
+
+
+class _Unsupported(Exception):
+    """A request the index doesn't answer the way SQL would (NULL sort keys,
+    odd cursor values, invalid paging); it goes to the database instead."""
+
+
+class Columns:
+    """The indexed columns of every product as parallel arrays, in id order.
+    Never modified in place: a refresh builds a new one (sharing the arrays
+    it didn't change) and swaps it in."""
+
+    __slots__ = tuple(FIELDS)
+
+    def __init__(self, **arrays):
+        for name in FIELDS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_rows(cls, rows):
+        values = itertools.chain.from_iterable(rows)
+        table = np.fromiter(values, dtype=np.int64, count=len(rows) * len(FIELDS)).reshape(-1, len(FIELDS))
+        return cls(**{name: table[:, i].astype(dtype) for i, (name, dtype) in enumerate(FIELDS.items())})
+
+    def __len__(self):
+        return len(self.id)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in FIELDS)
+
+    def take(self, index):
+        return Columns(**{name: getattr(self, name)[index] for name in FIELDS})
+
+    def _positions(self, ids):
+        # (positions of the ids present, mask of which ids are present)
+        positions = np.searchsorted(self.id, ids)
+        present = positions < len(self)
+        present[present] = self.id[positions[present]] == ids[present]
+        return positions[present], present
+
+    def replace(self, ids, fresh):
+        """Drop the rows of `ids` and add `fresh` (their current rows, in id
+        order). Rows already present are overwritten at their positions on
+        a copy of just the arrays that change; only inserts and deletes move
+        the rest, and nothing is re-sorted."""
+        at, present = self._positions(fresh.id)
+        arrays = {}
+        for name in FIELDS:
+            values, updates = getattr(self, name), getattr(fresh, name)[present]
+            if len(at) and (values[at] != updates).any():
+                values = values.copy()
+                values[at] = updates
+            arrays[name] = values
+        columns = Columns(**arrays)
+
+        gone = np.setdiff1d(np.fromiter(ids, dtype=np.int64, count=len(ids)), fresh.id)
+        gone_at, _ = columns._positions(gone)
+        if len(gone_at):
+            columns = Columns(**{name: np.delete(getattr(columns, name), gone_at) for name in FIELDS})
+        if not present.all():
+            added = fresh.take(~present)
+            insert_at = np.searchsorted(columns.id, added.id)
+            columns = Columns(**{name: np.insert(getattr(columns, name), insert_at, getattr(added, name))
+                                 for name in FIELDS})
+        return columns
+
+
+def load_columns(ids=None):
+    t = Product.__table__
+    stmt = select(
+        t.c.id,
+        (t.c.price * 100).cast(BigInteger),
+        t.c.brand_id,
+        func.coalesce(t.c.in_stock.cast(Integer), -1),
+        func.coalesce(t.c.is_sale.cast(Integer), -1),
+        func.coalesce(func.floor(func.extract('epoch', t.c.created_at) * 1000000).cast(BigInteger),
+                      literal(int(NULL), BigInteger)),
+        func.coalesce(t.c.sales_count.cast(BigInteger), literal(int(NULL), BigInteger)),
+    ).order_by(t.c.id)
+    if ids is not None:
+        stmt = stmt.where(t.c.id.in_(list(ids)))
+    result = db.session.execute(stmt.execution_options(yield_per=50000))
+    parts = [Columns.from_rows(rows) for rows in result.partitions()]
+    if not parts:
+        return Columns.from_rows([])
+    if len(parts) == 1:
+        return parts[0]
+    return Columns(**{name: np.concatenate([getattr(p, name) for p in parts]) for name in FIELDS})
+
+
+def _row_values(row):
+    # A product row in the index's units, as load_columns reads them
+    created_at, sales_count = row['created_at'], row['sales_count']
+    return (
+        row['id'],
+        int(row['price'] * 100),
+        row['brand_id'],
+        -1 if row['in_stock'] is None else int(row['in_stock']),
+        -1 if row['is_sale'] is None else int(row['is_sale']),
+        (created_at - EPOCH) // timedelta(microseconds=1) if created_at is not None else int(NULL),
+        sales_count if sales_count is not None else int(NULL),
+    )
+
+
+def _brand_mask(brand_ids, wanted):
+    lookup = np.zeros(max(int(brand_ids.max(initial=0)), max(wanted, default=0)) + 1, dtype=bool)
+    lookup[list(wanted)] = True
+    return lookup[brand_ids]
+
+
+def _all(conds, size, skip=None):
+    masks = [mask for name, mask in conds.items() if name != skip]
+    if not masks:
+        return np.ones(size, dtype=bool)
+    return np.logical_and.reduce(masks) if len(masks) > 1 else masks[0]
+
+
+def _conditions(columns, filters, tax):
+    # Filter name -> mask, the category scope aside
+    conds = {}
+    if filters.get('brand_slugs'):
+        conds['brand'] = _brand_mask(columns.brand_id, tax.brand_ids(filters['brand_slugs']))
+    price_masks = []
+    if filters.get('min_price') is not None:
+        price_masks.append(columns.price >= _cents(filters['min_price'], ROUND_CEILING))
+    if filters.get('max_price') is not None:
+        price_masks.append(columns.price <= _cents(filters['max_price'], ROUND_FLOOR))
+    if price_masks:
+        conds['price'] = np.logical_and.reduce(price_masks)
+    if filters.get('in_stock') is not None:
+        conds['stock'] = columns.in_stock == int(filters['in_stock'])
+    if filters.get('is_sale') is not None:
+        conds['sale'] = columns.is_sale == int(filters['is_sale'])
+    return conds
+
+
+def _cents(value, rounding):
+    # Float filters reach Postgres as their repr, compared as NUMERIC
+    if not math.isfinite(value):
+        raise _Unsupported()
+    cents = int((Decimal(repr(value)) * 100).to_integral_value(rounding))
+    return min(max(cents, -_LIMIT), _LIMIT)
+
+
+def _cursor_value(name, value):
+    if name == 'price' and isinstance(value, Decimal) and value.is_finite():
+        cents = value * 100
+        if cents == cents.to_integral_value():
+            return int(cents)
+    elif name == 'created_at' and isinstance(value, datetime) and value.tzinfo is not None:
+        return (value - EPOCH) // timedelta(microseconds=1)
+    elif name in ('id', 'sales_count') and isinstance(value, int) and not isinstance(value, bool):
+        if abs(value) < _LIMIT:
+            return value
+    raise _Unsupported()
+
+
+def _first(candidates, key, k, descending):
+    """Positions of the first k candidates ordered by (key, id). Candidates
+    come in position order, which is id order; key None means by id only."""
+    if k <= 0:
+        return candidates[:0]
+    if descending:
+        candidates = candidates[::-1]
+    if key is None:
+        return candidates[:k]
+    values = key[candidates]
+    if descending:
+        values = -values
+    if k < len(values):
+        # Only the k smallest keys (and ties with the k-th) get sorted
+        kth = np.partition(values, k - 1)[k - 1]
+        keep = np.flatnonzero(values <= kth)
+        candidates, values = candidates[keep], values[keep]
+    # Stable, so equal keys stay in id order (reversed above when descending)
+    return candidates[np.argsort(values, kind='stable')[:k]]
+
+
+class ColumnarIndex:
+    """In-process copy of the product columns the filter endpoint filters
+    and sorts on, as NumPy arrays. A listing's matches, order, total, price
+    bounds and facet counts are computed here; the database only returns
+    the rows of the final page.
+
+    The first use in a process starts a build in the background and the
+    listing runs in SQL until it is done. Products changed through this
+    process (admin writes, click flushes) are re-read one by one; other
+    workers' writes arrive with a full rebuild every COLUMNAR_INDEX_MAX_AGE
+    seconds.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = True
+        self.max_age = None
+        # (Columns, monotonic time the full build started), swapped in one assignment
+        self._state = None
+        # Serializes applying changes; a full build only takes it to swap
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._schedule_lock = threading.Lock()
+        self._scheduled = False
+        self._jobs = None
+        # Ids changed while a full build runs, re-read before it is swapped in
+        self._dirty = None
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('COLUMNAR_INDEX', True)
+        self.max_age = app.config.get('COLUMNAR_INDEX_MAX_AGE')
+        self._state = None
+        app.extensions['columnar_index'] = self
+        product_changed.connect(self._on_product_changed, app)
+        clicks_flushed.connect(self._on_clicks_flushed, app)
+
+    # ----------- building -----------
+
+    def columns(self):
+        """The current Columns, or None while the first build runs."""
+        if not self.enabled:
+            return None
+        state = self._state
+        if state is None or (self.max_age and time.monotonic() - state[1] > self.max_age):
+            self.rebuild(background=True)
+            state = self._state
+        return state[0] if state is not None else None
+
+    def rebuild(self, background=False):
+        if not background or self.app.config.get('TESTING'):
+            with self._build_lock, self.app.app_context():
+                self._build()
+            return
+        with self._schedule_lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._executor().submit(self._run)
+
+    def _executor(self):
+        with self._schedule_lock:
+            if self._jobs is None:
+                self._jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix='columnar-index')
+            return self._jobs
+
+    def _run(self):
+        try:
+            with self._build_lock, self.app.app_context():
+                self._build()
+        except Exception:
+            logger.exception('Building the columnar product index failed')
+        finally:
+            with self._schedule_lock:
+                self._scheduled = False
+
+    def _build(self):
+        with self._lock:
+            self._dirty = set()
+        started = time.monotonic()
+        try:
+            columns = load_columns()
+        except Exception:
+            with self._lock:
+                self._dirty = None
+            raise
+        with self._lock:
+            dirty, self._dirty = self._dirty, None
+            if dirty:
+                columns = columns.replace(dirty, load_columns(dirty))
+            self._state = (columns, started)
+        logger.info('Columnar product index: %d products in %.1fs', len(columns), time.monotonic() - started)
+
+    def refresh(self, ids, deleted=False):
+        """Re-read (or drop) just the given products."""
+        ids = set(ids)
+        if not ids:
+            return
+        with self._lock:
+            if self._dirty is not None:
+                self._dirty.update(ids)
+            state = self._state
+            if state is None:
+                return
+            fresh = Columns.from_rows([]) if deleted else load_columns(ids)
+            self._state = (state[0].replace(ids, fresh), state[1])
+
+    def _refresh_later(self, ids):
+        if self.app.config.get('TESTING'):
+            self.refresh(ids)
+            return
+
+        def job():
+            try:
+                with self.app.app_context():
+                    self.refresh(ids)
+            except Exception:
+                logger.exception('Re-reading products into the columnar index failed')
+        self._executor().submit(job)
+
+    def recheck(self, rows, filters, tax):
+        """Ids of the page `rows`, as just read from the database, that still
+        match `filters`. Rows the index holds differently were written by
+        another worker since its last build; they are queued for a re-read."""
+        state = self._state
+        if state is None or not rows:
+            return {row['id'] for row in rows}
+        fresh = Columns.from_rows([_row_values(row) for row in rows])
+        at, present = state[0]._positions(fresh.id)
+        changed = ~present
+        for name in FIELDS:
+            changed[present] |= getattr(state[0], name)[at] != getattr(fresh, name)[present]
+        if changed.any():
+            self._refresh_later(set(fresh.id[changed].tolist()))
+
+        matched = _all(_conditions(fresh, filters, tax), len(fresh))
+        category_id = tax.category_id(filters.get('category_slug'))
+        if category_id is not None:
+            matched &= _brand_mask(fresh.brand_id, tax.category_brands.get(category_id, ()))
+        return set(fresh.id[matched].tolist())
+
+    def _on_product_changed(self, sender, ids=(), deleted=False, **extra):
+        self.refresh(ids, deleted=deleted)
+
+    def _on_clicks_flushed(self, sender, counts=None, **extra):
+        # Re-read rather than add: a concurrent admin re-read may already
+        # include these clicks
+        self.refresh(counts or ())
+
+    # ----------- querying -----------
+
+    def query(self, filters, sort_by, page, limit, facets, keyset_mode, cursor, counted, tax,
+              histogram_buckets):
+        """Answer a filtered listing as a Selection, or None when it has to
+        run in SQL (index disabled or still building, or a request the
+        index doesn't handle). Raises InvalidCursor like the SQL path."""
+        columns = self.columns()
+        if columns is None:
+            return None
+        try:
+            return self._select(columns, filters, sort_by, page, limit, facets, keyset_mode, cursor,
+                                counted, tax, histogram_buckets)
+        except _Unsupported:
+            return None
+
+    def _select(self, columns, filters, sort_by, page, limit, facets, keyset_mode, cursor, counted, tax,
+                histogram_buckets):
+        if limit < 0 or (not keyset_mode and page < 1):
+            raise _Unsupported()
+
+        # An unknown category slug leaves the listing unscoped, as in SQL
+        category_id = tax.category_id(filters.get('category_slug'))
+        if category_id is not None:
+            columns = columns.take(np.flatnonzero(
+                _brand_mask(columns.brand_id, tax.category_brands.get(category_id, ()))))
+        size = len(columns)
+        conds = _conditions(columns, filters, tax)
+        matched = _all(conds, size)
+
+        summary = None
+        if counted:
+            summary = self._summary(columns, conds, matched, facets, histogram_buckets)
+
+        names, descending = sort_keys(sort_by)
+        key = None if names == ('id',) else getattr(columns, names[0])
+        candidates = np.flatnonzero(matched)
+        if key is not None and names[0] != 'price' and (key[candidates] == NULL).any():
+            # Postgres sorts NULLs first when descending; leave that to it
+            raise _Unsupported()
+
+        backwards = False
+        if keyset_mode:
+            descending, candidates, backwards = self._after(columns, key, names, descending, candidates,
+                                                            cursor, sort_by)
+            skip, k = 0, limit + 1
+        else:
+            skip = (page - 1) * limit
+            k = skip + limit
+        page_positions = _first(candidates, key, k, descending)[skip:]
+        return Selection(columns.id[page_positions].tolist(), 0 if keyset_mode else skip, backwards, summary)
+
+    def _after(self, columns, key, names, descending, candidates, cursor, sort_by):
+        # Same walk as pagination.keyset(): rows after the cursor's key,
+        # or before it (reading backwards) for a "prev" cursor
+        if not cursor:
+            return descending, candidates, False
+        direction, values = decode_cursor(cursor, sort_by)
+        backwards = direction == 'prev'
+        descending = descending != backwards
+        bound = [_cursor_value(name, value) for name, value in zip(names, values)]
+        ids = columns.id[candidates]
+        if key is None:
+            after = ids < bound[0] if descending else ids > bound[0]
+        else:
+            values = key[candidates]
+            if descending:
+                after = (values < bound[0]) | ((values == bound[0]) & (ids < bound[1]))
+            else:
+                after = (values > bound[0]) | ((values == bound[0]) & (ids > bound[1]))
+        return descending, candidates[after], backwards
+
+    def _summary(self, columns, conds, matched, facets, histogram_buckets):
+        # Price bounds only follow the brand filter, as in SQL
+        prices = columns.price[conds['brand']] if 'brand' in conds else columns.price
+        low = int(prices.min()) if len(prices) else None
+        high = int(prices.max()) if len(prices) else None
+
+        counts = {}
+        if 'brands' in facets:
+            per_brand = np.bincount(columns.brand_id[_all(conds, len(columns), 'brand')])
+            found = np.flatnonzero(per_brand)
+            counts['brands'] = dict(zip(found.tolist(), per_brand[found].tolist()))
+        for facet, cond, field in (('in_stock', 'stock', 'in_stock'), ('on_sale', 'sale', 'is_sale')):
+            if facet in facets:
+                flags = getattr(columns, field)[_all(conds, len(columns), cond)]
+                counts[facet] = {True: int(np.count_nonzero(flags == 1)), False: int(np.count_nonzero(flags == 0))}
+        if 'price' in facets and low is not None:
+            prices = columns.price[_all(conds, len(columns), 'price')]
+            if high > low:
+                # width_bucket(), whose numeric form divides exactly
+                buckets = np.minimum((prices - low) * histogram_buckets // (high - low) + 1, histogram_buckets)
+            else:
+                buckets = np.ones(len(prices), dtype=np.int64)
+            per_bucket = np.bincount(buckets)
+            found = np.flatnonzero(per_bucket)
+            counts['price'] = dict(zip(found.tolist(), per_bucket[found].tolist()))
+        elif 'price' in facets:
+            counts['price'] = {}
+
+        def price(cents):
+            return Decimal(cents).scaleb(-2) if cents is not None else None
+        return int(np.count_nonzero(matched)), price(low), price(high), counts
+
+
+columnar_index = ColumnarIndex()
+
+
+def _bench_params(columns, tax, rng):
+    # A random shop page: mostly one category, sometimes a few brands,
+    # a price band, flags, any sort, early pages, both paging modes
+    category = rng.choice([c.slug for c in tax.categories.values()]) if rng.random() < 0.75 else None
+    brands = None
+    if category and rng.random() < 0.3:
+        in_category = tax.category_brands.get(tax.category_id(category), ())
+        brands = [tax.brands[b].slug for b in rng.sample(in_category, min(len(in_category), rng.randint(1, 3)))]
+    low, high = sorted(np.quantile(columns.price, [rng.random(), rng.random()]) / 100)
+    keyset_mode = rng.random() < 0.3
+    return {
+        'filters': {
+            'category_slug': category,
+            'brand_slugs': brands,
+            'min_price': round(float(low), 2) if rng.random() < 0.4 else None,
+            'max_price': round(float(high), 2) if rng.random() < 0.4 else None,
+            'in_stock': rng.choice([None, None, True, False]),
+            'is_sale': rng.choice([None, None, None, True]),
+        },
+        'sort_by': rng.choice([None, *SORT_KEYS]),
+        'page': 1 if keyset_mode else rng.choice([1, 1, 1, 2, 3, 10]),
+        'limit': 12,
+        'facets': set(rng.sample(['price', 'brands', 'in_stock', 'on_sale'], rng.randint(0, 4))),
+        'keyset_mode': keyset_mode,
+        'cursor': None,
+        'with_total': rng.random() < 0.5,
+    }
+
+
+def _percentiles(timings):
+    timings = sorted(timings)
+    pick = lambda q: timings[min(len(timings) - 1, int(q * len(timings)))] * 1000
+    return f'mean {sum(timings) / len(timings) * 1000:7.1f}  p50 {pick(0.5):7.1f}  p95 {pick(0.95):7.1f}  p99 {pick(0.99):7.1f} ms'
+
+
+def _served(listing):
+    # SQL page rows also carry the summary columns; compare what is served
+    from services.facets import PAGE_COLUMNS
+    fields = [column.key for column in PAGE_COLUMNS] + ['brand_name', 'category_name']
+    return {**listing, 'products': [{name: row[name] for name in fields} for row in listing['products']]}
+
+
+def bench_listings(queries, seed=42, echo=print):
+    """Run `queries` random filter listings through the columnar index and
+    through SQL alone, check both give the same result and report timings.
+    Returns the number of mismatches."""
+    from services.facets import filtered_listing
+    from services import taxonomy
+
+    started = time.perf_counter()
+    columnar_index.rebuild()
+    columns = columnar_index.columns()
+    echo(f'Index: {len(columns)} products, {columns.nbytes / 2 ** 20:.1f} MiB, '
+         f'built in {time.perf_counter() - started:.1f}s')
+
+    rng = random.Random(seed)
+    tax = taxonomy.current()
+    timings = {'sql': [], 'columnar': []}
+    mismatches = 0
+    for _ in range(queries):
+        params = _bench_params(columns, tax, rng)
+        results = {}
+        for path in ('sql', 'columnar'):
+            columnar_index.enabled = path == 'columnar'
+            try:
+                begin = time.perf_counter()
+                results[path] = filtered_listing(**params)
+                timings[path].append(time.perf_counter() - begin)
+            finally:
+                columnar_index.enabled = True
+            db.session.rollback()
+        if _served(results['sql']) != _served(results['columnar']):
+            mismatches += 1
+            echo(f'MISMATCH {params}')
+    for path, values in timings.items():
+        echo(f'{path:9} {_percentiles(values)}')
+    return mismatches
+
+
+def init_app(app):
+    columnar_index.init_app(app)
+
+    @app.cli.command('bench-listing')
+    @click.option('--queries', default=300, show_default=True)
+    @click.option('--seed', default=42, show_default=True)
+    def bench_listing_command(queries, seed):
+        """Compare the filter endpoint's listing on the columnar index with
+        the SQL-only path: same results, and how long each takes."""
+        if bench_listings(queries, seed, click.echo):
+            raise SystemExit(1)
@@ -0,0 +1,60 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, make_response, current_app
+from services.cache import response_cache, SCOPES
+
+# Last-Modified for scopes that have not been written since startup
+BOOT_TIME = time.time()
+
+
+def validators(scopes, full_path=None):
+    """Strong ETag and Last-Modified for the current request (or full_path),
+    derived from the catalog scope versions alone; no query, no serialization.
+    The versions' epoch keeps a restarted process from reissuing old tags."""
+    versions = response_cache.versions(scopes)
+    tag = '|'.join(f'{scope}:{version}' for scope, (version, _) in zip(scopes, versions))
+    tag = f'{response_cache.epoch()}|{tag}'
+    etag = hashlib.sha1(f'{full_path or request.full_path}|{tag}'.encode()).hexdigest()[:32]
+    modified = max((bumped_at for _, bumped_at in versions), default=0.0) or BOOT_TIME
+    # HTTP dates have one-second resolution
+    last_modified = datetime.fromtimestamp(int(modified), tz=timezone.utc)
+    return etag, last_modified
+
+
+def not_modified(req, etag, last_modified):
+    if req.if_none_match:
+        # If-None-Match wins over If-Modified-Since when both are sent
+        return req.if_none_match.contains(etag)
+    since = req.if_modified_since
+    return since is not None and last_modified <= since
+
+
+def conditional(*scopes):
+    """Answer If-None-Match / If-Modified-Since with 304 before the view (and
+    its queries) run, and stamp ETag / Last-Modified on full responses."""
+    unknown = set(scopes) - set(SCOPES)
+    if unknown:
+        raise ValueError(f'Unknown cache scopes: {sorted(unknown)}')
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            etag, last_modified = validators(scopes)
+            if not_modified(request, etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'public, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,117 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+from sqlalchemy import bindparam, func
+from models import db, Product
+from services.signals import notify_clicks_flushed
+from services.stats import add_sales
+
+logger = logging.getLogger(__name__)
+
+
+class ClickCounter:
+    """Write-behind counter for product clicks.
+
+    Clicks accumulate in process and are flushed as one batched
+    ``UPDATE products SET sales_count = sales_count + n`` per product, at
+    most CLICK_FLUSH_INTERVAL seconds apart, sooner once CLICK_MAX_PENDING
+    clicks are waiting, and once more at interpreter shutdown.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._in_flight = Counter()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._at_exit = False
+        self.app = None
+        self.flush_interval = 5.0
+        self.max_pending = 1000
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('CLICK_FLUSH_INTERVAL', self.flush_interval)
+        self.max_pending = app.config.get('CLICK_MAX_PENDING', self.max_pending)
+        app.extensions['click_counter'] = self
+        if not app.config.get('TESTING'):
+            self.start()
+        if not self._at_exit:
+            atexit.register(self.stop)
+            self._at_exit = True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='click-counter', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Click flush failed; counts kept for the next attempt')
+
+    def record(self, product_id, n=1):
+        """Count n clicks and return how many are still unflushed for it."""
+        with self._lock:
+            self._pending[product_id] += n
+            waiting = self._pending[product_id] + self._in_flight[product_id]
+            backlog = sum(self._pending.values())
+        if backlog >= self.max_pending:
+            self._wake.set()
+        return waiting
+
+    def pending(self, product_id):
+        with self._lock:
+            return self._pending[product_id] + self._in_flight[product_id]
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, Counter()
+            self._in_flight.update(batch)
+
+        table = Product.__table__
+        stmt = (
+            table.update()
+            .where(table.c.id == bindparam('product_id'))
+            .values(sales_count=func.coalesce(table.c.sales_count, 0) + bindparam('clicks'))
+        )
+        params = [{'product_id': pid, 'clicks': n} for pid, n in sorted(batch.items())]
+        try:
+            with self.app.app_context():
+                db.session.execute(stmt, params)
+                add_sales(db.session.connection(), sum(batch.values()))
+                db.session.commit()
+        except Exception:
+            with self._lock:
+                self._pending.update(batch)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.subtract(batch)
+                self._in_flight = +self._in_flight
+
+        # Committed: nothing a receiver does may put the batch back
+        with self.app.app_context():
+            notify_clicks_flushed(batch)
+        return len(params)
+
+
+click_counter = ClickCounter()
@@ -0,0 +1,299 @@
+from sqlalchemy import select, func, case, and_, true, literal, tuple_
+from sqlalchemy.dialects.postgresql import JSON
+from models import db, Product
+from services.pagination import sort_keys, keyset, page_cursors, ordering
+from services import taxonomy
+from services.columnar import columnar_index
+
+# Facets the shop page can ask for with ?facets=price,brands,in_stock,on_sale
+FACETS = ('price', 'brands', 'in_stock', 'on_sale')
+PRICE_HISTOGRAM_BUCKETS = 10
+
+
+def parse_facets(raw):
+    # No ?facets param means "everything" (on offset pages, see filter_params),
+    # an empty one (or "none") means "nothing"
+    if raw is None:
+        return set(FACETS)
+    requested = {f.strip() for f in raw.split(',') if f.strip()}
+    return requested & set(FACETS)
+
+
+def _base_rows(category_id, tax):
+    # Narrow projection of the category-scoped candidate set. The remaining
+    # filters stay as separate conditions so each facet can ignore its own.
+    # Brand and category names come from the taxonomy snapshot, not a join.
+    query = select(
+        Product.id,
+        Product.price,
+        Product.brand_id,
+        Product.in_stock,
+        Product.is_sale,
+        Product.created_at,
+        Product.sales_count,
+    )
+    if category_id is not None:
+        query = query.where(Product.brand_id.in_(tax.category_brands.get(category_id, ())))
+    return query.cte('base')
+
+
+def _conditions(base, filters, tax):
+    brand_slugs = filters.get('brand_slugs')
+    min_price = filters.get('min_price')
+    max_price = filters.get('max_price')
+    in_stock = filters.get('in_stock')
+    is_sale = filters.get('is_sale')
+
+    price_conds = []
+    if min_price is not None:
+        price_conds.append(base.c.price >= min_price)
+    if max_price is not None:
+        price_conds.append(base.c.price <= max_price)
+
+    return {
+        'brand': base.c.brand_id.in_(tax.brand_ids(brand_slugs)) if brand_slugs else true(),
+        'price': and_(*price_conds) if price_conds else true(),
+        'stock': base.c.in_stock == in_stock if in_stock is not None else true(),
+        'sale': base.c.is_sale == is_sale if is_sale is not None else true(),
+    }
+
+
+def _all_except(conds, *skip):
+    return and_(*[cond for name, cond in conds.items() if name not in skip])
+
+
+def _facet_counts(base, summary, conds, facets):
+    bucket = case(
+        (summary.c.max_price > summary.c.min_price,
+         func.least(
+             func.width_bucket(base.c.price, summary.c.min_price, summary.c.max_price, PRICE_HISTOGRAM_BUCKETS),
+             PRICE_HISTOGRAM_BUCKETS,
+         )),
+        else_=1,
+    )
+    # facet name -> (grouping key columns, filter that facet ignores)
+    specs = {
+        'brands': ((base.c.brand_id,), 'brand'),
+        'in_stock': ((base.c.in_stock,), 'stock'),
+        'on_sale': ((base.c.is_sale,), 'sale'),
+        'price': ((bucket.label('bucket'),), 'price'),
+    }
+    requested = [name for name in FACETS if name in facets]
+    if not requested:
+        return None
+
+    # One scan of the candidate set answers every facet: each grouping set
+    # counts the rows matching all filters except its own.
+    columns = []
+    for name in requested:
+        keys, skip = specs[name]
+        columns.append(func.grouping(keys[0]).label(f'g_{name}'))
+        columns.extend(keys)
+        columns.append(func.count().filter(_all_except(conds, skip)).label(f'n_{name}'))
+
+    rows = (
+        select(*columns)
+        .select_from(base.join(summary, true()))
+        .group_by(func.grouping_sets(*[tuple_(*specs[name][0]) for name in requested]))
+        .subquery('facet_rows')
+    )
+    return select(func.json_agg(rows.table_valued(), type_=JSON)).scalar_subquery()
+
+
+# Columns of a listing page row
+PAGE_COLUMNS = (
+    Product.id,
+    Product.brand_id,
+    Product.title,
+    Product.images,
+    Product.image_variants,
+    Product.description,
+    Product.price,
+    Product.original_price,
+    Product.review_count,
+    Product.in_stock,
+    Product.is_new,
+    Product.is_sale,
+    Product.created_at,
+    Product.sales_count,
+)
+
+
+def filtered_listing(filters, sort_by=None, page=1, limit=12, facets=(),
+                     keyset_mode=False, cursor=None, with_total=True):
+    """Fetch one listing page, its total, the price bounds and the requested
+    facet counts in a single statement.
+
+    In keyset mode the page is located by ``cursor`` instead of an OFFSET and
+    the total/price-bounds scan only runs when with_total or facets ask for it.
+    Once the columnar index is built, everything but the page's rows comes
+    from it instead.
+    """
+    stmt, shape = listing_statement(filters, sort_by, page, limit, facets, keyset_mode, cursor, with_total)
+    return shape(db.session.execute(stmt).mappings().all())
+
+
+def listing_statement(filters, sort_by=None, page=1, limit=12, facets=(),
+                      keyset_mode=False, cursor=None, with_total=True):
+    """The filtered_listing statement and the function turning its mapping
+    rows into the result, for callers that execute it themselves."""
+    tax = taxonomy.current()
+    names, descending = sort_keys(sort_by)
+    counted = not (keyset_mode and not with_total and not facets)
+
+    def result(rows, summary, backwards, has_more=None):
+        listing = {'total': None, 'min_price': None, 'max_price': None, 'facets': {}}
+        if summary is not None:
+            total, min_price, max_price, counts = summary
+            listing.update(
+                total=total,
+                min_price=min_price,
+                max_price=max_price,
+                facets=_shape_facets(counts, min_price, max_price, facets, tax),
+            )
+        rows = [_with_names(row, tax) for row in rows]
+        if keyset_mode:
+            rows, listing['next_cursor'], listing['prev_cursor'] = page_cursors(
+                rows, lambda row: [row[name] for name in names], sort_by, limit, cursor, backwards, has_more
+            )
+        listing['products'] = rows
+        return listing
+
+    found = columnar_index.query(filters, sort_by, page, limit, facets, keyset_mode, cursor, counted, tax,
+                                 PRICE_HISTOGRAM_BUCKETS)
+    if found is not None:
+        # Only the page itself is read, in the index's order. The index may
+        # lag other workers' writes, so rows that no longer match are left out.
+        def shape(rows):
+            matching = columnar_index.recheck(rows, filters, tax)
+            by_id = {row['id']: row for row in rows if row['id'] in matching}
+            rows = [
+                {'position': found.offset + i, **by_id[product_id]}
+                for i, product_id in enumerate(found.ids, 1) if product_id in by_id
+            ]
+            has_more = len(found.ids) > limit if keyset_mode else None
+            return result(rows, found.summary, found.backwards, has_more)
+
+        return select(*PAGE_COLUMNS).where(Product.id.in_(found.ids)), shape
+
+    # An unknown slug leaves the listing unscoped, as before
+    base = _base_rows(tax.category_id(filters.get('category_slug')), tax)
+    conds = _conditions(base, filters, tax)
+    matched = _all_except(conds)
+
+    columns = [base.c[name] for name in names]
+    page_ids = select(base.c.id)
+    if keyset_mode:
+        after, order, backwards = keyset(columns, descending, cursor, sort_by)
+        if after is not None:
+            matched = and_(matched, after)
+        page_ids = page_ids.limit(limit + 1)
+    else:
+        order, backwards = ordering(columns, descending), False
+        page_ids = page_ids.offset((page - 1) * limit).limit(limit)
+
+    page_ids = (
+        page_ids.add_columns(func.row_number().over(order_by=order).label('position'))
+        .where(matched)
+        .order_by(*order)
+        .subquery('page_ids')
+    )
+    page_rows = (
+        select(page_ids.c.position, *PAGE_COLUMNS)
+        .join(Product, Product.id == page_ids.c.id)
+        .subquery('page_rows')
+    )
+
+    if not counted:
+        stmt = select(page_rows).order_by(page_rows.c.position)
+    else:
+        summary = (
+            select(
+                func.count().filter(_all_except(conds)).label('total'),
+                func.min(base.c.price).filter(conds['brand']).label('min_price'),
+                func.max(base.c.price).filter(conds['brand']).label('max_price'),
+            )
+            .cte('summary')
+        )
+        facet_json = _facet_counts(base, summary, conds, facets)
+        stmt = (
+            select(
+                summary.c.total,
+                summary.c.min_price,
+                summary.c.max_price,
+                (facet_json if facet_json is not None else literal(None, JSON)).label('facets'),
+                page_rows,
+            )
+            .select_from(summary.outerjoin(page_rows, true()))
+            .order_by(page_rows.c.position)
+        )
+
+    def shape(rows):
+        summary = None
+        if counted:
+            head = rows[0]
+            rows = [row for row in rows if row['id'] is not None]
+            summary = (head['total'], head['min_price'], head['max_price'],
+                       _grouped_counts(head['facets'] or [], facets))
+        return result(rows, summary, backwards)
+
+    return stmt, shape
+
+
+def _with_names(row, tax):
+    brand = tax.brand(row['brand_id'])
+    category = tax.category_of(brand)
+    return {
+        **row,
+        'brand_name': brand.name if brand else None,
+        'category_name': category.name if category else None,
+    }
+
+
+# facet name -> the key column of its grouping set
+FACET_KEYS = {'brands': 'brand_id', 'in_stock': 'in_stock', 'on_sale': 'is_sale', 'price': 'bucket'}
+
+
+def _grouped_counts(rows, facets):
+    # Grouping set rows -> {facet: {key: count}}
+    return {
+        name: {r[FACET_KEYS[name]]: r[f'n_{name}'] for r in rows if r.get(f'g_{name}') == 0}
+        for name in facets
+    }
+
+
+def _shape_facets(counts, min_price, max_price, facets, tax):
+    result = {}
+    if 'brands' in facets:
+        brands = ((tax.brand(brand_id), n) for brand_id, n in counts['brands'].items() if n)
+        result['brands'] = sorted(
+            (
+                {'id': brand.id, 'slug': brand.slug, 'name': brand.name, 'count': count}
+                for brand, count in brands
+                if brand is not None
+            ),
+            key=lambda b: (-b['count'], b['name']),
+        )
+    if 'in_stock' in facets:
+        result['in_stock'] = {'true': counts['in_stock'].get(True, 0), 'false': counts['in_stock'].get(False, 0)}
+    if 'on_sale' in facets:
+        result['on_sale'] = {'true': counts['on_sale'].get(True, 0), 'false': counts['on_sale'].get(False, 0)}
+    if 'price' in facets:
+        result['price_histogram'] = _histogram(counts['price'], min_price, max_price)
+    return result
+
+
+def _histogram(counts, min_price, max_price):
+    if min_price is None or max_price is None:
+        return []
+    low, high = float(min_price), float(max_price)
+    buckets = PRICE_HISTOGRAM_BUCKETS if high > low else 1
+    width = (high - low) / buckets
+    return [
+        {
+            'min': round(low + i * width, 2),
+            'max': round(low + (i + 1) * width, 2) if i < buckets - 1 else high,
+            'count': counts.get(i + 1, 0),
+        }
+        for i in range(buckets)
+    ]
@@ -0,0 +1,241 @@
+import base64
+import hashlib
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import click
+from PIL import Image, ImageOps, features
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.dialects.postgresql import insert
+from models import db, Product, ImageManifest
+from services.cache import response_cache
+from services.signals import product_changed
+from services.storage import uploader
+
+logger = logging.getLogger(__name__)
+
+# Derivative widths; an original narrower than one of these only gets the
+# widths below its own, or a single one at its own width
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_FORMATS = ('webp', 'avif') if features.check('avif') else ('webp',)
+QUALITY = {'webp': 80, 'avif': 60}
+
+# Cards are ~320 CSS px wide, so 640 covers 2x screens
+LISTING_WIDTH = 640
+LISTING_FORMAT = 'webp'
+
+# Originals fetched and rendered together when backfilling; each batch's
+# manifests are committed before the next is fetched
+FETCH_BATCH = 16
+# Products per refresh() in the process-images backfill
+BACKFILL_CHUNK = 500
+
+# Inline blurred placeholder (LQIP), a few hundred bytes of base64 WebP
+LQIP_WIDTH = 16
+
+
+def render_derivatives(data):
+    """Decode one original and encode its derivatives. Runs in a worker
+    process: takes and returns plain bytes/dicts only."""
+    with Image.open(io.BytesIO(data)) as original:
+        original.draft('RGB', (max(VARIANT_WIDTHS), max(VARIANT_WIDTHS)))
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    width, height = image.size
+
+    widths = [w for w in VARIANT_WIDTHS if w < width] or [width]
+    variants = []
+    for w in widths:
+        resized = image if w == width else image.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+        for fmt in VARIANT_FORMATS:
+            buf = io.BytesIO()
+            resized.save(buf, fmt.upper(), quality=QUALITY[fmt])
+            variants.append((w, fmt, buf.getvalue()))
+
+    tiny = image.resize((LQIP_WIDTH, max(1, round(height * LQIP_WIDTH / width))), Image.BILINEAR)
+    buf = io.BytesIO()
+    tiny.save(buf, 'WEBP', quality=30)
+    lqip = 'data:image/webp;base64,' + base64.b64encode(buf.getvalue()).decode()
+    return {'width': width, 'height': height, 'lqip': lqip, 'variants': variants}
+
+
+def _variant_name(url, width, fmt):
+    # Keyed by the original url, so re-processing overwrites in place
+    return f'{hashlib.sha1(url.encode()).hexdigest()[:16]}-{width}w.{fmt}'
+
+
+def listing_image(url, variants, width=LISTING_WIDTH):
+    """The smallest derivative at least `width` wide, else the original."""
+    manifest = (variants or {}).get(url)
+    if not manifest:
+        return url
+    sizes = sorted(int(w) for w in manifest['variants'])
+    chosen = next((w for w in sizes if w >= width), sizes[-1])
+    return manifest['variants'][str(chosen)].get(LISTING_FORMAT, url)
+
+
+def placeholder(url, variants):
+    manifest = (variants or {}).get(url)
+    return manifest['lqip'] if manifest else None
+
+
+class ImagePipeline:
+    """Resizes originals on a process pool and keeps product manifests
+    current. Uploads, product writes and imports all queue background
+    work on one thread, so a write's pass runs after the uploads before it."""
+
+    def __init__(self):
+        self.app = None
+        self.workers = 2
+        self.inline = False
+        self._processes = None
+        self._jobs = None
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('IMAGE_WORKERS', self.workers)
+        self.inline = app.config.get('TESTING', False)
+        app.extensions['image_pipeline'] = self
+        product_changed.connect(self._on_product_changed, app, weak=False)
+
+        @app.cli.command('process-images')
+        def process_images_command():
+            """Create derivatives for every product image that lacks them."""
+            count, last_id = 0, 0
+            while True:
+                ids = db.session.execute(
+                    select(Product.id).where(Product.id > last_id).order_by(Product.id).limit(BACKFILL_CHUNK)
+                ).scalars().all()
+                if not ids:
+                    break
+                count += self.refresh(ids)
+                last_id = ids[-1]
+            click.echo(f'Processed {count} images')
+
+    @property
+    def processes(self):
+        # Started on first use, after any forking server has forked
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=self.workers)
+        return self._processes
+
+    def derive(self, items):
+        """Render and upload derivatives for (url, original bytes) pairs.
+        Returns {url: manifest}; images that fail are logged and left out."""
+        rendering = [(url, self.processes.submit(render_derivatives, data)) for url, data in items]
+        manifests = {}
+        for url, future in rendering:
+            try:
+                rendered = future.result()
+                uploads = [
+                    (_variant_name(url, w, fmt), io.BytesIO(data)) for w, fmt, data in rendered['variants']
+                ]
+                urls = uploader.put_many(uploads)
+            except Exception:
+                logger.exception('Could not create derivatives for %s', url)
+                continue
+            variants = {}
+            for (w, fmt, _), variant_url in zip(rendered['variants'], urls):
+                variants.setdefault(str(w), {})[fmt] = variant_url
+            manifests[url] = {
+                'width': rendered['width'],
+                'height': rendered['height'],
+                'lqip': rendered['lqip'],
+                'variants': variants,
+            }
+        return manifests
+
+    def save(self, manifests):
+        if manifests:
+            stmt = insert(ImageManifest).values(
+                [{'url': url, 'manifest': manifest} for url, manifest in manifests.items()]
+            )
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['url'], set_={'manifest': stmt.excluded.manifest}
+            ))
+
+    def process_uploads(self, files, results):
+        """Queue derivatives for freshly uploaded files, from the bytes in
+        hand, so the upload response doesn't wait on rendering."""
+        items = []
+        for file, result in zip(files, results):
+            if 'url' in result:
+                file.stream.seek(0)
+                items.append((result['url'], file.stream.read()))
+        if items:
+            self._submit(self._derive_uploads, items)
+
+    def refresh(self, product_ids):
+        """Bring image_variants up to date for the given products, rendering
+        any image that has no manifest yet. Returns how many were rendered."""
+        products = db.session.execute(
+            select(Product.id, Product.images, Product.image_variants).where(Product.id.in_(product_ids))
+        ).all()
+        urls = {url for _, images, _ in products for url in images or () if url}
+        if not urls:
+            return 0
+        known = dict(db.session.execute(
+            select(ImageManifest.url, ImageManifest.manifest).where(ImageManifest.url.in_(urls))
+        ).all())
+
+        missing = sorted(urls - set(known))
+        rendered = 0
+        for start in range(0, len(missing), FETCH_BATCH):
+            batch = missing[start:start + FETCH_BATCH]
+            fetches = [(url, uploader.executor.submit(uploader.fetch_original, url)) for url in batch]
+            items = []
+            for url, future in fetches:
+                try:
+                    items.append((url, future.result()))
+                except Exception:
+                    logger.exception('Could not fetch %s', url)
+            # Committed per batch: what is already in storage stays recorded
+            manifests = self.derive(items)
+            self.save(manifests)
+            db.session.commit()
+            known.update(manifests)
+            rendered += len(manifests)
+
+        changes = []
+        for pid, images, current in products:
+            manifests = {url: known[url] for url in images or () if url in known}
+            if manifests != (current or {}):
+                changes.append({'pid': pid, 'variants': manifests or None})
+        if changes:
+            table = Product.__table__
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('pid')).values(image_variants=bindparam('variants')),
+                changes,
+            )
+        db.session.commit()
+        if changes:
+            response_cache.bump('product')
+        return rendered
+
+    def _derive_uploads(self, items):
+        self.save(self.derive(items))
+        db.session.commit()
+
+    def _run(self, job, *args):
+        with self.app.app_context():
+            try:
+                job(*args)
+            except Exception:
+                db.session.rollback()
+                logger.exception('Image job failed')
+
+    def _submit(self, job, *args):
+        if self.inline:
+            self._run(job, *args)
+            return
+        if self._jobs is None:
+            self._jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix='images')
+        self._jobs.submit(self._run, job, *args)
+
+    def _on_product_changed(self, sender, ids=(), deleted=False, **extra):
+        if deleted or not ids:
+            return
+        self._submit(self.refresh, list(ids))
+
+
+image_pipeline = ImagePipeline()
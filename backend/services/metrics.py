@@ -0,0 +1,232 @@
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_app_context, Response, abort
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds: seconds for timings, statements for query counts
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Longest parameter repr written to the slow query log
+MAX_LOGGED_PARAMETERS = 1000
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{n}="{_label_value(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, n=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class RequestTimings:
+    """What one request spent, filled in by the engine and JSON hooks."""
+
+    __slots__ = ('endpoint', 'started', 'queries', 'db', 'serialize')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+
+    def server_timing(self):
+        total = time.perf_counter() - self.started
+        return (
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+            f'serialize;dur={self.serialize * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+
+def _current():
+    return g.get('request_timings') if has_app_context() else None
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Counts JSON encoding, jsonify and streamed bodies alike, towards the
+    request's serialization time."""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            timings = _current()
+            if timings is not None:
+                timings.serialize += time.perf_counter() - started
+
+
+class Metrics:
+    """Per-endpoint request, SQL and serialization metrics, a Server-Timing
+    header on every response and a slow query log.
+
+    Values are kept per process; with several workers, let Prometheus
+    scrape each one (or sum them) rather than expecting one total.
+    DB time covers statement execution; rows later fetched from a
+    server-side cursor are not included.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.slow_query_ms = 200
+        self.token = None
+        self.requests = Counter(
+            'http_requests_total', 'Requests handled.', ('endpoint', 'method', 'status'))
+        self.duration = Histogram(
+            'http_request_duration_seconds', 'Time to the end of the response body.', ('endpoint', 'method'))
+        self.db_time = Histogram(
+            'http_request_db_seconds', 'Time spent executing SQL per request.', ('endpoint',))
+        self.db_queries = Histogram(
+            'http_request_db_queries', 'SQL statements per request.', ('endpoint',), QUERY_BUCKETS)
+        self.serialize_time = Histogram(
+            'http_request_serialize_seconds', 'Time spent encoding JSON per request.', ('endpoint',))
+        self.slow_queries = Counter(
+            'db_slow_queries_total', 'Statements slower than the slow query threshold.', ('endpoint',))
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.slow_query_ms = app.config.get('SLOW_QUERY_MS', self.slow_query_ms)
+        self.token = app.config.get('METRICS_TOKEN') or None
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+
+        app.json = TimedJSONProvider(app)
+        # On the Engine class, so every engine the app creates is covered
+        if not event.contains(Engine, 'before_cursor_execute', self._before_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        # Per-endpoint traffic and slow queries are not for the public
+        if self.token:
+            app.add_url_rule('/metrics', 'metrics', self.export)
+        else:
+            logger.warning('METRICS_TOKEN is not set; /metrics is not served')
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_started
+        timings = _current()
+        if timings is not None:
+            timings.queries += 1
+            timings.db += elapsed
+        if elapsed * 1000 >= self.slow_query_ms:
+            endpoint = timings.endpoint if timings is not None else '-'
+            self.slow_queries.inc(endpoint)
+            logger.warning(
+                'Slow query (%.1f ms) in %s: %s; parameters: %.*r',
+                elapsed * 1000, endpoint, statement, MAX_LOGGED_PARAMETERS, parameters,
+            )
+
+    def begin(self, endpoint):
+        """Start timing a request in the current app context."""
+        g.request_timings = RequestTimings(endpoint)
+        return g.request_timings
+
+    def record(self, timings, method, status):
+        endpoint = timings.endpoint
+        self.requests.inc(endpoint, method, status)
+        self.duration.observe(time.perf_counter() - timings.started, endpoint, method)
+        self.db_time.observe(timings.db, endpoint)
+        self.db_queries.observe(timings.queries, endpoint)
+        self.serialize_time.observe(timings.serialize, endpoint)
+
+    def _start(self):
+        rule = request.url_rule
+        self.begin(rule.rule if rule is not None else 'unmatched')
+
+    def _finish(self, response):
+        timings = g.get('request_timings')
+        if timings is None or request.endpoint == 'metrics':
+            return response
+        response.headers['Server-Timing'] = timings.server_timing()
+        method, status = request.method, response.status_code
+
+        # After the last byte, so streamed bodies are counted in full
+        response.call_on_close(lambda: self.record(timings, method, status))
+        return response
+
+    def export(self):
+        sent = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(sent.encode(), f'Bearer {self.token}'.encode()):
+            abort(401)
+        lines = []
+        for metric in (self.requests, self.duration, self.db_time, self.db_queries,
+                       self.serialize_time, self.slow_queries):
+            lines += metric.render()
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
@@ -0,0 +1,52 @@
+import os
+import click
+from sqlalchemy import text
+from models import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def pending_migrations():
+    applied = {
+        row[0] for row in db.session.execute(text('SELECT name FROM schema_migrations'))
+    }
+    names = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith('.sql'))
+    return [name for name in names if name not in applied]
+
+
+def apply_migrations():
+    """Apply every migrations/*.sql file not yet recorded, in name order."""
+    db.session.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        ' name VARCHAR(255) PRIMARY KEY,'
+        ' applied_at TIMESTAMPTZ NOT NULL DEFAULT now())'
+    ))
+    db.session.commit()
+
+    applied = []
+    for name in pending_migrations():
+        with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+            sql = f.read()
+        conn = db.session.connection()
+        for statement in _statements(sql):
+            conn.exec_driver_sql(statement)
+        db.session.execute(text('INSERT INTO schema_migrations (name) VALUES (:name)'), {'name': name})
+        db.session.commit()
+        applied.append(name)
+    return applied
+
+
+def _statements(sql):
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [s.strip() for s in '\n'.join(lines).split(';') if s.strip()]
+
+
+def init_app(app):
+    @app.cli.command('apply-migrations')
+    def apply_migrations_command():
+        """Apply pending SQL migrations from backend/migrations."""
+        applied = apply_migrations()
+        for name in applied:
+            click.echo(f'Applied {name}')
+        if not applied:
+            click.echo('Schema is up to date')
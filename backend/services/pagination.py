@@ -0,0 +1,103 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import tuple_
+
+# sort name -> (key column names, descending). Every sort ends on id so
+# rows with equal keys keep a stable order across pages.
+SORT_KEYS = {
+    'price_asc': (('price', 'id'), False),
+    'price_desc': (('price', 'id'), True),
+    'newest': (('created_at', 'id'), True),
+    'popularity': (('sales_count', 'id'), True),
+}
+DEFAULT_SORT_KEY = (('id',), False)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def sort_keys(sort_by):
+    return SORT_KEYS.get(sort_by, DEFAULT_SORT_KEY)
+
+
+def ordering(columns, descending):
+    return tuple(c.desc() if descending else c.asc() for c in columns)
+
+
+def _dump(value):
+    if isinstance(value, Decimal):
+        return ['d', str(value)]
+    if isinstance(value, datetime):
+        return ['t', value.isoformat()]
+    return value
+
+
+def _load(value):
+    if isinstance(value, list):
+        tag, raw = value
+        if tag == 'd':
+            return Decimal(raw)
+        if tag == 't':
+            return datetime.fromisoformat(raw)
+        raise InvalidCursor('Unknown cursor value')
+    return value
+
+
+def encode_cursor(sort_by, values, direction='next'):
+    payload = {'s': sort_by or '', 'd': direction, 'k': [_dump(v) for v in values]}
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, sort_by):
+    """Return (direction, key values) for a cursor issued for sort_by."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        values = [_load(v) for v in payload['k']]
+        direction = payload['d']
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor('Malformed cursor') from e
+
+    names, _ = sort_keys(sort_by)
+    if payload.get('s') != (sort_by or '') or len(values) != len(names) or direction not in ('next', 'prev'):
+        raise InvalidCursor('Cursor does not match this sort')
+    return direction, values
+
+
+def keyset(columns, descending, cursor, sort_by):
+    """Return (where clause or None, order by, reversed) for one keyset page.
+
+    A "prev" cursor walks the index backwards from the first row of the
+    current page; the caller flips the fetched rows back into display order.
+    """
+    if not cursor:
+        return None, ordering(columns, descending), False
+
+    direction, values = decode_cursor(cursor, sort_by)
+    backwards = direction == 'prev'
+    walk_descending = descending != backwards
+    key, bound = tuple_(*columns), tuple_(*values)
+    where = key < bound if walk_descending else key > bound
+    return where, ordering(columns, walk_descending), backwards
+
+
+def page_cursors(rows, key, sort_by, limit, cursor, backwards, has_more=None):
+    """Trim the limit + 1 probe row and build next/prev cursors for a page.
+    has_more overrides the probe when rows were dropped after the fact."""
+    if has_more is None:
+        has_more = len(rows) > limit
+    rows = list(rows[:limit])
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(sort_by, key(rows[-1]), 'next')
+        if cursor and (has_more or not backwards):
+            prev_cursor = encode_cursor(sort_by, key(rows[0]), 'prev')
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,141 @@
+import json
+from contextlib import contextmanager
+import click
+from sqlalchemy import event, select, func
+from models import db, Product
+from services.columnar import columnar_index
+
+# Below this many products the planner rightly prefers sequential scans, so
+# the checks only mean something against a large seeded catalog.
+MIN_PRODUCTS = 50000
+
+# (name, url, tables that must not be sequentially scanned, cost budget).
+# Budgets are planner cost units measured on a 100k product seed with
+# headroom; a plan that blows one has lost its index. {brand_id} and
+# {product_id} are filled from the data. Listings that aggregate the whole
+# candidate set (totals, facets) scan by design and only get a budget, as
+# do lookups in the small brand/category tables.
+PLAN_CHECKS = [
+    ('categories', '/api/categories', (), 500),
+    ('brands', '/api/brands', (), 500),
+    ('newest', '/api/products/newest', ('products',), 100),
+    ('bestsellers', '/api/products/bestsellers', ('products',), 100),
+    ('sale', '/api/products/sale', ('products',), 500),
+    ('minifilter', '/api/products/minifilter?brand_id={brand_id}', ('products',), 600),
+    ('detail', '/api/products/{product_id}', ('products',), 100),
+    ('similar', '/api/products/{product_id}/similar', ('products',), 500),
+    ('filter keyset price', '/api/products/filter?paginate=cursor&sort_by=price_asc&facets=none', ('products',), 500),
+    ('filter keyset newest', '/api/products/filter?paginate=cursor&sort_by=newest&facets=none', ('products',), 500),
+    ('filter keyset popularity', '/api/products/filter?paginate=cursor&sort_by=popularity&facets=none', ('products',), 500),
+    ('filter page with facets', '/api/products/filter?sort_by=price_asc', (), 300000),
+    ('admin products', '/api/admin/products', (), 10000),
+    ('admin products by brand', '/api/admin/products?brand_id={brand_id}&paginate=cursor', ('products',), 500),
+]
+
+
+@contextmanager
+def capture_statements():
+    """Collect (statement, parameters) for every SELECT sent in the block."""
+    captured = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        yield captured
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+
+
+def explain(statement, parameters):
+    row = db.session.connection().exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters).scalar()
+    plan = row if isinstance(row, list) else json.loads(row)
+    return plan[0]['Plan']
+
+
+def _nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from _nodes(child)
+
+
+def problems(plan, forbid_seq_scan, budget):
+    found = []
+    for node in _nodes(plan):
+        if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in forbid_seq_scan:
+            found.append(f"seq scan on {node['Relation Name']}")
+    if plan['Total Cost'] > budget:
+        found.append(f"cost {plan['Total Cost']:.0f} over budget {budget}")
+    return found
+
+
+def run_checks(client, min_products=MIN_PRODUCTS, verbose=False):
+    """EXPLAIN every statement each PLAN_CHECKS endpoint sends. Returns
+    [(name, [problems])] and a list of notices."""
+    notices = []
+    products = db.session.execute(select(func.count()).select_from(Product)).scalar()
+    if products < min_products:
+        notices.append(f'Only {products} products (want {min_products}); seq scans may be the right plan')
+
+    brand_id = db.session.execute(
+        select(Product.brand_id).group_by(Product.brand_id).order_by(func.count().desc()).limit(1)
+    ).scalar()
+    product_id = db.session.execute(select(func.max(Product.id))).scalar()
+    db.session.rollback()
+
+    # The budgets are for the SQL listing, the columnar index's fallback;
+    # with the index on, only the page's primary key lookup would be seen
+    columnar_enabled, columnar_index.enabled = columnar_index.enabled, False
+    try:
+        results = _check_endpoints(client, brand_id, product_id, verbose, notices)
+    finally:
+        columnar_index.enabled = columnar_enabled
+    return results, notices
+
+
+def _check_endpoints(client, brand_id, product_id, verbose, notices):
+    results = []
+    for name, url, forbid, budget in PLAN_CHECKS:
+        url = url.format(brand_id=brand_id, product_id=product_id)
+        with capture_statements() as captured:
+            response = client.get(url)
+            response.get_data()
+        if response.status_code != 200:
+            results.append((name, [f'{url} returned {response.status_code}']))
+            continue
+        found = []
+        for statement, parameters in captured:
+            plan = explain(statement, parameters)
+            if verbose:
+                notices.append(f"{name}: {plan['Node Type']} cost {plan['Total Cost']:.0f}")
+            found += problems(plan, forbid, budget)
+        db.session.rollback()
+        results.append((name, found))
+    return results
+
+
+def init_app(app):
+    @app.cli.command('check-plans')
+    @click.option('--min-products', default=MIN_PRODUCTS, show_default=True)
+    @click.option('--verbose', is_flag=True)
+    def check_plans_command(min_products, verbose):
+        """Fail when an endpoint's query plan regresses to a seq scan or
+        exceeds its cost budget. Run against a large seeded catalog."""
+        cache = app.extensions.get('response_cache')
+        if cache is not None:
+            cache.enabled = False
+        app.config['TESTING'] = True
+        results, notices = run_checks(app.test_client(), min_products, verbose)
+        for notice in notices:
+            click.echo(notice)
+        failed = 0
+        for name, found in results:
+            click.echo(f"{'FAIL' if found else 'ok  '} {name}")
+            for problem in found:
+                click.echo(f'       {problem}')
+            failed += bool(found)
+        if failed:
+            raise SystemExit(1)
@@ -0,0 +1,252 @@
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import case, cast, func, literal, select, update
+from models import db, Brand, Product
+from services.stats import apply_brand_deltas, apply_totals
+
+# Most rows one ?items= request may change; filters have no cap
+BULK_MAX_ITEMS = 1000
+
+MAX_PRICE = Decimal('99999999.99')  # DECIMAL(10, 2)
+
+
+class InvalidChange(ValueError):
+    pass
+
+
+def _price(value, nullable=False):
+    # Form fields arrive as strings; an emptied optional price clears it
+    if value in (None, '') and nullable:
+        return None
+    if isinstance(value, bool):
+        raise InvalidChange('must be a number')
+    try:
+        value = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise InvalidChange('must be a number')
+    if not value.is_finite() or value < 0 or value > MAX_PRICE:
+        raise InvalidChange(f'must be between 0 and {MAX_PRICE}')
+    return value
+
+
+def _integer(value):
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise InvalidChange('must be an integer')
+    return value
+
+
+def _count(value):
+    value = _integer(value)
+    if value < 0:
+        raise InvalidChange('must not be negative')
+    return value
+
+
+def _flag(value):
+    if not isinstance(value, bool):
+        raise InvalidChange('must be true or false')
+    return value
+
+
+def _title(value):
+    if not isinstance(value, str) or not value.strip() or len(value) > 255:
+        raise InvalidChange('must be a non-empty string of at most 255 characters')
+    return value
+
+
+def _text(value):
+    if value is not None and not isinstance(value, str):
+        raise InvalidChange('must be a string')
+    return value
+
+
+def _images(value):
+    if value is not None and (not isinstance(value, list) or not all(isinstance(u, str) for u in value)):
+        raise InvalidChange('must be a list of urls')
+    return value
+
+
+# Fields an admin may change on an existing product, with their checks
+EDITABLE = {
+    'images': _images,
+    'title': _title,
+    'description': _text,
+    'price': _price,
+    'original_price': lambda v: _price(v, nullable=True),
+    'review_count': _count,
+    'in_stock': _flag,
+    'is_new': _flag,
+    'is_sale': _flag,
+    'sales_count': _count,
+    'brand_id': _integer,
+}
+
+# Fields a filtered bulk update may multiply, e.g. {"price": 0.9}
+SCALABLE = ('price', 'original_price')
+
+
+def clean_changes(data, check_brands=True):
+    """Validate a {field: value} mapping of product changes, as sent to the
+    single-row PUT and in each bulk item. Unknown fields are ignored, like
+    the PUT always did; raises InvalidChange."""
+    if not isinstance(data, dict):
+        raise InvalidChange('Expected an object of field changes')
+    changes = {}
+    for field, check in EDITABLE.items():
+        if field in data:
+            try:
+                changes[field] = check(data[field])
+            except InvalidChange as e:
+                raise InvalidChange(f'{field} {e}')
+    if check_brands and 'brand_id' in changes:
+        _check_brands({changes['brand_id']})
+    return changes
+
+
+def _check_brands(brand_ids):
+    if brand_ids:
+        found = set(db.session.scalars(select(Brand.id).where(Brand.id.in_(brand_ids))))
+        if brand_ids - found:
+            raise InvalidChange(f'brand_id {min(brand_ids - found)} does not exist')
+
+
+def item_changes(items):
+    """Validate a bulk [{"id": ..., field: value}, ...] list into
+    {id: changes}; later items for the same id win field by field."""
+    if not isinstance(items, list) or not items:
+        raise InvalidChange('items must be a non-empty list')
+    if len(items) > BULK_MAX_ITEMS:
+        raise InvalidChange(f'At most {BULK_MAX_ITEMS} items per request')
+    by_id = {}
+    for item in items:
+        try:
+            product_id = _integer(item.get('id') if isinstance(item, dict) else None)
+        except InvalidChange:
+            raise InvalidChange('Every item needs an integer id')
+        fields = {k: v for k, v in item.items() if k != 'id'}
+        try:
+            changes = clean_changes(fields, check_brands=False)
+        except InvalidChange as e:
+            raise InvalidChange(f'item {product_id}: {e}')
+        by_id.setdefault(product_id, {}).update(changes)
+    if not any(by_id.values()):
+        raise InvalidChange('Nothing to change: items carry no editable fields')
+    _check_brands({c['brand_id'] for c in by_id.values() if 'brand_id' in c})
+    return by_id
+
+
+def filter_criteria(spec):
+    """WHERE criteria from {"brand_id", "category_id", "min_price", "max_price"}."""
+    if not isinstance(spec, dict):
+        raise InvalidChange('filter must be an object')
+    criteria = []
+    try:
+        if spec.get('brand_id') is not None:
+            criteria.append(Product.brand_id == _integer(spec['brand_id']))
+        if spec.get('category_id') is not None:
+            category_id = _integer(spec['category_id'])
+            criteria.append(Product.brand_id.in_(select(Brand.id).where(Brand.category_id == category_id)))
+        if spec.get('min_price') is not None:
+            criteria.append(Product.price >= _price(spec['min_price']))
+        if spec.get('max_price') is not None:
+            criteria.append(Product.price <= _price(spec['max_price']))
+    except InvalidChange as e:
+        raise InvalidChange(f'filter: {e}')
+    if not criteria:
+        raise InvalidChange('filter needs at least one of brand_id, category_id, min_price, max_price')
+    return criteria
+
+
+def expression_values(set_fields, multiply):
+    """SET clause of a filtered update: literal values plus multipliers."""
+    values = clean_changes(set_fields or {})
+    if not isinstance(multiply, dict):
+        raise InvalidChange('multiply must be an object')
+    for field, factor in multiply.items():
+        if field not in SCALABLE:
+            raise InvalidChange(f'multiply supports {", ".join(SCALABLE)}')
+        if field in values:
+            raise InvalidChange(f'{field} is both set and multiplied')
+        try:
+            factor = _price(factor)
+        except InvalidChange as e:
+            raise InvalidChange(f'multiply {field} {e}')
+        column = Product.__table__.c[field]
+        # NULL original prices stay NULL; results are capped to the column's range
+        values[field] = func.least(func.round(column * factor, 2), MAX_PRICE)
+    if not values:
+        raise InvalidChange('Nothing to change: give set and/or multiply')
+    return values
+
+
+def item_values(by_id):
+    """SET clause applying per-row values in one statement: each changed
+    column becomes CASE id WHEN ... THEN ... ELSE <current value> END."""
+    t = Product.__table__
+    values = {}
+    for field in EDITABLE:
+        column = t.c[field]
+        whens = {pid: cast(literal(c[field], column.type), column.type)
+                 for pid, c in by_id.items() if field in c}
+        if whens:
+            values[field] = case(whens, value=t.c.id, else_=column)
+    return values
+
+
+def bulk_update(criteria, values):
+    """Apply `values` to every product matching `criteria` as one UPDATE,
+    keeping the dashboard summary in step in the same transaction.
+
+    Returns the ids that were updated. The caller commits and notifies.
+    """
+    t = Product.__table__
+    if not values:
+        return []
+    # Lock and remember the old values the summary counters depend on
+    old = (
+        select(t.c.id, t.c.brand_id, t.c.in_stock, t.c.is_new, t.c.is_sale, t.c.sales_count)
+        .where(*criteria)
+        .with_for_update()
+        .cte('old')
+    )
+    flag = lambda column, default: func.coalesce(column, default).cast(db.Integer)
+    changed = (
+        update(t)
+        .where(t.c.id == old.c.id)
+        .values(values)
+        .returning(
+            t.c.id,
+            old.c.brand_id.label('old_brand_id'),
+            t.c.brand_id,
+            (flag(t.c.in_stock, True) - flag(old.c.in_stock, True)).label('in_stock'),
+            (flag(t.c.is_new, False) - flag(old.c.is_new, False)).label('is_new'),
+            (flag(t.c.is_sale, False) - flag(old.c.is_sale, False)).label('is_sale'),
+            (func.coalesce(t.c.sales_count, 0) - func.coalesce(old.c.sales_count, 0)).label('sales'),
+        )
+        .cte('changed')
+    )
+    rows = db.session.execute(
+        select(
+            changed.c.old_brand_id, changed.c.brand_id, func.count(),
+            func.sum(changed.c.in_stock), func.sum(changed.c.is_new), func.sum(changed.c.is_sale),
+            func.sum(changed.c.sales), func.array_agg(changed.c.id),
+        ).group_by(changed.c.old_brand_id, changed.c.brand_id)
+    ).all()
+
+    totals, brand_deltas, ids = Counter(), Counter(), []
+    for old_brand, new_brand, count, in_stock, is_new, is_sale, sales, group_ids in rows:
+        totals.update(in_stock=in_stock, out_of_stock=-in_stock, new_products=is_new,
+                      on_sale=is_sale, total_sales=sales)
+        if old_brand != new_brand:
+            brand_deltas[old_brand] -= count
+            brand_deltas[new_brand] += count
+        ids += group_ids
+
+    conn = db.session.connection()
+    apply_brand_deltas(conn, {k: v for k, v in brand_deltas.items() if v})
+    totals = {k: v for k, v in totals.items() if v}
+    if totals:
+        apply_totals(conn, totals)
+    return ids
@@ -0,0 +1,39 @@
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.orm import contains_eager, raiseload
+from models import db, Brand, Product
+
+
+def product_listing(*criteria, order_by=(), limit=None, with_taxonomy=False):
+    """Build a product listing statement whose relationships are loaded up
+    front, so serializing N rows never costs N extra queries.
+
+    with_taxonomy joins Brand and Category into the same statement and
+    populates ``product.brand`` and ``product.brand.category`` from it.
+    """
+    stmt = select(Product)
+    if with_taxonomy:
+        stmt = (
+            stmt.join(Product.brand)
+            .join(Brand.category)
+            .options(contains_eager(Product.brand).contains_eager(Brand.category))
+        )
+    if criteria:
+        stmt = stmt.where(*criteria)
+    if order_by:
+        stmt = stmt.order_by(*order_by)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return strict(stmt)
+
+
+def strict(stmt):
+    # In test mode any relationship the statement did not load up front
+    # raises instead of silently issuing one query per row.
+    if current_app.config.get('SQLALCHEMY_STRICT_LOADING'):
+        stmt = stmt.options(raiseload('*'))
+    return stmt
+
+
+def fetch_products(stmt):
+    return db.session.execute(stmt).scalars().all()
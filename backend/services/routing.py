@@ -0,0 +1,63 @@
+import time
+from flask import g, request, current_app, has_app_context
+from flask_sqlalchemy.session import Session
+from services.cache import response_cache
+
+# SQLALCHEMY_BINDS key of the read replica; no model is bound to it
+REPLICA_BIND = 'replica'
+
+# Set on a browser after an admin write; its reads stay on the primary
+# until the timestamp inside has passed
+PRIMARY_COOKIE = 'read_primary_until'
+
+# Invalidations that make a replica read unsafe to cache or tag. Click
+# flushes ("sales") are left out: counts are approximate anyway and they
+# bump every few seconds under traffic.
+LAG_SENSITIVE_SCOPES = ('product', 'taxonomy')
+
+
+class RoutingSession(Session):
+    """Sends a request's statements to the replica engine once the view has
+    opted in with use_replica(); writes, background jobs, the CLI and every
+    other request use the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_app_context() and g.get('db_replica')
+                and not getattr(clause, 'is_dml', False)):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _recently_written(window):
+    versions = response_cache.versions(LAG_SENSITIVE_SCOPES)
+    return max(bumped_at for _, bumped_at in versions) > time.time() - window
+
+
+def replica_allowed(cookies):
+    """Whether a read-only request may use the replica: not while the client
+    wrote recently (sticky cookie), nor while the catalog was written
+    within the lag window, so caches and ETags are never filled from a
+    lagging replica."""
+    window = current_app.config['DB_REPLICA_LAG_WINDOW']
+    until = cookies.get(PRIMARY_COOKIE, type=float)
+    if until is not None and until > time.time():
+        return False
+    return not _recently_written(window)
+
+
+def use_replica():
+    """Route this request's reads to the replica when replica_allowed()."""
+    if REPLICA_BIND in current_app.config.get('SQLALCHEMY_BINDS', {}) and replica_allowed(request.cookies):
+        g.db_replica = True
+
+
+def stick_to_primary(response):
+    """after_request hook for write endpoints: keep this client's reads on
+    the primary for the lag window after a successful write."""
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        window = current_app.config['DB_REPLICA_LAG_WINDOW']
+        response.set_cookie(PRIMARY_COOKIE, str(time.time() + window), max_age=int(window) + 1,
+                            path='/api', httponly=True, samesite='Lax')
+    return response
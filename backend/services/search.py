@@ -0,0 +1,282 @@
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select
+from models import db, Category, Brand, Product
+from services.signals import product_changed, taxonomy_changed
+from services.text import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Field weights for the BM25F-style score
+FIELD_WEIGHTS = {'title': 3.0, 'brand': 2.0, 'category': 1.5, 'description': 1.0}
+K1 = 1.2
+B = 0.75
+
+# Typo tolerance: vocabulary terms whose trigram overlap with a query term
+# reaches this Jaccard similarity count as matches, at a discount.
+FUZZY_MIN_SIMILARITY = 0.3
+FUZZY_MAX_EXPANSIONS = 5
+PREFIX_MAX_EXPANSIONS = 10
+
+
+def _trigrams(term):
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Documents:
+    """The inverted index itself: postings, document lengths and the
+    vocabulary lookups. Changed in place by SearchIndex, under its lock."""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)      # term -> {product id: weighted tf}
+        self.doc_terms = {}                    # product id -> {term: weighted tf}
+        self.doc_lengths = {}                  # product id -> weighted length
+        self.total_length = 0.0
+        self.trigrams = defaultdict(set)       # trigram -> terms
+        self.vocabulary = []                   # sorted terms, for prefix lookups
+
+    def add(self, product_id, title, description, brand, category):
+        fields = {'title': title, 'description': description, 'brand': brand, 'category': category}
+        weights = defaultdict(float)
+        for field, text in fields.items():
+            for term in tokenize(text):
+                weights[term] += FIELD_WEIGHTS[field]
+
+        self.doc_terms[product_id] = dict(weights)
+        self.doc_lengths[product_id] = sum(weights.values())
+        self.total_length += self.doc_lengths[product_id]
+        for term, weight in weights.items():
+            if term not in self.postings:
+                self._add_term(term)
+            self.postings[term][product_id] = weight
+
+    def _add_term(self, term):
+        for gram in _trigrams(term):
+            self.trigrams[gram].add(term)
+        position = bisect_left(self.vocabulary, term)
+        self.vocabulary.insert(position, term)
+
+    def remove(self, product_id):
+        terms = self.doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_lengths.pop(product_id)
+        for term in terms:
+            docs = self.postings[term]
+            docs.pop(product_id, None)
+            if not docs:
+                del self.postings[term]
+                for gram in _trigrams(term):
+                    self.trigrams[gram].discard(term)
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+
+    def expand(self, token, is_last):
+        # query token -> {vocabulary term: match weight}
+        matches = {}
+        if token in self.postings:
+            matches[token] = 1.0
+
+        if is_last:
+            # As-you-type: the last token also matches as a prefix
+            start = bisect_left(self.vocabulary, token)
+            for term in self.vocabulary[start:start + PREFIX_MAX_EXPANSIONS]:
+                if not term.startswith(token):
+                    break
+                matches.setdefault(term, 0.9)
+
+        if len(token) >= 3:
+            grams = _trigrams(token)
+            overlap = defaultdict(int)
+            for gram in grams:
+                for term in self.trigrams.get(gram, ()):
+                    overlap[term] += 1
+            scored = []
+            for term, shared in overlap.items():
+                similarity = shared / (len(grams) + len(_trigrams(term)) - shared)
+                if similarity >= FUZZY_MIN_SIMILARITY and term not in matches:
+                    scored.append((similarity, term))
+            for similarity, term in sorted(scored, reverse=True)[:FUZZY_MAX_EXPANSIONS]:
+                matches[term] = 0.8 * similarity
+        return matches
+
+
+class SearchIndex:
+    """In-process inverted index over product title, description, brand name
+    and category name.
+
+    Built from one query on first use and kept current by the
+    product_changed signal. Full rebuilds (taxonomy renames, or every
+    SEARCH_INDEX_MAX_AGE seconds to pick up other workers' writes) fill a
+    fresh index in the background; searches use the old one until it is
+    swapped in.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.max_age = None
+        # Guards the current Documents while they are read or changed
+        self._lock = threading.RLock()
+        self._documents = None
+        self._built_at = None
+        self._build_lock = threading.Lock()
+        self._schedule_lock = threading.Lock()
+        self._scheduled = False
+        self._jobs = None
+        # Ids changed while a background build runs, re-read before the swap
+        self._dirty = None
+
+    def init_app(self, app):
+        self.app = app
+        self.max_age = app.config.get('SEARCH_INDEX_MAX_AGE')
+        with self._lock:
+            self._documents = None
+
+    # ----------- building -----------
+
+    def _document_rows(self, ids=None):
+        stmt = (
+            select(Product.id, Product.title, Product.description, Brand.name, Category.name)
+            .join(Brand, Product.brand_id == Brand.id)
+            .join(Category, Brand.category_id == Category.id)
+        )
+        if ids is not None:
+            stmt = stmt.where(Product.id.in_(ids))
+        return db.session.execute(stmt.execution_options(yield_per=2000))
+
+    def rebuild(self, if_missing=False):
+        """Build a fresh index and swap it in; searches keep using the
+        current one meanwhile. Returns the number of products indexed."""
+        with self._build_lock:
+            # Concurrent first searches wait for one build instead of each running one
+            if if_missing and self._documents is not None:
+                return len(self._documents.doc_lengths)
+            with self._lock:
+                self._dirty = set()
+            started = time.monotonic()
+            documents = Documents()
+            try:
+                for row in self._document_rows():
+                    documents.add(*row)
+            except Exception:
+                with self._lock:
+                    self._dirty = None
+                raise
+            with self._lock:
+                dirty, self._dirty = self._dirty, None
+                self._apply(documents, dirty)
+                self._documents, self._built_at = documents, started
+            return len(documents.doc_lengths)
+
+    def ensure_built(self):
+        if self._documents is None:
+            self.rebuild(if_missing=True)
+        elif self.max_age and time.monotonic() - self._built_at > self.max_age:
+            # Searches until the rebuild is swapped in don't queue another
+            self._built_at = time.monotonic()
+            self.refresh()
+
+    def refresh(self):
+        """Queue a background rebuild, coalesced with one already queued."""
+        if self.app is None or self.app.config.get('TESTING'):
+            if self.app is not None:
+                with self.app.app_context():
+                    self.rebuild()
+            return
+        with self._schedule_lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+            if self._jobs is None:
+                self._jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-index')
+        self._jobs.submit(self._run)
+
+    def _run(self):
+        # Cleared before building, so a rename landing mid-build queues another
+        with self._schedule_lock:
+            self._scheduled = False
+        try:
+            with self.app.app_context():
+                self.rebuild()
+        except Exception:
+            logger.exception('Rebuilding the search index failed')
+
+    def _apply(self, documents, ids):
+        if not ids:
+            return
+        for product_id in ids:
+            documents.remove(product_id)
+        for row in self._document_rows(ids):
+            documents.add(*row)
+
+    def update(self, ids, deleted=False):
+        """Re-read (or drop) just the given products."""
+        with self._lock:
+            if self._dirty is not None:
+                self._dirty.update(ids)
+            if self._documents is None:
+                return
+            if deleted:
+                for product_id in ids:
+                    self._documents.remove(product_id)
+            else:
+                self._apply(self._documents, ids)
+
+    # ----------- querying -----------
+
+    def search(self, query, offset=0, limit=20):
+        """Return (total matches, product ids for the requested slice) ranked
+        by relevance. Products matching more query tokens always rank first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+
+        self.ensure_built()
+        with self._lock:
+            documents = self._documents
+            doc_count = len(documents.doc_lengths)
+            if not doc_count:
+                return 0, []
+            avg_length = documents.total_length / doc_count
+
+            scores = defaultdict(float)
+            matched_tokens = defaultdict(int)
+            for i, token in enumerate(tokens):
+                best = {}
+                for term, match_weight in documents.expand(token, i == len(tokens) - 1).items():
+                    docs = documents.postings[term]
+                    idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for product_id, tf in docs.items():
+                        norm = K1 * (1 - B + B * documents.doc_lengths[product_id] / avg_length)
+                        score = match_weight * idf * tf * (K1 + 1) / (tf + norm)
+                        if score > best.get(product_id, 0.0):
+                            best[product_id] = score
+                for product_id, score in best.items():
+                    scores[product_id] += score
+                    matched_tokens[product_id] += 1
+
+        ranked = sorted(scores, key=lambda pid: (-matched_tokens[pid], -scores[pid], pid))
+        return len(ranked), ranked[offset:offset + limit]
+
+
+search_index = SearchIndex()
+
+
+def _on_product_changed(sender, ids=(), deleted=False, **extra):
+    search_index.update(ids, deleted=deleted)
+
+
+def _on_taxonomy_changed(sender, **extra):
+    # Brand/category names are denormalized into every document
+    search_index.refresh()
+
+
+def init_app(app):
+    search_index.init_app(app)
+    product_changed.connect(_on_product_changed, app)
+    taxonomy_changed.connect(_on_taxonomy_changed, app)
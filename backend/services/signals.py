@@ -0,0 +1,44 @@
+import logging
+from blinker import Namespace
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Sent by the admin blueprint after a catalog write has been committed.
+# Receivers keep derived, in-process state (search index, caches, ...) in step.
+catalog_signals = Namespace()
+
+# kwargs: ids (list of product ids), deleted (bool)
+product_changed = catalog_signals.signal('product-changed')
+
+# Categories or brands were created, renamed, moved or deleted.
+# kwargs: category_ids (categories whose set of products changed: both
+# ends of a brand move, a deleted brand's category)
+taxonomy_changed = catalog_signals.signal('taxonomy-changed')
+
+# Buffered click counts reached products.sales_count.
+# kwargs: counts ({product id: clicks added})
+clicks_flushed = catalog_signals.signal('clicks-flushed')
+
+
+def notify_product_changed(ids, deleted=False):
+    product_changed.send(current_app._get_current_object(), ids=list(ids), deleted=deleted)
+
+
+def notify_taxonomy_changed(category_ids=()):
+    # Swapped before the send: receivers run in no fixed order, and those
+    # that resolve slugs or names (cache, search, home) must see the new one
+    from services.taxonomy import taxonomy_snapshot
+    taxonomy_snapshot.refresh()
+    taxonomy_changed.send(current_app._get_current_object(), category_ids=list(category_ids))
+
+
+def notify_clicks_flushed(counts):
+    # Sent from the flusher thread after the commit: a failing receiver is
+    # logged and the others still run
+    sender = current_app._get_current_object()
+    for receiver in clicks_flushed.receivers_for(sender):
+        try:
+            receiver(sender, counts=dict(counts))
+        except Exception:
+            logger.exception('clicks-flushed receiver %r failed', receiver)
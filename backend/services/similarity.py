@@ -0,0 +1,345 @@
+import logging
+import threading
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import click
+import numpy as np
+from sqlalchemy import select, delete, insert, func
+from models import db, Brand, Product, ProductSimilarity
+from services.queries import product_listing, fetch_products
+from services.signals import product_changed, taxonomy_changed
+from services.text import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Neighbours stored per product; the endpoint serves the first few
+TOP_N = 12
+
+# Title/description terms are hashed into this many TF-IDF dimensions
+HASH_DIM = 1024
+TITLE_WEIGHT = 2.0
+
+# Score = text cosine + same brand bonus + price proximity. Candidates are
+# blocked by category, so the category match is implied by every pair.
+TEXT_WEIGHT = 0.6
+BRAND_WEIGHT = 0.25
+PRICE_WEIGHT = 0.15
+# Prices this far apart in log space (about 1.65x) score 1/e on proximity
+PRICE_SCALE = 0.5
+
+# Rows of the similarity matrix scored per NumPy batch
+SCORE_BATCH = 512
+
+
+def _bucket(term):
+    # crc32 rather than hash(): stable across processes and restarts
+    return zlib.crc32(term.encode()) % HASH_DIM
+
+
+def _term_counts(title, description):
+    counts = Counter()
+    for term in tokenize(title):
+        counts[_bucket(term)] += TITLE_WEIGHT
+    for term in tokenize(description):
+        counts[_bucket(term)] += 1.0
+    return counts
+
+
+def _vectors(documents):
+    """L2-normalised TF-IDF rows (float32, n x HASH_DIM) for one block."""
+    tf = np.zeros((len(documents), HASH_DIM), dtype=np.float32)
+    for i, counts in enumerate(documents):
+        if counts:
+            tf[i, list(counts)] = np.log1p(list(counts.values()))
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + len(documents)) / (1 + df)).astype(np.float32) + 1
+    tf *= idf
+    norms = np.linalg.norm(tf, axis=1, keepdims=True)
+    return tf / np.maximum(norms, 1e-9)
+
+
+class Block:
+    """One category's products, vectorised for scoring."""
+
+    def __init__(self, ids, brand_ids, prices, documents):
+        self.ids = np.asarray(ids)
+        self.brand_ids = np.asarray(brand_ids)
+        self.log_prices = np.log(np.maximum(np.asarray(prices, dtype=np.float64), 0.01))
+        self.vectors = _vectors(documents)
+        self.position = {int(pid): i for i, pid in enumerate(ids)}
+        self.k = min(TOP_N, len(ids) - 1)
+
+    def scores(self, rows):
+        """Scores of the products at `rows` against the whole block (a
+        product never scores against itself). Symmetric: the same matrix,
+        read by column, is every product's score against `rows`."""
+        scores = TEXT_WEIGHT * (self.vectors[rows] @ self.vectors.T)
+        scores += BRAND_WEIGHT * (self.brand_ids[rows, None] == self.brand_ids[None, :])
+        scores += PRICE_WEIGHT * np.exp(-np.abs(self.log_prices[rows, None] - self.log_prices[None, :]) / PRICE_SCALE)
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return scores
+
+    def top(self, rows):
+        """{product id: [(neighbour id, score), ...]} for the products at
+        `rows`, SCORE_BATCH of them per matrix product."""
+        k = self.k
+        if k <= 0:
+            return {int(self.ids[r]): [] for r in rows}
+        neighbours = {}
+        for start in range(0, len(rows), SCORE_BATCH):
+            batch = rows[start:start + SCORE_BATCH]
+            scores = self.scores(batch)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            for r, cols, vals in zip(batch, top, top_scores):
+                neighbours[int(self.ids[r])] = [(int(self.ids[c]), float(v)) for c, v in zip(cols, vals)]
+        return neighbours
+
+
+def score_block(ids, brand_ids, prices, documents):
+    """Top-N neighbours for every product of one category block, as
+    {product id: [(neighbour id, score), ...]}."""
+    return Block(ids, brand_ids, prices, documents).top(np.arange(len(ids)))
+
+
+def _load_block(category_id):
+    stmt = (
+        select(Product.id, Product.brand_id, Product.price, Product.title, Product.description)
+        .join(Brand, Product.brand_id == Brand.id)
+        .where(Brand.category_id == category_id)
+        .order_by(Product.id)
+        .execution_options(yield_per=2000)
+    )
+    ids, brand_ids, prices, documents = [], [], [], []
+    for pid, brand_id, price, title, description in db.session.execute(stmt):
+        ids.append(pid)
+        brand_ids.append(brand_id)
+        prices.append(float(price))
+        documents.append(_term_counts(title, description))
+    return ids, brand_ids, prices, documents
+
+
+def _store(neighbours):
+    table = ProductSimilarity.__table__
+    db.session.execute(delete(table).where(table.c.product_id.in_(list(neighbours))))
+    rows = [
+        {'product_id': pid, 'rank': rank, 'similar_id': sid, 'score': score}
+        for pid, pairs in neighbours.items()
+        for rank, (sid, score) in enumerate(pairs)
+    ]
+    if rows:
+        db.session.execute(insert(table), rows)
+
+
+def rebuild_categories(category_ids):
+    """Recompute the neighbour lists of every product in the given
+    categories, one transaction per category."""
+    products = 0
+    for category_id in sorted(set(category_ids)):
+        block = _load_block(category_id)
+        if block[0]:
+            _store(score_block(*block))
+        db.session.commit()
+        products += len(block[0])
+    return products
+
+
+def rebuild_similarity():
+    """Recompute every list, one category (and transaction) at a time; the
+    other categories keep serving their current lists meanwhile."""
+    category_ids = db.session.execute(select(Brand.category_id).distinct()).scalars().all()
+    products = rebuild_categories(category_ids)
+    # Lists of products no category block covers any more
+    blocked = select(Product.id).join(Brand, Product.brand_id == Brand.id)
+    db.session.execute(delete(ProductSimilarity).where(ProductSimilarity.product_id.not_in(blocked)))
+    db.session.commit()
+    return products
+
+
+def _list_bounds(category_id):
+    # {product id: (stored neighbours, lowest stored score)} for a category
+    table = ProductSimilarity.__table__
+    in_block = (
+        select(Product.id).join(Brand, Product.brand_id == Brand.id).where(Brand.category_id == category_id)
+    )
+    rows = db.session.execute(
+        select(table.c.product_id, func.count(), func.min(table.c.score))
+        .where(table.c.product_id.in_(in_block))
+        .group_by(table.c.product_id)
+    )
+    return {pid: (count, low) for pid, count, low in rows}
+
+
+def _stored_lists(product_ids):
+    # {product id: [(neighbour id, score), ...]} in rank order
+    table = ProductSimilarity.__table__
+    lists = defaultdict(list)
+    rows = db.session.execute(
+        select(table.c.product_id, table.c.similar_id, table.c.score)
+        .where(table.c.product_id.in_(product_ids))
+        .order_by(table.c.product_id, table.c.rank)
+    )
+    for pid, sid, score in rows:
+        lists[pid].append((sid, score))
+    return lists
+
+
+def _update_block(category_id, rescore, written):
+    """Rescore the products in `rescore` against the category's block and
+    offer each other product the `written` ones as neighbours."""
+    block = Block(*_load_block(category_id))
+    rows = np.array(sorted(block.position[pid] for pid in rescore if pid in block.position), dtype=np.intp)
+    if not len(rows):
+        return 0
+    neighbours = block.top(rows)
+
+    written_rows = np.array(sorted(block.position[pid] for pid in written if pid in block.position),
+                            dtype=np.intp)
+    if len(written_rows) and block.k > 0:
+        scores = block.scores(written_rows)
+        best = scores.max(axis=0)
+        stats = _list_bounds(category_id)
+        count = np.array([stats.get(int(pid), (0, None))[0] for pid in block.ids])
+        low = np.array([stats.get(int(pid), (0, -np.inf))[1] for pid in block.ids], dtype=np.float64)
+        # Products whose list a written product now enters. Products with
+        # no list yet keep the endpoint's fallback until a rebuild.
+        improves = (count > 0) & ((count < block.k) | (best > low))
+        improves[rows] = False
+        candidates = np.flatnonzero(improves)
+        if len(candidates):
+            written_ids = {int(block.ids[r]) for r in written_rows}
+            lists = _stored_lists([int(block.ids[c]) for c in candidates])
+            for c in candidates:
+                pid = int(block.ids[c])
+                pairs = [pair for pair in lists.get(pid, []) if pair[0] not in written_ids]
+                pairs += [(int(block.ids[r]), float(scores[j, c])) for j, r in enumerate(written_rows)
+                          if r != c]
+                pairs = sorted(pairs, key=lambda pair: -pair[1])[:block.k]
+                if pairs != lists.get(pid, []):
+                    neighbours[pid] = pairs
+
+    _store(neighbours)
+    return len(neighbours)
+
+
+def update_similarity(ids):
+    """Patch the neighbour lists after writes to the given products.
+
+    Per category involved, the written products and the products that
+    listed them (covers deletions and category moves) are rescored against
+    the block. Every other product only compares its stored list with its
+    scores against the written products, which the same matrix product
+    gives, so a write costs O(block size) rather than a block rebuild.
+    Untouched scores keep the block's IDF from when they were computed;
+    `flask rebuild-similarity` rescores everything.
+    """
+    ids = {int(pid) for pid in ids}
+    if not ids:
+        return 0
+    current = (
+        select(Product.id, Brand.category_id)
+        .join(Brand, Product.brand_id == Brand.id)
+        .where(Product.id.in_(ids))
+    )
+    referencing = (
+        select(ProductSimilarity.product_id, Brand.category_id)
+        .join(Product, Product.id == ProductSimilarity.product_id)
+        .join(Brand, Product.brand_id == Brand.id)
+        .where(ProductSimilarity.similar_id.in_(ids))
+    )
+    rescore = defaultdict(set)
+    for pid, category_id in db.session.execute(current.union(referencing)):
+        rescore[category_id].add(pid)
+
+    products = 0
+    for category_id in sorted(rescore):
+        products += _update_block(category_id, rescore[category_id], ids)
+        db.session.commit()
+    return products
+
+
+def neighbour_listing(product_id, limit=4):
+    return product_listing(
+        ProductSimilarity.product_id == product_id,
+        order_by=(ProductSimilarity.rank,),
+        limit=limit,
+    ).join(ProductSimilarity, ProductSimilarity.similar_id == Product.id)
+
+
+def similar_products(product_id, limit=4):
+    """Stored neighbours of a product in rank order, or None when the index
+    has nothing for it yet."""
+    return fetch_products(neighbour_listing(product_id, limit)) or None
+
+
+def _refresh(ids=None, category_ids=()):
+    try:
+        if category_ids:
+            rebuild_categories(category_ids)
+        if ids is None:
+            rebuild_similarity()
+        elif ids:
+            update_similarity(ids)
+    except Exception:
+        # The catalog write is already committed; the endpoint falls back to
+        # the legacy query until the next rebuild
+        db.session.rollback()
+        logger.exception('Similarity rebuild failed')
+
+
+# Writes queue their product ids (and re-blocked categories) here; one
+# background worker drains them, so a burst of admin writes is patched in
+# one pass, off the request thread
+_pending = set()
+_pending_categories = set()
+_pending_lock = threading.Lock()
+_jobs = None
+
+
+def _drain(app):
+    with _pending_lock:
+        ids, category_ids = list(_pending), list(_pending_categories)
+        _pending.clear()
+        _pending_categories.clear()
+    if ids or category_ids:
+        with app.app_context():
+            _refresh(ids, category_ids)
+
+
+def _schedule(app, ids=(), category_ids=()):
+    global _jobs
+    if app.config.get('TESTING'):
+        _refresh(list(ids), list(category_ids))
+        return
+    with _pending_lock:
+        _pending.update(ids)
+        _pending_categories.update(category_ids)
+        if _jobs is None:
+            _jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similarity')
+    _jobs.submit(_drain, app)
+
+
+def _on_product_changed(sender, ids=(), deleted=False, **extra):
+    _schedule(sender, ids=ids)
+
+
+def _on_taxonomy_changed(sender, category_ids=(), **extra):
+    # Only brand moves and deletions re-block categories; renames don't
+    # change any score
+    if category_ids:
+        _schedule(sender, category_ids=category_ids)
+
+
+def init_app(app):
+    product_changed.connect(_on_product_changed, app)
+    taxonomy_changed.connect(_on_taxonomy_changed, app)
+
+    @app.cli.command('rebuild-similarity')
+    def rebuild_similarity_command():
+        """Recompute the similar products index from scratch."""
+        count = rebuild_similarity()
+        click.echo(f'Similar products rebuilt for {count} products')
@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """A value derived from the catalog, built once per process and then
+    rebuilt off the request thread whenever one of `signals` fires.
+
+    Readers get the current value without touching the database; only the
+    first read in a process builds inline. Rebuilds are coalesced: a burst
+    of writes costs one rebuild after the one in progress. Other workers'
+    writes don't reach this process, so a value older than `max_age`
+    seconds is served once more while a rebuild is queued.
+
+    With background=False a signal rebuilds inline instead, in the writing
+    request, so the writer's next read already sees the new value; meant
+    for values that are cheap to build.
+    """
+
+    def __init__(self, name, build, signals=(), max_age=None, background=True):
+        self.name = name
+        self.build = build
+        self.signals = signals
+        self.max_age = max_age
+        self.background = background
+        self.app = None
+        # (value, monotonic time the build started), swapped in one assignment
+        self._state = None
+        self._build_lock = threading.Lock()
+        self._schedule_lock = threading.Lock()
+        self._scheduled = False
+        self._jobs = None
+
+    def init_app(self, app, max_age=None):
+        self.app = app
+        self._state = None
+        if max_age is not None:
+            self.max_age = max_age
+        app.extensions[f'{self.name}_snapshot'] = self
+        for signal in self.signals:
+            signal.connect(self._on_change, app)
+
+    def get(self):
+        state = self._state
+        if state is None:
+            with self._build_lock:
+                if self._state is None:
+                    self._rebuild()
+            state = self._state
+        elif self.max_age and time.monotonic() - state[1] > self.max_age:
+            self.refresh(background=True)
+        return state[0]
+
+    def _rebuild(self):
+        started = time.monotonic()
+        self._state = (self.build(), started)
+
+    def refresh(self, background=None):
+        """Queue a rebuild; the current value is served until it is done."""
+        if background is None:
+            background = self.background
+        if not background or self.app.config.get('TESTING'):
+            # A fresh app context: its own session, reading the primary
+            with self._build_lock, self.app.app_context():
+                self._rebuild()
+            return
+        with self._schedule_lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+            if self._jobs is None:
+                self._jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{self.name}-snapshot')
+        self._jobs.submit(self._run)
+
+    def _run(self):
+        # Cleared before building, so a write landing mid-build queues another
+        with self._schedule_lock:
+            self._scheduled = False
+        try:
+            with self._build_lock, self.app.app_context():
+                self._rebuild()
+        except Exception:
+            logger.exception('Rebuilding the %s snapshot failed', self.name)
+
+    def _on_change(self, sender, **extra):
+        self.refresh()
@@ -0,0 +1,250 @@
+from collections import Counter
+import click
+from sqlalchemy import event, inspect, select, func, update, delete, insert, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import db, Admin, Category, Brand, Product, CatalogStats, BrandStats, CategoryStats
+
+STATS_ID = 1
+TOP_N = 5
+
+
+# ----------- INCREMENTAL MAINTENANCE -----------
+
+def _column_default(attr):
+    default = Product.__table__.c[attr].default
+    return default.arg if default is not None else None
+
+
+def _value(obj, attr, old=False):
+    history = inspect(obj).attrs[attr].history
+    if old and history.deleted:
+        value = history.deleted[0]
+    elif not old and history.added:
+        value = history.added[0]
+    elif history.unchanged:
+        value = history.unchanged[0]
+    else:
+        value = getattr(obj, attr)
+    return _column_default(attr) if value is None else value
+
+
+def _product_contribution(product, old=False):
+    """What one product row adds to the summary counters and brand counts."""
+    counts = Counter(products=1, total_sales=_value(product, 'sales_count', old))
+    counts['in_stock' if _value(product, 'in_stock', old) else 'out_of_stock'] += 1
+    if _value(product, 'is_new', old):
+        counts['new_products'] += 1
+    if _value(product, 'is_sale', old):
+        counts['on_sale'] += 1
+    return counts, _value(product, 'brand_id', old)
+
+
+def _changed(obj, attrs):
+    state = inspect(obj)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+
+def _after_flush(session, flush_context):
+    totals = Counter()
+    brand_deltas = Counter()
+    brand_moves = []
+    new_brands, new_categories = [], []
+
+    for obj in session.new:
+        if isinstance(obj, Product):
+            counts, brand_id = _product_contribution(obj)
+            totals.update(counts)
+            brand_deltas[brand_id] += 1
+        elif isinstance(obj, Brand):
+            totals['brands'] += 1
+            new_brands.append(obj.id)
+        elif isinstance(obj, Category):
+            totals['categories'] += 1
+            new_categories.append(obj.id)
+        elif isinstance(obj, Admin):
+            totals['admins'] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            counts, brand_id = _product_contribution(obj, old=True)
+            totals.subtract(counts)
+            brand_deltas[brand_id] -= 1
+        elif isinstance(obj, Brand):
+            totals['brands'] -= 1
+        elif isinstance(obj, Category):
+            totals['categories'] -= 1
+        elif isinstance(obj, Admin):
+            totals['admins'] -= 1
+
+    for obj in session.dirty:
+        if isinstance(obj, Product) and _changed(obj, ('in_stock', 'is_new', 'is_sale', 'sales_count', 'brand_id')):
+            old_counts, old_brand = _product_contribution(obj, old=True)
+            new_counts, new_brand = _product_contribution(obj)
+            totals.update(new_counts)
+            totals.subtract(old_counts)
+            brand_deltas[old_brand] -= 1
+            brand_deltas[new_brand] += 1
+        elif isinstance(obj, Brand) and _changed(obj, ('category_id',)):
+            brand_moves.append((obj.id, _value(obj, 'category_id', old=True), obj.category_id))
+
+    totals = {k: v for k, v in totals.items() if v}
+    brand_deltas = {k: v for k, v in brand_deltas.items() if v}
+    if not (totals or brand_deltas or brand_moves or new_brands or new_categories):
+        return
+
+    conn = session.connection()
+    if new_categories:
+        conn.execute(pg_insert(CategoryStats).values(
+            [{'category_id': cid, 'product_count': 0} for cid in new_categories]
+        ).on_conflict_do_nothing())
+    if new_brands:
+        conn.execute(pg_insert(BrandStats).values(
+            [{'brand_id': bid, 'product_count': 0} for bid in new_brands]
+        ).on_conflict_do_nothing())
+    # Moves first, so they carry the brand's pre-flush count
+    for brand_id, old_category, new_category in brand_moves:
+        moved = select(BrandStats.product_count).where(BrandStats.brand_id == brand_id).scalar_subquery()
+        _add_to_category(conn, old_category, -moved)
+        _add_to_category(conn, new_category, moved)
+    apply_brand_deltas(conn, brand_deltas)
+    if totals:
+        apply_totals(conn, totals)
+
+
+def apply_brand_deltas(conn, brand_deltas):
+    """Add a {brand id: product count delta} mapping to the brand and
+    category counts."""
+    for brand_id, delta in brand_deltas.items():
+        _add_to_brand(conn, brand_id, delta)
+        category_id = select(Brand.category_id).where(Brand.id == brand_id).scalar_subquery()
+        _add_to_category(conn, category_id, delta)
+
+
+def _add_to_brand(conn, brand_id, delta):
+    stmt = pg_insert(BrandStats).values(brand_id=brand_id, product_count=delta)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[BrandStats.brand_id],
+        set_={'product_count': BrandStats.product_count + stmt.excluded.product_count},
+    ))
+
+
+def _add_to_category(conn, category_id, delta):
+    conn.execute(
+        update(CategoryStats)
+        .where(CategoryStats.category_id == category_id)
+        .values(product_count=CategoryStats.product_count + delta)
+    )
+
+
+def apply_totals(conn, totals):
+    """Add a {column: delta} mapping to the summary row."""
+    table = CatalogStats.__table__
+    conn.execute(
+        table.update()
+        .where(table.c.id == STATS_ID)
+        .values({table.c[name]: table.c[name] + delta for name, delta in totals.items()})
+    )
+
+
+def add_sales(conn, clicks):
+    apply_totals(conn, {'total_sales': clicks})
+
+
+# ----------- RECONCILIATION -----------
+
+def recompute_stats():
+    """Rebuild every summary table from the base tables in one transaction."""
+    session = db.session
+    session.execute(text('LOCK TABLE catalog_stats, brand_stats, category_stats IN EXCLUSIVE MODE'))
+
+    product_totals = session.execute(select(
+        func.count(Product.id),
+        func.count(Product.id).filter(func.coalesce(Product.in_stock, True)),
+        func.count(Product.id).filter(~func.coalesce(Product.in_stock, True)),
+        func.count(Product.id).filter(func.coalesce(Product.is_new, False)),
+        func.count(Product.id).filter(func.coalesce(Product.is_sale, False)),
+        func.coalesce(func.sum(Product.sales_count), 0),
+    )).one()
+    row = {
+        'id': STATS_ID,
+        'categories': session.scalar(select(func.count(Category.id))),
+        'brands': session.scalar(select(func.count(Brand.id))),
+        'admins': session.scalar(select(func.count(Admin.id))),
+        'products': product_totals[0],
+        'in_stock': product_totals[1],
+        'out_of_stock': product_totals[2],
+        'new_products': product_totals[3],
+        'on_sale': product_totals[4],
+        'total_sales': product_totals[5],
+    }
+    session.execute(delete(CatalogStats))
+    session.execute(insert(CatalogStats).values(row))
+
+    session.execute(delete(BrandStats))
+    per_brand = (
+        select(Brand.id, func.count(Product.id))
+        .outerjoin(Product, Product.brand_id == Brand.id)
+        .group_by(Brand.id)
+    )
+    session.execute(insert(BrandStats).from_select(['brand_id', 'product_count'], per_brand))
+
+    session.execute(delete(CategoryStats))
+    per_category = (
+        select(Category.id, func.count(Product.id))
+        .outerjoin(Brand, Brand.category_id == Category.id)
+        .outerjoin(Product, Product.brand_id == Brand.id)
+        .group_by(Category.id)
+    )
+    session.execute(insert(CategoryStats).from_select(['category_id', 'product_count'], per_category))
+    session.commit()
+    return row
+
+
+# ----------- READING -----------
+
+def _json_rows(stmt):
+    rows = stmt.subquery()
+    return select(func.coalesce(func.json_agg(rows.table_valued()), text("'[]'::json"))).scalar_subquery()
+
+
+def dashboard_summary():
+    """Everything the admin dashboard shows, in one query whose cost does
+    not depend on the number of products."""
+    top_brands = _json_rows(
+        select(Brand.name, BrandStats.product_count)
+        .join(Brand, Brand.id == BrandStats.brand_id)
+        .where(BrandStats.product_count > 0)
+        .order_by(BrandStats.product_count.desc())
+        .limit(TOP_N)
+    )
+    top_categories = _json_rows(
+        select(Category.name, CategoryStats.product_count)
+        .join(Category, Category.id == CategoryStats.category_id)
+        .where(CategoryStats.product_count > 0)
+        .order_by(CategoryStats.product_count.desc())
+        .limit(TOP_N)
+    )
+    recent_products = _json_rows(
+        select(Product.id, Product.title, Product.created_at, Product.brand_id)
+        .order_by(Product.created_at.desc(), Product.id.desc())
+        .limit(TOP_N)
+    )
+    stmt = select(
+        CatalogStats.__table__,
+        top_brands.label('top_brands'),
+        top_categories.label('top_categories'),
+        recent_products.label('recent_products'),
+    ).where(CatalogStats.id == STATS_ID)
+    return db.session.execute(stmt).mappings().first()
+
+
+def init_app(app):
+    # db.session outlives any one app; listen once per process
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+    @app.cli.command('recompute-stats')
+    def recompute_stats_command():
+        """Rebuild the dashboard summary tables from scratch."""
+        row = recompute_stats()
+        click.echo(f"Dashboard stats rebuilt: {row['products']} products, {row['brands']} brands")
@@ -0,0 +1,237 @@
+import ipaddress
+import logging
+import os
+import random
+import shutil
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+# Attempts per file, and the first backoff delay (doubled each retry, jittered)
+UPLOAD_ATTEMPTS = 3
+UPLOAD_BACKOFF = 0.5
+
+# Status codes worth another attempt; any other failure is final
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Largest original fetch_original() will download
+MAX_FETCH_BYTES = 20 * 1024 * 1024
+
+
+class StorageError(Exception):
+    def __init__(self, message, status=502, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+def _session(pool_size):
+    # One keep-alive connection per upload worker
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _download(session, url, timeout):
+    try:
+        # A redirect could lead anywhere; fetch_original only vetted this url
+        with session.get(url, stream=True, timeout=timeout, allow_redirects=False) as response:
+            if response.status_code != 200:
+                raise StorageError(
+                    f'Fetch failed with status {response.status_code}',
+                    status=response.status_code,
+                    retryable=response.status_code in RETRY_STATUSES,
+                )
+            data = response.raw.read(MAX_FETCH_BYTES + 1, decode_content=True)
+    except requests.RequestException as e:
+        raise StorageError(str(e), retryable=True)
+    if len(data) > MAX_FETCH_BYTES:
+        raise StorageError('File too large', status=413)
+    return data
+
+
+class HttpStorage:
+    """PUTs each file to ``{endpoint}/{name}`` through a shared session.
+    Any server accepting plain PUTs will do as a stand-in for BunnyCDN."""
+
+    def __init__(self, endpoint, public_url, headers=None, pool_size=4, timeout=30):
+        self.endpoint = endpoint.rstrip('/')
+        self.public_url = public_url.rstrip('/')
+        self.headers = headers or {}
+        self.session = _session(pool_size)
+        self.timeout = timeout
+
+    def put(self, name, stream):
+        try:
+            response = self.session.put(
+                f'{self.endpoint}/{name}',
+                data=stream,
+                headers={**self.headers, 'Content-Type': 'application/octet-stream'},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise StorageError(str(e), retryable=True)
+        if response.status_code not in (200, 201, 204):
+            raise StorageError(
+                response.text or f'Upload failed with status {response.status_code}',
+                status=response.status_code,
+                retryable=response.status_code in RETRY_STATUSES,
+            )
+        return f'{self.public_url}/{name}'
+
+    def fetch(self, url):
+        return _download(self.session, url, self.timeout)
+
+
+class BunnyStorage(HttpStorage):
+
+    def __init__(self, zone, api_key, pool_size=4, timeout=30):
+        self.configured = bool(api_key)
+        super().__init__(
+            f'https://storage.bunnycdn.com/{zone}',
+            f'https://{zone}.b-cdn.net',
+            headers={'AccessKey': api_key},
+            pool_size=pool_size,
+            timeout=timeout,
+        )
+
+    def put(self, name, stream):
+        if not self.configured:
+            raise StorageError('BUNNY_STORAGE_API_KEY is not set', status=503)
+        return super().put(name, stream)
+
+
+class LocalStorage:
+    """Writes files under a directory; for development, tests and benchmarks."""
+
+    def __init__(self, root, public_url):
+        self.root = root
+        self.public_url = public_url.rstrip('/')
+        self.session = _session(1)
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, name, stream):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            shutil.copyfileobj(stream, f)
+        return f'{self.public_url}/{name}'
+
+    def fetch(self, url):
+        name = secure_filename(url[len(self.public_url) + 1:]) if url.startswith(self.public_url + '/') else ''
+        if not name:
+            return _download(self.session, url, 30)
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+
+class Uploader:
+    """Runs uploads on a bounded thread pool against the configured backend."""
+
+    def __init__(self):
+        self.storage = None
+        self.executor = None
+        self.workers = None
+        self.fetch_hosts = frozenset()
+
+    def init_app(self, app):
+        workers = app.config.get('UPLOAD_WORKERS', 4)
+        self.fetch_hosts = frozenset(app.config.get('STORAGE_FETCH_HOSTS', ()))
+        backend = app.config.get('STORAGE_BACKEND', 'bunny')
+        if backend == 'local':
+            self.storage = LocalStorage(app.config['STORAGE_LOCAL_ROOT'], app.config['STORAGE_PUBLIC_URL'])
+        elif backend == 'http':
+            self.storage = HttpStorage(
+                app.config['STORAGE_HTTP_ENDPOINT'], app.config['STORAGE_PUBLIC_URL'], pool_size=workers
+            )
+        else:
+            self.storage = BunnyStorage(
+                app.config['BUNNY_STORAGE_ZONE'], app.config['BUNNY_STORAGE_API_KEY'], pool_size=workers
+            )
+        # Another create_app() in the process reuses the pool unless it is resized
+        if workers != self.workers:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload')
+            self.workers = workers
+        app.extensions['uploader'] = self
+
+    def _upload(self, name, stream):
+        delay = UPLOAD_BACKOFF
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            stream.seek(0)
+            try:
+                return self.storage.put(name, stream)
+            except StorageError as e:
+                if not e.retryable or attempt == UPLOAD_ATTEMPTS:
+                    raise
+                logger.warning('Upload of %s failed (%s), retrying', name, e)
+            time.sleep(delay * (1 + random.random()))
+            delay *= 2
+
+    def put_many(self, items):
+        """Upload (name, stream) pairs concurrently; returns their URLs in
+        order, raising the first failure."""
+        futures = [self.executor.submit(self._upload, name, stream) for name, stream in items]
+        return [future.result() for future in futures]
+
+    def check_fetch_url(self, url):
+        """Refuse urls the server should not download: product images come
+        from admins and import feeds, so they could name internal services."""
+        if url.startswith(self.storage.public_url + '/'):
+            return
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        if parts.scheme != 'https' or host not in self.fetch_hosts:
+            raise StorageError(f'Not fetching from {host or url!r}: not an allowed https host', status=400)
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 443, type=socket.SOCK_STREAM)}
+        except socket.gaierror as e:
+            raise StorageError(f'Cannot resolve {host}: {e}', retryable=True)
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split('%', 1)[0])
+            if not ip.is_global:
+                raise StorageError(f'Not fetching from {host}: resolves to {ip}', status=400)
+
+    def fetch_original(self, url):
+        self.check_fetch_url(url)
+        delay = UPLOAD_BACKOFF
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                return self.storage.fetch(url)
+            except StorageError as e:
+                if not e.retryable or attempt == UPLOAD_ATTEMPTS:
+                    raise
+            time.sleep(delay * (1 + random.random()))
+            delay *= 2
+
+    def upload_many(self, files):
+        """Upload werkzeug FileStorage objects concurrently. Returns one
+        result dict per file, in order: {'filename', 'url'} or
+        {'filename', 'error', 'status'}."""
+        futures = []
+        for file in files:
+            name = secure_filename(file.filename or '')
+            futures.append((file.filename, self.executor.submit(self._upload, name, file.stream) if name else None))
+
+        results = []
+        for filename, future in futures:
+            if future is None:
+                results.append({'filename': filename, 'error': 'Invalid file name', 'status': 400})
+                continue
+            try:
+                results.append({'filename': filename, 'url': future.result()})
+            except StorageError as e:
+                results.append({'filename': filename, 'error': str(e), 'status': e.status})
+            except OSError as e:
+                results.append({'filename': filename, 'error': str(e), 'status': 500})
+        return results
+
+
+uploader = Uploader()
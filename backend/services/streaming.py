@@ -0,0 +1,91 @@
+from flask import request, current_app, Response, stream_with_context
+from services.pagination import InvalidCursor, encode_cursor, decode_cursor
+from models import db
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows fetched per round trip from the server-side cursor
+STREAM_BATCH_SIZE = 500
+
+NDJSON = 'application/x-ndjson'
+
+
+def page_size(default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    limit = request.args.get('limit', default=default, type=int)
+    return min(max(limit, 1), maximum)
+
+
+def wants_ndjson(req=None):
+    req = req or request
+    return req.args.get('format') == 'ndjson' or req.accept_mimetypes.best == NDJSON
+
+
+def json_lines(items, serialize, ndjson=False):
+    """Encode items one at a time, as a JSON array or as NDJSON."""
+    dumps = current_app.json.dumps
+    if ndjson:
+        for item in items:
+            yield dumps(serialize(item)) + '\n'
+        return
+    yield '['
+    first = True
+    for item in items:
+        yield ('' if first else ',') + dumps(serialize(item))
+        first = False
+    yield ']'
+
+
+def streamed(items, serialize, next_cursor=None):
+    """Wrap a lazy row iterator in a streamed JSON/NDJSON response; the
+    continuation token travels in the X-Next-Cursor header."""
+    ndjson = wants_ndjson()
+    response = Response(
+        stream_with_context(json_lines(items, serialize, ndjson)),
+        mimetype=NDJSON if ndjson else 'application/json',
+    )
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+def stream_by_key(stmt, key_column, serialize, default_limit=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Stream one bounded page of an entity select, walking key_column (a
+    unique, ascending key) with an opaque ?cursor= continuation token.
+
+    Raises InvalidCursor for a token that was not issued here.
+    """
+    limit = page_size(default_limit, maximum)
+    cursor_name = f'key:{key_column.key}'
+    cursor = request.args.get('cursor')
+    if cursor:
+        _, (after,) = decode_cursor(cursor, cursor_name)
+        stmt = stmt.where(key_column > after)
+
+    # The last key of this page and whether anything follows it, from the
+    # index alone, so the token can be sent before the body starts
+    probe = db.session.execute(
+        stmt.with_only_columns(key_column).order_by(key_column).offset(limit - 1).limit(2)
+    ).scalars().all()
+    next_cursor = encode_cursor(cursor_name, [probe[0]]) if len(probe) == 2 else None
+
+    return streamed(stream_rows(stmt.order_by(key_column).limit(limit)), serialize, next_cursor)
+
+
+def stream_rows(stmt):
+    """Entities from a server-side cursor, STREAM_BATCH_SIZE at a time.
+
+    The statement only runs once the body is iterated: the view's session is
+    torn down before a streamed response is sent, taking its cursor along.
+    """
+    yield from db.session.execute(stmt.execution_options(yield_per=STREAM_BATCH_SIZE)).scalars()
+
+
+def offset_cursor(offset):
+    return encode_cursor('offset', [offset])
+
+
+def decode_offset_cursor(token):
+    _, (offset,) = decode_cursor(token, 'offset')
+    if not isinstance(offset, int) or offset < 0:
+        raise InvalidCursor('Malformed cursor')
+    return offset
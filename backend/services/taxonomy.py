@@ -0,0 +1,65 @@
+import itertools
+from collections import namedtuple
+from types import MappingProxyType
+from sqlalchemy import select
+from models import db, Category, Brand
+from services.snapshots import Snapshot
+
+# Same attribute names as the models, so serializers take either
+CategoryEntry = namedtuple('CategoryEntry', 'id name slug')
+BrandEntry = namedtuple('BrandEntry', 'id name slug category_id')
+
+_versions = itertools.count(1)
+
+
+class Taxonomy:
+    """One immutable view of every category and brand. Readers hold on to
+    the instance they got; a write builds a new one and swaps it in."""
+
+    __slots__ = ('version', 'categories', 'brands', 'category_slugs', 'brand_slugs', 'category_brands')
+
+    def __init__(self, categories, brands):
+        self.version = next(_versions)
+        self.categories = MappingProxyType({c.id: c for c in categories})
+        self.brands = MappingProxyType({b.id: b for b in brands})
+        self.category_slugs = MappingProxyType({c.slug: c.id for c in categories})
+        self.brand_slugs = MappingProxyType({b.slug: b.id for b in brands})
+        per_category = {c.id: [] for c in categories}
+        for b in brands:
+            per_category.setdefault(b.category_id, []).append(b.id)
+        self.category_brands = MappingProxyType({cid: tuple(ids) for cid, ids in per_category.items()})
+
+    def brand(self, brand_id):
+        return self.brands.get(brand_id)
+
+    def category_of(self, brand):
+        return self.categories.get(brand.category_id) if brand is not None else None
+
+    def category_id(self, slug):
+        return self.category_slugs.get(slug)
+
+    def brand_ids(self, slugs):
+        return [self.brand_slugs[s] for s in slugs if s in self.brand_slugs]
+
+
+def load_taxonomy():
+    categories = [CategoryEntry(*row) for row in db.session.execute(
+        select(Category.id, Category.name, Category.slug).order_by(Category.id))]
+    brands = [BrandEntry(*row) for row in db.session.execute(
+        select(Brand.id, Brand.name, Brand.slug, Brand.category_id).order_by(Brand.id))]
+    return Taxonomy(categories, brands)
+
+
+# Rebuilt inline by notify_taxonomy_changed (two small queries), ahead of
+# the taxonomy_changed receivers, so they and the writer's next request
+# already resolve the new slugs
+taxonomy_snapshot = Snapshot('taxonomy', load_taxonomy, background=False)
+
+
+def current():
+    """The current Taxonomy; loaded on first use, never queried after."""
+    return taxonomy_snapshot.get()
+
+
+def init_app(app):
+    taxonomy_snapshot.init_app(app, app.config.get('TAXONOMY_SNAPSHOT_MAX_AGE'))
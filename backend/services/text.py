@@ -0,0 +1,18 @@
+import re
+from unidecode import unidecode
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    # Accent-free lowercase ASCII, the same folding slugs use
+    return unidecode(text or '').lower()
+
+
+def slugify(text):
+    text = _NON_ALNUM.sub('-', normalize(text))
+    return text.strip('-')
+
+
+def tokenize(text):
+    return [t for t in _NON_ALNUM.split(normalize(text)) if t]
@@ -0,0 +1,97 @@
+"""N+1 guard for the listing endpoints.
+
+Runs against the database in TEST_DATABASE_URL (or DATABASE_URL) with a
+seeded catalog, e.g. `python seeds.py --products 1000`, from backend/:
+
+    TEST_DATABASE_URL=postgresql://... python -m pytest tests
+"""
+import os
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import OperationalError
+
+DATABASE_URL = os.environ.get('TEST_DATABASE_URL') or os.environ.get('DATABASE_URL')
+
+# (url, page size parameter)
+LISTINGS = [
+    ('/api/products/sale', 'limit'),
+    ('/api/products/minifilter?brand_id={brand_id}', 'limit'),
+    ('/api/products/filter?sort_by=newest', 'limit'),
+    ('/api/products/filter?paginate=cursor&facets=none', 'limit'),
+    ('/api/products/search?query=a', 'limit'),
+    ('/api/products/bundle?ids={product_ids}', None),
+    ('/api/admin/products', 'per_page'),
+    ('/api/admin/products?brand_id={brand_id}&paginate=cursor', 'per_page'),
+]
+
+
+@contextmanager
+def count_queries(engine):
+    """Count the statements sent to the database inside the block."""
+    counter = {'count': 0}
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['count'] += 1
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+
+
+@pytest.fixture(scope='module')
+def app():
+    if not DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    from app import create_app
+    from models import db, Product
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': DATABASE_URL,
+        'SQLALCHEMY_BINDS': {},
+        # Relationships not loaded up front raise instead of querying per row
+        'SQLALCHEMY_STRICT_LOADING': True,
+        'CACHE_ENABLED': False,
+        'COLUMNAR_INDEX': False,
+    })
+    with app.app_context():
+        try:
+            products = db.session.scalar(select(func.count()).select_from(Product))
+        except OperationalError as e:
+            pytest.skip(f'database unavailable: {e}')
+        if products < 100:
+            pytest.skip('needs a seeded catalog of at least 100 products')
+        brand_id = db.session.scalar(
+            select(Product.brand_id).group_by(Product.brand_id).order_by(func.count().desc()).limit(1))
+        product_ids = db.session.scalars(select(Product.id).order_by(Product.id).limit(50)).all()
+        app.config['TEST_URL_VALUES'] = {
+            'brand_id': brand_id, 'product_ids': ','.join(map(str, product_ids)),
+        }
+    return app
+
+
+def query_count(app, url):
+    from models import db
+    with app.app_context(), count_queries(db.engine) as counter:
+        response = app.test_client().get(url)
+        response.get_data()
+    assert response.status_code == 200, f'{url} returned {response.status_code}'
+    return counter['count']
+
+
+@pytest.mark.parametrize('url, size_param', LISTINGS)
+def test_query_count_does_not_grow_with_page_size(app, url, size_param):
+    values = app.config['TEST_URL_VALUES']
+    url = url.format(**values)
+    # Lazily built in-process state (taxonomy, search index) loads on first use
+    query_count(app, url)
+    if size_param is None:
+        # Batch endpoints: one id against many
+        single = url.replace(values['product_ids'], values['product_ids'].split(',')[0])
+        counts = {1: query_count(app, single), 50: query_count(app, url)}
+    else:
+        separator = '&' if '?' in url else '?'
+        counts = {size: query_count(app, f'{url}{separator}{size_param}={size}') for size in (1, 50)}
+    assert len(set(counts.values())) == 1, f'{url} query count grows with page size: {counts}'
@@ -22,17 +22,18 @@ const Index = () => {
   const [onSale, setOnSale] = useState([]);
 
   useEffect(() => {
-    fetchNewProducts();
-    fetchBestSellers();
-    fetchOnSale();
+    fetchHome();
   }, []);
 
-  const fetchNewProducts = async () => {
+  // All three lists in one request, served from a prebuilt snapshot
+  const fetchHome = async () => {
     try {
-      const res = await axios.get(`${API_URL}/products/newest`);
-      setNewProducts(res.data);
+      const res = await axios.get(`${API_URL}/home`);
+      setNewProducts(res.data.newest);
+      setBestSellers(res.data.bestsellers);
+      setOnSale(res.data.sale);
     } catch (error) {
-      console.error('Error fetching new products:', error);
+      console.error('Error fetching home page:', error);
     }
   };
   
@@ -40,24 +41,6 @@ const Index = () => {
     navigate(`/products/${product.id}/${createSlug(product.title)}`);
   }
 
-  const fetchBestSellers = async () => {
-    try {
-      const res = await axios.get(`${API_URL}/products/bestsellers`);
-      setBestSellers(res.data);
-    } catch (err) {
-      console.log('Error fetching best sellers:', err);
-    }
-  }
-
-  const fetchOnSale = async () => {
-    try {
-      const res = await axios.get(`${API_URL}/products/sale`);
-      setOnSale(res.data);
-    } catch (err) {
-      console.log('Error fetching on sale:', err);
-    }
-  }
-
   const handleBrowseAll = () => {
     navigate('/products?category=all')
   }
@@ -42,19 +42,20 @@ const ProductDetails = () => {
 
   useEffect(() => {
     fetchProduct();
-    fetchSimilarProducts();
   }, [id]);
 
   useEffect(() => {
     window.scrollTo(0, 0);
   })
 
+  // Detail and similar products in one request
   const fetchProduct = async () => {
     try {
       setLoading(true);
       setError(null);
-      const response = await axios.get(`${API_URL}/products/${id}`);
-      setProduct(response.data);
+      const response = await axios.get(`${API_URL}/products/${id}/bundle`);
+      setProduct(response.data.product);
+      setSimilarProducts(response.data.similar);
     } catch (err) {
       setError(err.response?.data?.message || 'Failed to fetch product');
     } finally {
@@ -63,20 +64,6 @@ const ProductDetails = () => {
   };
 
 
-  const fetchSimilarProducts = async () => {
-    try {
-      setLoading(true);
-      setError(null);
-      const response = await axios.get(`${API_URL}/products/${id}/similar`);
-      setSimilarProducts(response.data);
-    } catch (err) {
-      setError(err.response?.data?.message || 'Failed to fetch similar products');
-    } finally {
-      setLoading(false);
-    }
-  };
-
-
   const handleShare = async () => {
     if (navigator.share) {
       try {
@@ -63,7 +63,8 @@ const BrandManager = () => {
         headers: {
           'Content-Type': 'application/json',
           'X-CSRF-TOKEN': csrfToken
-        }
+        },
+        withCredentials: true
       }
     );
       setNewBrand("");
@@ -85,7 +86,10 @@ const BrandManager = () => {
     
     setLoading(true);
     try {
-      await axios.delete(`${API_URL}/admin/brands/${id}`);
+      await axios.delete(`${API_URL}/admin/brands/${id}`, {
+        headers: { 'X-CSRF-TOKEN': Cookies.get('csrf_access_token') },
+        withCredentials: true
+      });
       fetchBrands();
       setError('');
       setSuccess('Brand deleted successfully!');
@@ -161,19 +161,33 @@ const ProductManager = () => {
   };
 
   const uploadImages = async () => {
+    const newFiles = imageFiles.filter(file => typeof file !== 'string');
+    const uploaded = new Map();
+    if (newFiles.length > 0) {
+      // One request for all new images; the server uploads them in parallel
+      const formData = new FormData();
+      newFiles.forEach(file => formData.append('files', file));
+      try {
+        const res = await axios.post(`${API_URL}/admin/upload/batch`, formData, {
+          withCredentials: true,
+          headers: { 'X-CSRF-TOKEN': Cookies.get('csrf_access_token') },
+          validateStatus: status => status === 201 || status === 207,
+        });
+        res.data.results.forEach((result, i) => {
+          if (result.url) uploaded.set(newFiles[i], result.url);
+          else console.error('Error uploading image:', result.filename, result.error);
+        });
+      } catch (error) {
+        console.error('Error uploading images:', error);
+      }
+    }
+
     const urls = [];
     for (let file of imageFiles) {
       if (typeof file === 'string') {
         urls.push(file); // Already a link
-      } else {
-        const formData = new FormData();
-        formData.append('file', file);
-        try {
-          const res = await axios.post(`${API_URL}/admin/upload`, formData);
-          urls.push(res.data.url);
-        } catch (error) {
-          console.error('Error uploading image:', error);
-        }
+      } else if (uploaded.has(file)) {
+        urls.push(uploaded.get(file));
       }
     }
     return urls;
@@ -193,7 +207,10 @@ const ProductManager = () => {
       if (data.price === "") data.price = null;
       if (data.original_price === "") data.original_price = null;
 
-      const res = await axios.post(`${API_URL}/admin/products`, data);
+      const res = await axios.post(`${API_URL}/admin/products`, data, {
+        withCredentials: true,
+        headers: { 'X-CSRF-TOKEN': Cookies.get('csrf_access_token') }
+      });
       alert('Product added: ' + res.data.title);
       resetForm();
       fetchProducts();
@@ -212,7 +229,8 @@ const ProductManager = () => {
       const data = { ...form, images: imageUrls.length ? imageUrls : form.images };
       
       const res = await axios.put(`${API_URL}/admin/products/${id}`, data, {
-        withCredentials: true
+        withCredentials: true,
+        headers: { 'X-CSRF-TOKEN': Cookies.get('csrf_access_token') }
       });
         
       alert('Product updated: ' + res.data.title);